@@ -1,11 +1,29 @@
 # core/database.py
 import os
+import time
+import threading
 import psycopg2
-from psycopg2.extensions import ISOLATION_LEVEL_AUTOCOMMIT
+from contextlib import contextmanager
+from psycopg2 import pool as pg_pool
+from psycopg2.extensions import ISOLATION_LEVEL_AUTOCOMMIT, cursor as BaseCursor
 from dotenv import load_dotenv
 
+from core import metrics
+
 load_dotenv()  # Load environment variables from .env file
 
+# Content types stored in the embeddings table, each with its own partial vector index
+VECTOR_CONTENT_TYPES = ('euda', 'macro', 'formula')
+
+# Index expression, operator class and distance operator per quantization mode.
+# Quantized indexes hold a compact copy of each vector for candidate retrieval;
+# the full-precision column is kept for re-ranking the candidates.
+VECTOR_QUANTIZATIONS = {
+    'none': ('{}', 'vector_cosine_ops', '<=>'),
+    'halfvec': ('({}::halfvec(1536))', 'halfvec_cosine_ops', '<=>'),
+    'binary': ('(binary_quantize({})::bit(1536))', 'bit_hamming_ops', '<~>')
+}
+
 class Database:
     def __init__(self):
         self.conn = None
@@ -89,10 +107,15 @@ class Database:
                     data_sensitivity VARCHAR(50),
                     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
                     description TEXT,
-                    purpose TEXT
+                    purpose TEXT,
+                    dependency_metrics JSONB,
+                    content_hash TEXT
                 )
             """)
             
+            # Structural metrics of the formula dependency graph, for tables created before them
+            cursor.execute("ALTER TABLE eudas ADD COLUMN IF NOT EXISTS dependency_metrics JSONB")
+            
             # Create table for storing macros
             cursor.execute("""
                 CREATE TABLE IF NOT EXISTS macros (
@@ -101,7 +124,8 @@ class Database:
                     macro_name VARCHAR(255),
                     macro_code TEXT,
                     purpose TEXT,
-                    complexity_score FLOAT
+                    complexity_score FLOAT,
+                    content_hash TEXT
                 )
             """)
             
@@ -113,10 +137,28 @@ class Database:
                     worksheet VARCHAR(255),
                     cell_reference VARCHAR(20),
                     formula TEXT,
-                    purpose TEXT
+                    purpose TEXT,
+                    normalized_formula TEXT,
+                    cell_ranges TEXT,
+                    cell_count INTEGER DEFAULT 1,
+                    content_hash TEXT
                 )
             """)
             
+            # A formula row describes a group of cells sharing one normalized (R1C1) formula;
+            # add the group columns to tables created before formulas were grouped
+            cursor.execute("""
+                ALTER TABLE formulas
+                    ADD COLUMN IF NOT EXISTS normalized_formula TEXT,
+                    ADD COLUMN IF NOT EXISTS cell_ranges TEXT,
+                    ADD COLUMN IF NOT EXISTS cell_count INTEGER DEFAULT 1
+            """)
+            
+            # Hash of the content each row's embedding is generated from, so that a
+            # re-stored EUDA only re-embeds what changed; rows stored before have none
+            for table in ('eudas', 'macros', 'formulas'):
+                cursor.execute(f"ALTER TABLE {table} ADD COLUMN IF NOT EXISTS content_hash TEXT")
+            
             # Create table for storing vector embeddings
             cursor.execute("""
                 CREATE TABLE IF NOT EXISTS embeddings (
@@ -124,20 +166,409 @@ class Database:
                     euda_id INTEGER REFERENCES eudas(id),
                     content_type VARCHAR(50),
                     content_id INTEGER,
-                    embedding VECTOR(1536)
+                    embedding VECTOR(1536),
+                    content_hash TEXT
+                )
+            """)
+            
+            # VBA code stored once per distinct module; macros rows link to it by code_hash
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS macro_code (
+                    code_hash TEXT PRIMARY KEY,
+                    macro_code TEXT NOT NULL,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            """)
+            
+            # Macro and formula embeddings are content-addressed: one row per distinct
+            # content_hash, shared by every macros or formulas row with that hash
+            cursor.execute("ALTER TABLE embeddings ADD COLUMN IF NOT EXISTS content_hash TEXT")
+            cursor.execute("ALTER TABLE macros ADD COLUMN IF NOT EXISTS code_hash TEXT")
+            self._migrate_content_addressing()
+            cursor.execute("""
+                CREATE UNIQUE INDEX IF NOT EXISTS embeddings_content_hash_idx
+                ON embeddings (content_type, content_hash) WHERE content_hash IS NOT NULL
+            """)
+            
+            # Work queue for distributed scans: one row per workbook to scan, claimed
+            # by workers with FOR UPDATE SKIP LOCKED and held under a renewable lease
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS scan_jobs (
+                    id BIGSERIAL PRIMARY KEY,
+                    file_path TEXT NOT NULL,
+                    status VARCHAR(20) NOT NULL DEFAULT 'pending',
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    max_attempts INTEGER NOT NULL DEFAULT 3,
+                    worker_id TEXT,
+                    available_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+                    lease_expires_at TIMESTAMPTZ,
+                    heartbeat_at TIMESTAMPTZ,
+                    enqueued_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+                    started_at TIMESTAMPTZ,
+                    finished_at TIMESTAMPTZ,
+                    euda_id INTEGER REFERENCES eudas(id),
+                    error TEXT,
+                    elapsed FLOAT
                 )
             """)
+            # A workbook is queued at most once until its job finishes
+            cursor.execute("""
+                CREATE UNIQUE INDEX IF NOT EXISTS scan_jobs_active_path_idx
+                ON scan_jobs (file_path) WHERE status IN ('pending', 'running')
+            """)
+            cursor.execute("""
+                CREATE INDEX IF NOT EXISTS scan_jobs_pending_idx
+                ON scan_jobs (available_at, id) WHERE status = 'pending'
+            """)
+            cursor.execute("""
+                CREATE INDEX IF NOT EXISTS scan_jobs_lease_idx
+                ON scan_jobs (lease_expires_at) WHERE status = 'running'
+            """)
+            
+            # Liveness and throughput counters of the queue workers
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS scan_workers (
+                    worker_id TEXT PRIMARY KEY,
+                    hostname TEXT,
+                    pid INTEGER,
+                    started_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+                    heartbeat_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+                    jobs_done INTEGER NOT NULL DEFAULT 0,
+                    jobs_failed INTEGER NOT NULL DEFAULT 0,
+                    busy_seconds FLOAT NOT NULL DEFAULT 0,
+                    bytes_processed BIGINT NOT NULL DEFAULT 0
+                )
+            """)
+            
+            # Lookup indexes for joins from embeddings back to their content
+            cursor.execute("CREATE INDEX IF NOT EXISTS embeddings_content_idx ON embeddings (content_type, content_id)")
+            cursor.execute("CREATE INDEX IF NOT EXISTS embeddings_euda_id_idx ON embeddings (euda_id)")
+            cursor.execute("CREATE INDEX IF NOT EXISTS macros_euda_id_idx ON macros (euda_id)")
+            cursor.execute("CREATE INDEX IF NOT EXISTS formulas_euda_id_idx ON formulas (euda_id)")
+            # Clone lookups: which EUDAs link to a module or a formula
+            cursor.execute("CREATE INDEX IF NOT EXISTS macros_code_hash_idx ON macros (code_hash)")
+            cursor.execute("CREATE INDEX IF NOT EXISTS macros_content_hash_idx ON macros (content_hash)")
+            cursor.execute("CREATE INDEX IF NOT EXISTS formulas_content_hash_idx ON formulas (content_hash)")
+            # Re-stored EUDAs are looked up by file
+            cursor.execute("CREATE INDEX IF NOT EXISTS eudas_file_path_idx ON eudas (file_path)")
             
             self.conn.commit()
             cursor.close()
             print("Tables created successfully")
-            return True
+            
+            # Approximate nearest neighbour indexes on the embeddings
+            return self.create_vector_indexes()
         except (Exception, psycopg2.DatabaseError) as error:
             print(f"Error creating tables: {error}")
             return False
     
+    def _migrate_content_addressing(self):
+        """Move macros and formulas stored one copy per row to the content-addressed layout
+        
+        Every statement only touches rows still in the old layout, so running
+        it again is a no-op. The migration runs as one transaction: if it
+        fails part way, the old layout is left as it was.
+        """
+        self.conn.autocommit = False
+        try:
+            with self.conn, self.conn.cursor() as cursor:
+                # Code stored inline moves to macro_code, keyed by the SHA-256 of the code
+                cursor.execute("""
+                    UPDATE macros SET code_hash = encode(sha256(convert_to(macro_code, 'UTF8')), 'hex')
+                    WHERE macro_code IS NOT NULL AND code_hash IS NULL
+                """)
+                cursor.execute("""
+                    INSERT INTO macro_code (code_hash, macro_code)
+                    SELECT DISTINCT ON (code_hash) code_hash, macro_code FROM macros
+                    WHERE macro_code IS NOT NULL AND code_hash IS NOT NULL
+                    ON CONFLICT (code_hash) DO NOTHING
+                """)
+                # Only code already in macro_code is dropped; rows an older writer adds
+                # meanwhile keep their code until the next run moves it
+                cursor.execute("""
+                    UPDATE macros m SET macro_code = NULL
+                    FROM macro_code c
+                    WHERE m.code_hash = c.code_hash AND m.macro_code IS NOT NULL
+                """)
+                
+                rekeyed = 0
+                for content_type, table in (('macro', 'macros'), ('formula', 'formulas')):
+                    # Rows stored before content hashes existed get a hash of their own
+                    cursor.execute(f"UPDATE {table} SET content_hash = 'row:' || id WHERE content_hash IS NULL")
+                    cursor.execute(f"""
+                        UPDATE embeddings emb SET content_hash = t.content_hash, euda_id = NULL, content_id = NULL
+                        FROM {table} t
+                        WHERE emb.content_type = %s AND emb.content_id = t.id AND emb.content_hash IS NULL
+                    """, (content_type,))
+                    rekeyed += cursor.rowcount
+                
+                # Keep one embedding per content hash; only re-keyed rows can be duplicates
+                if rekeyed:
+                    cursor.execute("""
+                        DELETE FROM embeddings a USING embeddings b
+                        WHERE a.content_hash IS NOT NULL AND a.content_type = b.content_type
+                          AND a.content_hash = b.content_hash AND a.id > b.id
+                    """)
+        finally:
+            self.conn.autocommit = True
+    
+    def create_vector_indexes(self, method=None, content_types=VECTOR_CONTENT_TYPES, rebuild=False,
+                              concurrently=False, quantization=None):
+        """Create one partial ANN index on embeddings.embedding per content type"""
+        method = (method or os.getenv("VECTOR_INDEX_METHOD", "hnsw")).lower()
+        if method not in ('hnsw', 'ivfflat'):
+            print(f"Unknown vector index method: {method}")
+            return False
+        
+        quantization = (quantization or os.getenv("VECTOR_QUANTIZATION", "none")).lower()
+        if quantization not in VECTOR_QUANTIZATIONS:
+            print(f"Unsupported vector quantization for PostgreSQL: {quantization}")
+            return False
+        expression, opclass, _ = VECTOR_QUANTIZATIONS[quantization]
+        
+        try:
+            cursor = self.conn.cursor()
+            for content_type in content_types:
+                index_name = f"embeddings_{content_type}_{method}_idx"
+                if quantization != 'none':
+                    index_name = f"embeddings_{content_type}_{method}_{quantization}_idx"
+                
+                if rebuild:
+                    cursor.execute(f"DROP INDEX {'CONCURRENTLY ' if concurrently else ''}IF EXISTS {index_name}")
+                
+                if method == 'hnsw':
+                    options = "m = %d, ef_construction = %d" % (
+                        int(os.getenv("HNSW_M", "16")),
+                        int(os.getenv("HNSW_EF_CONSTRUCTION", "64"))
+                    )
+                else:
+                    # IVFFlat clusters existing rows, so size the lists from the data:
+                    # rows / 1000 up to a million rows, sqrt(rows) beyond that
+                    cursor.execute("SELECT COUNT(*) FROM embeddings WHERE content_type = %s", (content_type,))
+                    rows = cursor.fetchone()[0]
+                    if rows == 0:
+                        print(f"Skipping IVFFlat index for '{content_type}': no embeddings to train on yet")
+                        continue
+                    lists = max(1, rows // 1000) if rows <= 1000000 else int(rows ** 0.5)
+                    options = f"lists = {lists}"
+                
+                # The partial predicate matches the content_type filter of the search queries
+                cursor.execute(f"""
+                    CREATE INDEX {'CONCURRENTLY ' if concurrently else ''}IF NOT EXISTS {index_name}
+                    ON embeddings USING {method} ({expression.format('embedding')} {opclass})
+                    WITH ({options})
+                    WHERE content_type = %s
+                """, (content_type,))
+            
+            self.conn.commit()
+            cursor.close()
+            print(f"Vector indexes ({method}, quantization {quantization}) created successfully")
+            return True
+        except (Exception, psycopg2.DatabaseError) as error:
+            print(f"Error creating vector indexes: {error}")
+            return False
+    
     def close(self):
         """Close the database connection"""
         if self.conn:
             self.conn.close()
-            print("Database connection closed")
\ No newline at end of file
+            print("Database connection closed")
+
+def _statement_kind(query):
+    """First keyword of a statement, used as the metrics label"""
+    if isinstance(query, bytes):
+        query = query.decode('utf-8', 'replace')
+    if not isinstance(query, str):
+        return 'COMPOSED'
+    words = query.split(None, 1)
+    return words[0].upper() if words else 'EMPTY'
+
+class InstrumentedCursor(BaseCursor):
+    """Cursor that records latency, row counts and failures of every statement"""
+    
+    def execute(self, query, vars=None):
+        kind = _statement_kind(query)
+        with metrics.timer('db_statement_seconds', statement=kind):
+            result = super().execute(query, vars)
+        metrics.increment('db_rows_total', max(self.rowcount, 0), statement=kind)
+        return result
+    
+    def executemany(self, query, vars_list):
+        kind = _statement_kind(query)
+        with metrics.timer('db_statement_seconds', statement=kind):
+            result = super().executemany(query, vars_list)
+        metrics.increment('db_rows_total', max(self.rowcount, 0), statement=kind)
+        return result
+    
+    def copy_expert(self, sql, file, size=8192):
+        with metrics.timer('db_statement_seconds', statement='COPY'):
+            result = super().copy_expert(sql, file, size)
+        metrics.increment('db_rows_total', max(self.rowcount, 0), statement='COPY')
+        return result
+
+class DatabasePool:
+    """Thread-safe connection pool for the EUDA database with health checks and reconnection"""
+    
+    _shared = None
+    _shared_pid = None
+    _shared_lock = threading.Lock()
+    
+    def __init__(self, database=None, min_size=None, max_size=None,
+                 statement_timeout_ms=None, health_check_interval=None, checkout_timeout=None):
+        self.database = database or Database()
+        self.min_size = min_size if min_size is not None else int(os.getenv("DB_POOL_MIN", "1"))
+        self.max_size = max_size if max_size is not None else int(os.getenv("DB_POOL_MAX", "10"))
+        self.statement_timeout_ms = (statement_timeout_ms if statement_timeout_ms is not None
+                                     else int(os.getenv("DB_STATEMENT_TIMEOUT_MS", "60000")))
+        self.health_check_interval = (health_check_interval if health_check_interval is not None
+                                      else float(os.getenv("DB_HEALTH_CHECK_INTERVAL", "30")))
+        self.checkout_timeout = (checkout_timeout if checkout_timeout is not None
+                                 else float(os.getenv("DB_CHECKOUT_TIMEOUT", "30")))
+        
+        self._pool = None
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(self.max_size)
+        self._local = threading.local()
+        self._last_used = {}
+    
+    @classmethod
+    def shared(cls):
+        """Return the process-wide pool, creating a fresh one after a fork"""
+        with cls._shared_lock:
+            if cls._shared is None or cls._shared_pid != os.getpid():
+                cls._shared = cls()
+                cls._shared_pid = os.getpid()
+            return cls._shared
+    
+    def _connection_kwargs(self):
+        db = self.database
+        kwargs = {
+            'host': db.host,
+            'port': db.port,
+            'user': db.user,
+            'password': db.password,
+            'database': db.dbname,
+            'options': f"-c statement_timeout={self.statement_timeout_ms}"
+        }
+        # Only pay for per-statement timing when metrics are being collected
+        if metrics.registry.enabled:
+            kwargs['cursor_factory'] = InstrumentedCursor
+        return kwargs
+    
+    def _get_pool(self):
+        """Create the underlying pool on first use"""
+        with self._lock:
+            if self._pool is None:
+                try:
+                    self._pool = pg_pool.ThreadedConnectionPool(
+                        self.min_size, self.max_size, **self._connection_kwargs()
+                    )
+                except psycopg2.OperationalError as error:
+                    # Create the database if it doesn't exist, then retry once
+                    if "does not exist" not in str(error):
+                        raise
+                    self.database._create_database()
+                    self._pool = pg_pool.ThreadedConnectionPool(
+                        self.min_size, self.max_size, **self._connection_kwargs()
+                    )
+            return self._pool
+    
+    def _is_healthy(self, conn):
+        """Check a connection that has been idle longer than the health check interval"""
+        if conn.closed:
+            return False
+        idle = time.monotonic() - self._last_used.get(id(conn), 0)
+        if idle < self.health_check_interval:
+            return True
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute("SELECT 1")
+            conn.rollback()
+            return True
+        except (psycopg2.OperationalError, psycopg2.InterfaceError):
+            return False
+    
+    def _checkout(self, retries=3):
+        """Take a healthy connection from the pool, reconnecting if needed"""
+        if not self._slots.acquire(timeout=self.checkout_timeout):
+            raise pg_pool.PoolError(f"No database connection available after {self.checkout_timeout}s")
+        
+        try:
+            pool = self._get_pool()
+            for attempt in range(retries + 1):
+                try:
+                    conn = pool.getconn()
+                except psycopg2.OperationalError:
+                    if attempt == retries:
+                        raise
+                    time.sleep(min(5.0, 0.2 * (2 ** attempt)))
+                    continue
+                
+                if self._is_healthy(conn):
+                    return conn
+                
+                # Drop the dead connection; the pool opens a new one next time
+                self._last_used.pop(id(conn), None)
+                pool.putconn(conn, close=True)
+            raise psycopg2.OperationalError("Could not obtain a healthy database connection")
+        except Exception:
+            self._slots.release()
+            raise
+    
+    def _checkin(self, conn, broken=False):
+        """Return a connection to the pool, discarding it if it is broken"""
+        try:
+            if broken or conn.closed:
+                self._last_used.pop(id(conn), None)
+                self._pool.putconn(conn, close=True)
+            else:
+                self._last_used[id(conn)] = time.monotonic()
+                self._pool.putconn(conn)
+        finally:
+            self._slots.release()
+    
+    @contextmanager
+    def connection(self):
+        """Check out a connection for the current thread; commit on success, roll back on error"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            # Nested use in the same thread shares the outer transaction
+            yield conn
+            return
+        
+        conn = self._checkout()
+        self._local.conn = conn
+        broken = False
+        try:
+            yield conn
+            conn.commit()
+        except Exception as error:
+            broken = isinstance(error, (psycopg2.OperationalError, psycopg2.InterfaceError))
+            if not conn.closed:
+                try:
+                    conn.rollback()
+                except psycopg2.Error:
+                    broken = True
+            raise
+        finally:
+            self._local.conn = None
+            self._checkin(conn, broken)
+    
+    @contextmanager
+    def cursor(self):
+        """Check out a connection and yield a cursor in a single transaction"""
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            try:
+                yield cursor
+            finally:
+                cursor.close()
+    
+    def close(self):
+        """Close all pooled connections"""
+        with self._lock:
+            if self._pool is not None:
+                self._pool.closeall()
+                self._pool = None
+                self._last_used.clear()
+                print("Database connection pool closed")
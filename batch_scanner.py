@@ -0,0 +1,250 @@
+# core/batch_scanner.py
+import os
+import sys
+import json
+import time
+import argparse
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from core.excel_analyzer import ExcelAnalyzer
+from core.macro_extractor import MacroExtractor
+from core.workbook_reader import WorkbookReader
+from core.fingerprint_store import FingerprintStore, content_digest
+from core import metrics
+from config.settings import SCAN_MAX_WORKERS, SCAN_CACHE_PATH
+
+EXCEL_EXTENSIONS = ('.xls', '.xlsx', '.xlsm')
+
+
+def scan_file(file_path, include_details=False, max_formulas=None, fingerprint=False):
+    """Analyze a single workbook and return its combined summary
+
+    With fingerprint the content digest of the workbook is returned as
+    well, taken from the already open package.
+    """
+    started = time.perf_counter()
+    result = {
+        'file_path': file_path,
+        'summary': None,
+        'error': None
+    }
+    # The workbook is opened and indexed once and shared by the analyzer and the extractor
+    reader = WorkbookReader(file_path)
+
+    try:
+        # Analyze the workbook structure and formulas
+        analyzer = ExcelAnalyzer(file_path, max_formulas=max_formulas, reader=reader)
+        if not analyzer.analyze():
+            result['error'] = analyzer.error
+            return result
+
+        summary = analyzer.get_summary()
+        if include_details:
+            summary['formulas'] = analyzer.formulas
+            summary['formula_groups'] = analyzer.formula_groups
+            summary['external_connections'] = analyzer.external_connections
+
+        # Extract and analyze macros for macro-enabled workbooks; an .xlsm
+        # without a VBA project simply has no macros
+        if analyzer.has_macros and reader.has_part('xl/vbaProject.bin'):
+            extractor = MacroExtractor(file_path, reader=reader)
+            if extractor.extract_macros():
+                extractor.analyze_macros()
+            elif extractor.error:
+                result['error'] = extractor.error
+
+            macro_summary = extractor.get_summary()
+            if not include_details:
+                macro_summary.pop('macros', None)
+            summary['macro_summary'] = macro_summary
+            if include_details:
+                summary['macros'] = extractor.macros
+
+        result['summary'] = summary
+        if fingerprint:
+            result['digest'] = content_digest(file_path, reader)
+    except Exception as e:
+        result['error'] = f"Error scanning file: {str(e)}"
+    finally:
+        reader.close()
+        result['elapsed'] = time.perf_counter() - started
+        # Hand this file's metrics back to the parent process
+        if metrics.registry.enabled:
+            result['metrics'] = metrics.registry.snapshot(reset=True)
+
+    return result
+
+
+class PortfolioScanner:
+    def __init__(self, max_workers=None, include_details=False, max_pending=None, max_formulas=None,
+                 fingerprint_store=None):
+        """Initialize the scanner with a process pool configuration"""
+        self.max_workers = max_workers or SCAN_MAX_WORKERS
+        self.include_details = include_details
+        # Cap on formula records kept per workbook so giant files fit in a worker
+        self.max_formulas = max_formulas
+        # With a FingerprintStore unchanged workbooks are served their previous result
+        self.fingerprint_store = fingerprint_store
+        self._options = FingerprintStore.make_options(include_details=include_details, max_formulas=max_formulas)
+        # Bound the number of submitted-but-unfinished files so huge
+        # portfolios do not queue every path in the pool at once
+        self.max_pending = max_pending or self.max_workers * 4
+
+    def discover(self, source):
+        """Yield Excel files from a directory tree, a manifest file or a list of paths"""
+        if isinstance(source, (list, tuple, set)):
+            for path in source:
+                yield path
+        elif os.path.isdir(source):
+            yield from self._walk_directory(source)
+        elif os.path.isfile(source):
+            yield from self._read_manifest(source)
+        else:
+            raise FileNotFoundError(f"Scan source not found: {source}")
+
+    def _walk_directory(self, directory):
+        """Walk a directory tree and yield Excel files"""
+        for root, dirs, files in os.walk(directory):
+            dirs.sort()
+            for filename in sorted(files):
+                # Skip Office lock files such as ~$Book1.xlsx
+                if filename.startswith('~$'):
+                    continue
+                if os.path.splitext(filename)[1].lower() in EXCEL_EXTENSIONS:
+                    yield os.path.join(root, filename)
+
+    def _read_manifest(self, manifest_path):
+        """Read a manifest with one workbook path per line"""
+        base_dir = os.path.dirname(os.path.abspath(manifest_path))
+        with open(manifest_path, 'r', encoding='utf-8') as f:
+            for line in f:
+                path = line.strip()
+                if not path or path.startswith('#'):
+                    continue
+                if not os.path.isabs(path):
+                    path = os.path.join(base_dir, path)
+                yield path
+
+    def scan(self, source, callback=None):
+        """Scan workbooks in parallel and yield results as they finish"""
+        paths = iter(self.discover(source))
+        store = self.fingerprint_store
+
+        with ProcessPoolExecutor(max_workers=self.max_workers) as executor:
+            pending = {}
+            # Results of unchanged workbooks, served without a worker
+            ready = deque()
+
+            def submit_next():
+                for path in paths:
+                    fingerprint = None
+                    if store:
+                        started = time.perf_counter()
+                        cached, fingerprint = store.lookup(path, self._options)
+                        if cached:
+                            cached.update(cached=True, elapsed=time.perf_counter() - started)
+                            ready.append(cached)
+                            return True
+                    future = executor.submit(scan_file, path, self.include_details, self.max_formulas, bool(store))
+                    pending[future] = (path, fingerprint)
+                    return True
+                return False
+
+            # Prime the pool
+            while len(pending) + len(ready) < self.max_pending and submit_next():
+                pass
+
+            while pending or ready:
+                if ready:
+                    results = [ready.popleft()]
+                else:
+                    done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                    results = [self._collect(future, *pending.pop(future)) for future in done]
+
+                for result in results:
+                    if callback:
+                        callback(result)
+                    yield result
+
+                    submit_next()
+
+    def _collect(self, future, path, fingerprint):
+        """Return a worker's result and remember it for the next incremental scan"""
+        try:
+            result = future.result()
+        except Exception as e:
+            # The worker process died or the result could not be returned
+            result = {
+                'file_path': path,
+                'summary': None,
+                'error': f"Worker failed: {str(e)}"
+            }
+
+        metrics.registry.merge(result.pop('metrics', None))
+        digest = result.pop('digest', None)
+        if self.fingerprint_store:
+            result['cached'] = False
+            # Failed scans are not remembered so the file is retried next time
+            if not result['error']:
+                self.fingerprint_store.record(path, fingerprint, digest, self._options, result)
+        return result
+
+    def scan_all(self, source, callback=None):
+        """Scan workbooks in parallel and return all results"""
+        return list(self.scan(source, callback=callback))
+
+
+def main(argv=None):
+    """Command line entry point for batch portfolio scans"""
+    parser = argparse.ArgumentParser(description="Scan a portfolio of EUDA workbooks in parallel")
+    parser.add_argument('source', help="Directory tree to walk or manifest file with one path per line")
+    parser.add_argument('--workers', type=int, default=None, help="Number of worker processes")
+    parser.add_argument('--output', default=None, help="Write JSON lines results to this file instead of stdout")
+    parser.add_argument('--details', action='store_true', help="Include formulas and macros in each result")
+    parser.add_argument('--max-formulas', type=int, default=None,
+                        help="Keep at most this many formula records per workbook (a uniform sample)")
+    parser.add_argument('--incremental', action='store_true',
+                        help="Skip workbooks unchanged since the last incremental scan and reuse their results")
+    parser.add_argument('--scan-cache', default=None,
+                        help=f"Fingerprint database for --incremental (default: {SCAN_CACHE_PATH})")
+    parser.add_argument('--metrics', default=None,
+                        help="Write metrics to this file (Prometheus text, or JSON lines for .json/.jsonl)")
+    args = parser.parse_args(argv)
+
+    if args.metrics:
+        # Worker processes read the flag from the environment
+        os.environ['METRICS_ENABLED'] = 'true'
+        metrics.registry.enable()
+
+    store = FingerprintStore(args.scan_cache or SCAN_CACHE_PATH) if args.incremental else None
+    scanner = PortfolioScanner(max_workers=args.workers, include_details=args.details,
+                               max_formulas=args.max_formulas, fingerprint_store=store)
+    out = open(args.output, 'w', encoding='utf-8') if args.output else sys.stdout
+
+    scanned = 0
+    failed = 0
+    unchanged = 0
+    started = time.perf_counter()
+    try:
+        for result in scanner.scan(args.source):
+            scanned += 1
+            if result['error']:
+                failed += 1
+            if result.get('cached'):
+                unchanged += 1
+            out.write(json.dumps(result, default=str) + '\n')
+    finally:
+        if out is not sys.stdout:
+            out.close()
+        if store:
+            store.close()
+
+    elapsed = time.perf_counter() - started
+    print(f"Scanned {scanned} files ({unchanged} unchanged, {failed} with errors) in {elapsed:.1f}s", file=sys.stderr)
+    if args.metrics:
+        metrics.registry.write(args.metrics)
+    return 0 if failed == 0 else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,481 @@
+# core/dependency_graph.py
+import re
+from array import array
+from bisect import bisect_left, bisect_right
+from functools import lru_cache
+import numpy as np
+from core.formula_scanner import MAX_ROW, MAX_COLUMN
+from core.formula_tokenizer import parse_formula
+
+# Ranges spanning at most this many formula cells get one edge per cell;
+# larger ranges are linked through the segment tree of the column
+DIRECT_EDGE_LIMIT = 8
+
+# Metrics of a workbook without formulas
+EMPTY_METRICS = {
+    'formula_cells': 0,
+    'references': 0,
+    'cross_sheet_references': 0,
+    'edges': 0,
+    'max_depth': 0,
+    'mean_depth': 0.0,
+    'max_fan_in': 0,
+    'max_fan_out': 0,
+    'circular_reference_groups': 0,
+    'cells_in_cycles': 0,
+    'largest_cycle': 0,
+    'truncated': False
+}
+
+# One side of an R1C1 reference: R[-1]C[2], R5C3, RC, R[2] or C
+R1C1_PART = re.compile(r'^(?:R(?:\[(-?\d+)\]|(\d+))?(?=C|$)|(?=C))(?:C(?:\[(-?\d+)\]|(\d+))?)?$')
+
+
+def _axis(relative, absolute):
+    """Coordinate spec of one axis: ('abs', n) or ('rel', offset)"""
+    if absolute is not None:
+        return ('abs', int(absolute))
+    return ('rel', int(relative or 0))
+
+
+def _parse_part(text):
+    """Parse one side of an R1C1 reference into (row spec, column spec); None is the whole axis"""
+    match = R1C1_PART.match(text)
+    if not match or not text:
+        return None
+    row = _axis(match.group(1), match.group(2)) if text.startswith('R') else None
+    col = _axis(match.group(3), match.group(4)) if 'C' in text else None
+    return row, col
+
+
+def _parse_prefix(prefix):
+    """Sheet names of a reference prefix: () for the formula's own sheet, None for other workbooks"""
+    if not prefix:
+        return ()
+    if prefix.startswith("'"):
+        prefix = prefix[1:-1].replace("''", "'")
+    if '[' in prefix:
+        return None
+    # Sheet1:Sheet3 is a 3D reference over every sheet between the two
+    return tuple(prefix.split(':', 1))
+
+
+@lru_cache(maxsize=65536)
+def reference_specs(normalized):
+    """Cell and range references of a normalized formula as coordinate specs
+
+    Each spec is (sheets, (row1, col1, row2, col2)); sheets is () for the
+    formula's own sheet. Structured references, defined names and links to
+    other workbooks are not resolved.
+    """
+    specs = []
+    for reference in parse_formula(normalized).references:
+        prefix, _, address = reference.rpartition('!')
+        sheets = _parse_prefix(prefix)
+        if sheets is None:
+            continue
+        first, _, second = address.partition(':')
+        start = _parse_part(first)
+        end = _parse_part(second) if second else start
+        if start is None or end is None:
+            continue
+        (row1, col1), (row2, col2) = start, end
+        # R[1]:R[2] spans whole rows and C:C whole columns
+        if row1 is None or row2 is None:
+            row1, row2 = ('abs', 1), ('abs', MAX_ROW)
+        if col1 is None or col2 is None:
+            col1, col2 = ('abs', 1), ('abs', MAX_COLUMN)
+        specs.append((sheets, (row1, col1, row2, col2)))
+    return tuple(specs)
+
+
+def _bincount(values, length, chunk=1 << 20):
+    """np.bincount over an int32 array without casting all of it to int64 at once"""
+    counts = np.zeros(length, dtype=np.int64)
+    for start in range(0, len(values), chunk):
+        counts += np.bincount(values[start:start + chunk], minlength=length)
+    return counts
+
+
+def _resolve(spec, base):
+    kind, value = spec
+    return value if kind == 'abs' else base + value
+
+
+class DependencyGraph:
+    """Precedent/dependent graph of the formula cells of a workbook
+
+    Formula cells are numbered in the order they are added and stored in
+    flat integer arrays. Edges point from a precedent to the formula that
+    reads it. A range covering many formula cells in a column is linked
+    through a segment tree over that column, so a reference costs
+    O(log n) edges rather than one per cell and running totals like
+    SUM(B$2:B1000) do not produce a quadratic number of edges. Cells
+    holding constants are not nodes; they only count towards fan-in.
+
+    Fan-in and fan-out count the same (formula, cell read) pairs from
+    either end: the fan-in of a formula is the number of cells it reads
+    and the fan-out of a formula cell the number of formulas reading it.
+    Only cells that resolve are counted: referenced cells are clamped to
+    the used range of their sheet, so SUM(A:A) reads the rows in use.
+    With max_nodes, formula cells beyond the limit are not added and the
+    metrics describe the first max_nodes cells, with truncated set.
+    """
+
+    def __init__(self, max_nodes=None):
+        self.max_nodes = max_nodes
+        self.truncated = False
+        self.sheet_index = {}
+        self.used_ranges = {}
+        self.formula_index = {}
+        self.formula_texts = []
+        self._sheet = array('i')
+        self._row = array('i')
+        self._col = array('i')
+        self._formula = array('i')
+
+    def __len__(self):
+        return len(self._row)
+
+    def add_formula(self, sheet, row, col, normalized):
+        """Add a formula cell with its normalized (R1C1) formula text"""
+        if self.max_nodes is not None and len(self._row) >= self.max_nodes:
+            self.truncated = True
+            return
+        sheet_id = self.sheet_index.setdefault(sheet, len(self.sheet_index))
+        formula_id = self.formula_index.get(normalized)
+        if formula_id is None:
+            formula_id = self.formula_index[normalized] = len(self.formula_texts)
+            self.formula_texts.append(normalized)
+        self._sheet.append(sheet_id)
+        self._row.append(row)
+        self._col.append(col)
+        self._formula.append(formula_id)
+
+    def set_used_range(self, sheet, last_row, last_col):
+        """Record the last row and column in use on a sheet, for clamping references"""
+        self.used_ranges[sheet] = (last_row, last_col)
+
+    def _sheet_extents(self, sheet_order, columns):
+        """Last used (row, column) per sheet id and per workbook position
+
+        The formula cells of a sheet are always inside its extent, even when
+        no used range was recorded for it; sheets with neither get None.
+        """
+        formula_extents = {}
+        for (sheet_id, col), column in columns.items():
+            last_row, last_col = formula_extents.get(sheet_id, (0, 0))
+            formula_extents[sheet_id] = (max(last_row, column[0][-1]), max(last_col, col))
+
+        def extent(name):
+            used = self.used_ranges.get(name)
+            found = formula_extents.get(self.sheet_index.get(name))
+            if used and found:
+                return max(used[0], found[0]), max(used[1], found[1])
+            return used or found
+
+        by_id = {sheet_id: extent(name) for name, sheet_id in self.sheet_index.items()}
+        return by_id, [extent(name) for name in sheet_order]
+
+    def _index_columns(self):
+        """Group the formula cells by sheet and column, sorted by row"""
+        count = len(self)
+        sheet = np.frombuffer(self._sheet, dtype=np.int32) if count else np.zeros(0, np.int32)
+        row = np.frombuffer(self._row, dtype=np.int32) if count else np.zeros(0, np.int32)
+        col = np.frombuffer(self._col, dtype=np.int32) if count else np.zeros(0, np.int32)
+        order = np.lexsort((row, col, sheet))
+
+        columns = {}
+        sheet_columns = {}
+        boundaries = np.flatnonzero(np.diff(sheet[order]) | np.diff(col[order])) + 1
+        for chunk in np.split(order, boundaries) if count else []:
+            key = (int(sheet[chunk[0]]), int(col[chunk[0]]))
+            columns[key] = [array('i', row[chunk].tobytes()), array('i', chunk.astype(np.int32).tobytes()), None]
+            sheet_columns.setdefault(key[0], []).append(key[1])
+        return columns, sheet_columns
+
+    def _segment_tree(self, column, tree_precedents, next_id):
+        """Build the segment tree of a column: leaves are its formula cells
+
+        Internal node k covers children 2k and 2k+1; leaf i is node m + i.
+        The id given to internal node 0 is stored as the column's base, so
+        internal node k is base + k and reads the two precedents appended
+        for it. Returns the next free node id.
+        """
+        nodes = column[1]
+        m = len(nodes)
+        base = next_id
+        for k in range(1, m):
+            for child in (2 * k, 2 * k + 1):
+                tree_precedents.append(nodes[child - m] if child >= m else base + child)
+        column[2] = base
+        return base + m
+
+    def build(self, sheets=None):
+        """Resolve every reference and return the structural metrics of the workbook
+
+        sheets is the workbook sheet order, used to expand 3D references.
+        """
+        count = len(self)
+        if not count:
+            return dict(EMPTY_METRICS, truncated=self.truncated)
+        sheet_order = list(sheets or self.sheet_index)
+        sheet_positions = {name: position for position, name in enumerate(sheet_order)}
+        sheet_ids = [self.sheet_index.get(name) for name in sheet_order]
+        columns, sheet_columns = self._index_columns()
+        extent_by_id, extent_by_position = self._sheet_extents(sheet_order, columns)
+
+        # Precedents of the formula cells in node order, with the offset of
+        # each cell's first precedent, and precedents of segment tree nodes
+        formula_indptr = array('q', [0])
+        formula_precedents = array('i')
+        tree_precedents = array('i')
+        fan_in = array('q', bytes(8 * count))
+        next_id = count
+        references = 0
+        cross_sheet_references = 0
+
+        add_precedent = formula_precedents.append
+        for node in range(count):
+            own_sheet = self._sheet[node]
+            base_row = self._row[node]
+            base_col = self._col[node]
+            for sheets_ref, (row1, col1, row2, col2) in reference_specs(self.formula_texts[self._formula[node]]):
+                r1, r2 = sorted((_resolve(row1, base_row), _resolve(row2, base_row)))
+                c1, c2 = sorted((_resolve(col1, base_col), _resolve(col2, base_col)))
+                r1, c1 = max(r1, 1), max(c1, 1)
+                r2, c2 = min(r2, MAX_ROW), min(c2, MAX_COLUMN)
+                if r1 > r2 or c1 > c2:
+                    continue
+
+                sheet_count = 1
+                if not sheets_ref:
+                    targets = (own_sheet,)
+                    extents = (extent_by_id[own_sheet],)
+                else:
+                    positions = [sheet_positions.get(name) for name in sheets_ref]
+                    if None in positions:
+                        # Unknown sheets have no cells to read
+                        targets = extents = ()
+                    else:
+                        low, high = min(positions), max(positions)
+                        sheet_count = high - low + 1
+                        # Sheets without formulas have no nodes to link, only cells to read
+                        targets = [sheet_ids[p] for p in range(low, high + 1) if sheet_ids[p] is not None]
+                        extents = extent_by_position[low:high + 1]
+                    if list(targets) != [own_sheet] or sheet_count > 1:
+                        cross_sheet_references += 1
+
+                references += 1
+                for extent in extents:
+                    if extent:
+                        rows = min(r2, extent[0]) - r1 + 1
+                        cols = min(c2, extent[1]) - c1 + 1
+                        if rows > 0 and cols > 0:
+                            fan_in[node] += rows * cols
+
+                for target in targets:
+                    present = sheet_columns.get(target)
+                    if not present:
+                        continue
+                    for col in present[bisect_left(present, c1):bisect_right(present, c2)]:
+                        column = columns[(target, col)]
+                        rows, nodes = column[0], column[1]
+                        start, stop = bisect_left(rows, r1), bisect_right(rows, r2)
+                        if stop - start <= DIRECT_EDGE_LIMIT:
+                            for position in range(start, stop):
+                                add_precedent(nodes[position])
+                            continue
+
+                        if column[2] is None:
+                            next_id = self._segment_tree(column, tree_precedents, next_id)
+                        base, m = column[2], len(nodes)
+                        low, high = start + m, stop + m
+                        while low < high:
+                            if low & 1:
+                                add_precedent(nodes[low - m] if low >= m else base + low)
+                                low += 1
+                            if high & 1:
+                                high -= 1
+                                add_precedent(nodes[high - m] if high >= m else base + high)
+                            low >>= 1
+                            high >>= 1
+            formula_indptr.append(len(formula_precedents))
+
+        # Adjacency is stored from each node to its precedents, so components
+        # come out precedents first and depth can be computed in one sweep
+        edge_count = len(formula_precedents) + len(tree_precedents)
+        indptr, indices = self._csr(next_id, formula_indptr, formula_precedents, tree_precedents, columns)
+        del formula_indptr, formula_precedents, tree_precedents
+        component, component_count = self._strongly_connected_components(next_id, indptr, indices)
+        depth = self._depth(count, indptr, indices, component, component_count)
+        fan_out = self._fan_out(count, indptr, indices, columns)
+
+        # Segment tree edges never form a cycle, so a component with more
+        # than one node, or a formula reading itself, is a circular reference.
+        # Formula cells are the first nodes, so their edges come first.
+        formula_edges = int(indptr[count])
+        readers = np.repeat(np.arange(count, dtype=np.int32), np.diff(indptr[:count + 1]))
+        component_sizes = np.bincount(component, minlength=component_count)
+        cyclic = component_sizes > 1
+        cyclic[component[readers[readers == indices[:formula_edges]]]] = True
+        formula_cells = np.bincount(component[:count], minlength=component_count)[cyclic]
+
+        return {
+            'formula_cells': count,
+            'references': references,
+            'cross_sheet_references': cross_sheet_references,
+            'edges': edge_count,
+            'max_depth': int(depth.max()),
+            'mean_depth': round(float(depth.mean()), 2),
+            'max_fan_in': max(fan_in),
+            'max_fan_out': int(fan_out.max()),
+            'circular_reference_groups': int(cyclic.sum()),
+            'cells_in_cycles': int(formula_cells.sum()),
+            'largest_cycle': int(formula_cells.max()) if len(formula_cells) else 0,
+            'truncated': self.truncated
+        }
+
+    def _csr(self, node_count, formula_indptr, formula_precedents, tree_precedents, columns):
+        """Compressed sparse row adjacency: precedents of v are indices[indptr[v]:indptr[v + 1]]
+
+        Formula cells come first and their precedents were recorded in node
+        order. Segment tree nodes follow in the order the trees were built,
+        each internal node with two precedents, so no sort is needed.
+        """
+        count = len(formula_indptr) - 1
+        degree = np.zeros(node_count - count, dtype=np.int64)
+        for _, nodes, base in columns.values():
+            if base is not None:
+                degree[base - count + 1:base - count + len(nodes)] = 2
+        indptr = np.empty(node_count + 1, dtype=np.int64)
+        indptr[:count + 1] = np.frombuffer(formula_indptr, dtype=np.int64)
+        np.cumsum(degree, out=indptr[count + 1:])
+        indptr[count + 1:] += indptr[count]
+        indices = np.concatenate((
+            np.frombuffer(formula_precedents, dtype=np.int32) if len(formula_precedents) else np.zeros(0, np.int32),
+            np.frombuffer(tree_precedents, dtype=np.int32) if len(tree_precedents) else np.zeros(0, np.int32)
+        ))
+        return indptr, indices
+
+    def _strongly_connected_components(self, node_count, indptr, indices):
+        """Iterative Tarjan; a component is numbered after every component it has edges to
+
+        The adjacency is read through memoryviews of the CSR arrays and the
+        DFS stacks are integer arrays, so no per-node Python objects are kept.
+        """
+        starts = indptr.data
+        successors = indices.data
+        index = array('i', [-1]) * node_count
+        low = array('i', [0]) * node_count
+        component = array('i', [-1]) * node_count
+        on_stack = bytearray(node_count)
+        stack = array('i')
+        # DFS path: a node and the position of the next successor to visit
+        work_nodes = array('i')
+        work_positions = array('q')
+        counter = 0
+        component_count = 0
+
+        for root in range(node_count):
+            if index[root] != -1:
+                continue
+            index[root] = low[root] = counter
+            counter += 1
+            stack.append(root)
+            on_stack[root] = 1
+            work_nodes.append(root)
+            work_positions.append(starts[root])
+
+            while work_nodes:
+                node = work_nodes[-1]
+                position = work_positions[-1]
+                end = starts[node + 1]
+                descended = False
+                while position < end:
+                    successor = successors[position]
+                    position += 1
+                    if index[successor] == -1:
+                        work_positions[-1] = position
+                        index[successor] = low[successor] = counter
+                        counter += 1
+                        stack.append(successor)
+                        on_stack[successor] = 1
+                        work_nodes.append(successor)
+                        work_positions.append(starts[successor])
+                        descended = True
+                        break
+                    if on_stack[successor] and index[successor] < low[node]:
+                        low[node] = index[successor]
+                if descended:
+                    continue
+
+                work_nodes.pop()
+                work_positions.pop()
+                if low[node] == index[node]:
+                    while True:
+                        member = stack.pop()
+                        on_stack[member] = 0
+                        component[member] = component_count
+                        if member == node:
+                            break
+                    component_count += 1
+                if work_nodes:
+                    parent = work_nodes[-1]
+                    if low[node] < low[parent]:
+                        low[parent] = low[node]
+
+        return np.frombuffer(component, dtype=np.int32), component_count
+
+    def _depth(self, count, indptr, indices, component, component_count):
+        """Longest chain of formula cells ending at each formula cell
+
+        A formula that only reads constants has depth 1. Components are
+        numbered precedents first, so one pass over them in order sees the
+        final depth of the components each one reads; a cycle counts each
+        of its cells once.
+        """
+        weight = np.bincount(component[:count], minlength=component_count).data
+        depth = array('q', bytes(8 * component_count))
+        # Nodes grouped by component, in component order
+        members = np.argsort(component, kind='stable').astype(np.int32).data
+        bounds = np.zeros(component_count + 1, dtype=np.int64)
+        np.cumsum(np.bincount(component, minlength=component_count), out=bounds[1:])
+        bounds = bounds.data
+        starts = indptr.data
+        precedents = indices.data
+        component_of = component.data
+
+        for current in range(component_count):
+            best = 0
+            for node in members[bounds[current]:bounds[current + 1]]:
+                for position in range(starts[node], starts[node + 1]):
+                    other = component_of[precedents[position]]
+                    if other != current and depth[other] > best:
+                        best = depth[other]
+            depth[current] = weight[current] + best
+
+        return np.frombuffer(depth, dtype=np.int64)[component[:count]]
+
+    def _fan_out(self, count, indptr, indices, columns):
+        """Number of formulas reading each formula cell, directly or through a range"""
+        node_count = len(indptr) - 1
+        # Formula cells are the first nodes, so their edges are the first ones
+        direct = _bincount(indices[:indptr[count]], node_count)
+
+        fan_out = direct[:count].copy()
+        for _, nodes, base in columns.values():
+            if base is None:
+                continue
+            # A formula reading segment tree node k reads every leaf below it;
+            # accumulate down the tree one level at a time
+            m = len(nodes)
+            reads = direct[base:base + m]
+            inherited = np.zeros(m, dtype=np.int64)
+            level = 1
+            while level < m:
+                k = np.arange(level, min(2 * level, m))
+                inherited[k] = reads[k] + inherited[k >> 1]
+                level *= 2
+            fan_out[np.frombuffer(nodes, dtype=np.int32)] += inherited[(m + np.arange(m)) >> 1]
+        return fan_out
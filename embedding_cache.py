@@ -0,0 +1,177 @@
+# embedding/embedding_cache.py
+import os
+import sys
+import sqlite3
+import hashlib
+import threading
+from array import array
+
+# SQLite limits the number of host parameters per statement
+SQLITE_BATCH_SIZE = 500
+
+class EmbeddingCache:
+    """On-disk, content-addressed cache of embeddings with LRU eviction"""
+
+    def __init__(self, path, max_bytes=1024 * 1024 * 1024):
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+
+        self.path = path
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+
+        self.conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=30)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS embeddings (
+                key BLOB PRIMARY KEY,
+                model_id TEXT NOT NULL,
+                vector BLOB NOT NULL,
+                last_access INTEGER NOT NULL
+            )
+        """)
+        self.conn.execute("CREATE INDEX IF NOT EXISTS embeddings_last_access ON embeddings (last_access)")
+
+        # Access clock and total size, so eviction does not need to rescan the table
+        clock, size = self.conn.execute(
+            "SELECT COALESCE(MAX(last_access), 0), COALESCE(SUM(LENGTH(vector)), 0) FROM embeddings"
+        ).fetchone()
+        self._clock = clock
+        self._bytes = size
+
+    @staticmethod
+    def make_key(model_id, text):
+        """Hash the model id and the exact input text"""
+        digest = hashlib.sha256()
+        digest.update(model_id.encode('utf-8'))
+        digest.update(b'\0')
+        digest.update(text.encode('utf-8'))
+        return digest.digest()
+
+    @staticmethod
+    def _encode(embedding):
+        """Pack an embedding as little-endian float32"""
+        vector = array('f', embedding)
+        if sys.byteorder == 'big':
+            vector.byteswap()
+        return vector.tobytes()
+
+    @staticmethod
+    def _decode(blob):
+        """Unpack a little-endian float32 embedding"""
+        vector = array('f')
+        vector.frombytes(blob)
+        if sys.byteorder == 'big':
+            vector.byteswap()
+        return vector.tolist()
+
+    def _tick(self):
+        self._clock += 1
+        return self._clock
+
+    def get(self, model_id, text):
+        """Return a cached embedding or None"""
+        return self.get_many(model_id, [text])[0]
+
+    def get_many(self, model_id, texts):
+        """Return cached embeddings in input order, None for misses"""
+        keys = [self.make_key(model_id, text) for text in texts]
+        found = {}
+
+        with self._lock:
+            for start in range(0, len(keys), SQLITE_BATCH_SIZE):
+                batch = keys[start:start + SQLITE_BATCH_SIZE]
+                placeholders = ','.join('?' * len(batch))
+                rows = self.conn.execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({placeholders})", batch
+                ).fetchall()
+                found.update(rows)
+
+            # Mark hits as recently used
+            if found:
+                tick = self._tick()
+                self.conn.executemany(
+                    "UPDATE embeddings SET last_access = ? WHERE key = ?",
+                    [(tick, key) for key in found]
+                )
+
+            results = [self._decode(found[key]) if key in found else None for key in keys]
+            hits = sum(1 for result in results if result is not None)
+            self.hits += hits
+            self.misses += len(results) - hits
+
+        return results
+
+    def put(self, model_id, text, embedding):
+        """Store one embedding"""
+        self.put_many(model_id, [(text, embedding)])
+
+    def put_many(self, model_id, items):
+        """Store (text, embedding) pairs, skipping failed embeddings"""
+        rows = [
+            (self.make_key(model_id, text), model_id, self._encode(embedding))
+            for text, embedding in items if embedding
+        ]
+        if not rows:
+            return
+
+        with self._lock:
+            tick = self._tick()
+            self.conn.execute("BEGIN")
+            try:
+                for key, model, blob in rows:
+                    cursor = self.conn.execute(
+                        "INSERT OR IGNORE INTO embeddings (key, model_id, vector, last_access) VALUES (?, ?, ?, ?)",
+                        (key, model, blob, tick)
+                    )
+                    if cursor.rowcount:
+                        self._bytes += len(blob)
+                self.conn.execute("COMMIT")
+            except Exception:
+                self.conn.execute("ROLLBACK")
+                raise
+
+            if self._bytes > self.max_bytes:
+                self._evict()
+
+    def _evict(self):
+        """Drop least recently used entries until the cache is 90% of its cap"""
+        target = self.max_bytes * 0.9
+        while self._bytes > target:
+            rows = self.conn.execute(
+                "SELECT key, LENGTH(vector) FROM embeddings ORDER BY last_access LIMIT ?",
+                (SQLITE_BATCH_SIZE,)
+            ).fetchall()
+            if not rows:
+                self._bytes = 0
+                break
+
+            victims = []
+            for key, size in rows:
+                if self._bytes <= target:
+                    break
+                victims.append((key,))
+                self._bytes -= size
+            self.conn.executemany("DELETE FROM embeddings WHERE key = ?", victims)
+            self.evictions += len(victims)
+
+    def stats(self):
+        """Return hit/miss counters and the cache size"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'evictions': self.evictions,
+                'size_bytes': self._bytes
+            }
+
+    def close(self):
+        """Close the cache database"""
+        with self._lock:
+            self.conn.close()
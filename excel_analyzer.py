@@ -1,13 +1,29 @@
 # core/excel_analyzer.py
 import os
+import json
+import random
+import math
 import pandas as pd
 import openpyxl
-import re
+import zipfile
+import xml.etree.ElementTree as ET
+from collections import Counter
+from contextlib import nullcontext
 from openpyxl.utils.exceptions import InvalidFileException
+from core.formula_scanner import read_sheet_paths, iter_sheet_formulas, split_cell
+from core.formula_normalizer import FormulaGrouper, normalize_formula
+from core.formula_tokenizer import parse_formula
+from core.dependency_graph import DependencyGraph
+from core.external_connections import find_external_connections
+from core.workbook_reader import WorkbookReader
+from core import metrics
+from config.settings import ANALYZER_MAX_FORMULAS
 
 class ExcelAnalyzer:
-    def __init__(self, file_path):
+    def __init__(self, file_path, max_formulas=None, spill_path=None, reader=None):
         self.file_path = file_path
+        # A WorkbookReader shared with the macro extractor; it stays open for the whole scan
+        self.reader = reader
         self.workbook = None
         self.sheets = []
         self.has_macros = False
@@ -17,8 +33,62 @@ class ExcelAnalyzer:
         self.formulas = []
         self.error = None
         
+        # Bound the formula state kept in memory: with max_formulas a uniform
+        # sample of records is kept and formula groups and dependency graph
+        # nodes stop at max_formulas; with spill_path every record goes to a
+        # JSON lines file
+        self.max_formulas = max_formulas if max_formulas is not None else ANALYZER_MAX_FORMULAS
+        self.spill_path = spill_path
+        self.formulas_sampled = False
+        self._spill_file = None
+        self._analyzed = False
+        self._reset_formula_state()
+    
+    def _reset_formula_state(self):
+        """Clear formula records and the incremental counters"""
+        self.formulas = []
+        self.external_connections = []
+        self.has_formulas = False
+        self.has_external_connections = False
+        self.formula_count = 0
+        self.formula_types = Counter()
+        self.external_connection_count = 0
+        self.connection_types = Counter()
+        self.formulas_sampled = False
+        self._sample_random = random.Random(0)
+        # Formulas filled across ranges collapse into one group per logical formula
+        self.formula_groups = []
+        self._grouper = FormulaGrouper(self.max_formulas)
+        # Precedent/dependent graph of the formula cells, kept in compact arrays
+        self.dependency_metrics = None
+        self._graph = DependencyGraph(self.max_formulas)
+        if self._spill_file:
+            self._spill_file.seek(0)
+            self._spill_file.truncate()
+        
+
+    @metrics.timed('excel_analyze_seconds')
     def analyze(self):
         """Analyze the Excel file and gather information"""
+        analyzed = self._analyze()
+        if metrics.registry.enabled:
+            metrics.increment('excel_files_analyzed_total', status='ok' if analyzed else 'failed')
+            if analyzed:
+                metrics.increment('excel_bytes_processed_total', os.path.getsize(self.file_path))
+                metrics.increment('excel_formulas_found_total', self.formula_count)
+        return analyzed
+    
+    def _analyze(self):
+        try:
+            if self.spill_path:
+                self._spill_file = open(self.spill_path, 'w', encoding='utf-8')
+            return self._analyze_workbook()
+        finally:
+            if self._spill_file:
+                self._spill_file.close()
+                self._spill_file = None
+    
+    def _analyze_workbook(self):
         try:
             # Check if file exists
             if not os.path.exists(self.file_path):
@@ -34,80 +104,182 @@ class ExcelAnalyzer:
             # Check if it has macros
             self.has_macros = extension == '.xlsm'
             
-            # Load the workbook
-            try:
-                self.workbook = openpyxl.load_workbook(self.file_path, read_only=True, keep_vba=self.has_macros)
-                self.sheets = self.workbook.sheetnames
-            except InvalidFileException:
-                # Try with pandas if openpyxl fails
+            # Stream formulas straight from the workbook package and only
+            # load the workbook with openpyxl if that is not possible
+            if extension == '.xls' or not self._analyze_formulas():
+                self._reset_formula_state()
                 try:
-                    excel_file = pd.ExcelFile(self.file_path)
-                    self.sheets = excel_file.sheet_names
-                except Exception as e:
-                    self.error = f"Failed to open Excel file: {str(e)}"
-                    return False
-            
-            # Analyze formulas
-            if self.workbook:
-                self._analyze_formulas()
+                    source = self.reader.stream() if self.reader and extension != '.xls' else self.file_path
+                    self.workbook = openpyxl.load_workbook(source, read_only=True, keep_vba=self.has_macros)
+                    self.sheets = self.workbook.sheetnames
+                except InvalidFileException:
+                    # Try with pandas if openpyxl fails
+                    try:
+                        excel_file = pd.ExcelFile(self.file_path)
+                        self.sheets = excel_file.sheet_names
+                    except Exception as e:
+                        self.error = f"Failed to open Excel file: {str(e)}"
+                        return False
                 
-            # Look for external connections
-            self._analyze_external_connections()
+                # Analyze formulas
+                if self.workbook:
+                    self._analyze_formulas_openpyxl()
             
+            self.formula_groups = self._grouper.groups()
+            self.dependency_metrics = self._build_dependency_graph()
+            self._analyzed = True
             return True
         except Exception as e:
             self.error = f"Error analyzing Excel file: {str(e)}"
             return False
     
+    @metrics.timed('excel_formula_scan_seconds')
     def _analyze_formulas(self):
-        """Check for formulas in the Excel workbook"""
-        formula_pattern = re.compile(r'=.*\(.*\)') 
+        """Stream formulas from the worksheet XML without building cell objects"""
+        try:
+            with self._package() as z:
+                sheets = read_sheet_paths(z)
+                self.sheets = [sheet_name for sheet_name, _ in sheets]
+                for formula_info in self._stream_formulas(z, sheets):
+                    self._record_formula(formula_info)
+                self._record_workbook_connections(z)
+        except (zipfile.BadZipFile, KeyError, ValueError, ET.ParseError):
+            return False
         
+        return True
+    
+    def _package(self):
+        """The shared workbook reader, or a reader of this analyzer's own"""
+        if self.reader:
+            return nullcontext(self.reader)
+        return WorkbookReader(self.file_path)
+    
+    def _stream_formulas(self, z, sheets=None):
+        """Yield formula records from the worksheet XML of an open package"""
+        for sheet_name, sheet_path in sheets or read_sheet_paths(z):
+            # Chart sheets and dialog sheets have no cells
+            if not sheet_path:
+                continue
+            
+            used_range = []
+            for cell, formula, kind in iter_sheet_formulas(z, sheet_path, used_range):
+                yield self._formula_info(sheet_name, cell, '=' + formula)
+            # References to cells beyond the last used row or column resolve to nothing
+            if used_range:
+                self._graph.set_used_range(sheet_name, *used_range)
+    
+    def _openpyxl_formulas(self):
+        """Yield formula records from openpyxl cells"""
         for sheet_name in self.sheets:
             sheet = self.workbook[sheet_name]
             
             for row in sheet.iter_rows():
                 for cell in row:
                     if cell.value and isinstance(cell.value, str) and cell.value.startswith('='):
-                        self.has_formulas = True
-                        formula_info = {
-                            'sheet': sheet_name,
-                            'cell': cell.coordinate,
-                            'formula': cell.value
-                        }
-                        self.formulas.append(formula_info)
-                        
-                        # Check for specific formula types
-                        if 'VLOOKUP' in cell.value or 'HLOOKUP' in cell.value:
-                            formula_info['type'] = 'lookup'
-                        elif 'SUM' in cell.value or 'AVERAGE' in cell.value:
-                            formula_info['type'] = 'aggregation'
-                        elif 'IF' in cell.value:
-                            formula_info['type'] = 'conditional'
-                        else:
-                            formula_info['type'] = 'other'
-    
-    def _analyze_external_connections(self):
-        """Check for external connections in the Excel file"""
-        # Note: This is a simplified version. Advanced analysis would require
-        # more complex parsing of the Excel file structure.
+                        yield self._formula_info(sheet_name, cell.coordinate, cell.value)
+    
+    def _analyze_formulas_openpyxl(self):
+        """Check for formulas in the Excel workbook using openpyxl cells"""
+        for formula_info in self._openpyxl_formulas():
+            self._record_formula(formula_info)
+        for sheet_name in self.sheets:
+            sheet = self.workbook[sheet_name]
+            if sheet.max_row and sheet.max_column:
+                self._graph.set_used_range(sheet_name, sheet.max_row, sheet.max_column)
+    
+    def _record_formula(self, formula_info):
+        """Update the counters for one formula and keep, sample or spill its record"""
+        self.formula_count += 1
+        self.formula_types[formula_info['type']] += 1
+        self.has_formulas = True
+        self._check_external_connection(formula_info)
+        self._grouper.add(formula_info)
+        row, col = split_cell(formula_info['cell'])
+        self._graph.add_formula(formula_info['sheet'], row, col, formula_info['normalized'])
         
-        # Look for common connection patterns in formulas
-        connection_patterns = [
-            r'ODBC', r'ADO', r'connect', r'server', r'database', r'DSN=', 
-            r'Provider=', r'Data Source='
-        ]
+        if self._spill_file:
+            self._spill_file.write(json.dumps(formula_info) + '\n')
+        elif self.max_formulas is None or len(self.formulas) < self.max_formulas:
+            self.formulas.append(formula_info)
+        else:
+            # Reservoir sampling keeps a uniform sample of max_formulas records
+            self.formulas_sampled = True
+            slot = self._sample_random.randrange(self.formula_count)
+            if slot < self.max_formulas:
+                self.formulas[slot] = formula_info
+    
+    def iter_formulas(self):
+        """Yield every formula record of the workbook with constant memory
         
-        for formula in self.formulas:
-            for pattern in connection_patterns:
-                if re.search(pattern, formula['formula'], re.IGNORECASE):
-                    self.has_external_connections = True
-                    self.external_connections.append({
-                        'sheet': formula['sheet'],
-                        'cell': formula['cell'],
-                        'formula': formula['formula'],
-                        'connection_type': 'formula-based'
-                    })
+        After analyze() the records are replayed from memory or from the
+        spill file; when only a sample was kept, or before analyze(), they
+        are streamed from the workbook again.
+        """
+        if self._analyzed and self.spill_path:
+            with open(self.spill_path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    yield json.loads(line)
+        elif self._analyzed and not self.formulas_sampled:
+            yield from self.formulas
+        elif self.workbook:
+            yield from self._openpyxl_formulas()
+        else:
+            with self._package() as z:
+                yield from self._stream_formulas(z)
+    
+    def _formula_info(self, sheet_name, cell, formula):
+        """Build the formula record and classify the formula type"""
+        # Filled-down copies of a formula share the normalized text, so the
+        # tokenizer parses each logical formula once and caches the result
+        row, col = split_cell(cell)
+        normalized = normalize_formula(formula, row, col)
+        return {
+            'sheet': sheet_name,
+            'cell': cell,
+            'formula': formula,
+            'type': parse_formula(normalized).formula_type,
+            'normalized': normalized
+        }
+    
+    def _check_external_connection(self, formula):
+        """Check one formula for external connections using its tokens"""
+        parsed = parse_formula(formula['normalized'])
+        if not parsed.is_connection:
+            return
+        
+        connection_type = 'external-reference' if parsed.external_links else 'formula-based'
+        self.has_external_connections = True
+        self.external_connection_count += 1
+        self.connection_types[connection_type] += 1
+        # Connection records are capped like formula records
+        if self.max_formulas is None or len(self.external_connections) < self.max_formulas:
+            self.external_connections.append({
+                'sheet': formula['sheet'],
+                'cell': formula['cell'],
+                'formula': formula['formula'],
+                'connection_type': connection_type
+            })
+    
+    @metrics.timed('excel_connection_scan_seconds')
+    def _record_workbook_connections(self, z):
+        """Record the data connections, links and queries declared in the workbook package"""
+        for connection in find_external_connections(z):
+            self.has_external_connections = True
+            self.external_connection_count += 1
+            self.connection_types[connection['connection_type']] += 1
+            self.external_connections.append(connection)
+    
+    @metrics.timed('excel_dependency_graph_seconds')
+    def _build_dependency_graph(self):
+        """Resolve the formula references and measure the structure of the workbook"""
+        try:
+            return self._graph.build(self.sheets)
+        except Exception as e:
+            # The structural metrics are optional; the rest of the analysis stands
+            print(f"Error building dependency graph: {str(e)}")
+            return None
+        finally:
+            self._graph = DependencyGraph(self.max_formulas)
     
     def get_complexity_score(self):
         """Calculate a complexity score for the EUDA"""
@@ -123,13 +295,27 @@ class ExcelAnalyzer:
         
         # Add points for formulas
         if self.has_formulas:
-            score += min(10, len(self.formulas) / 10)
+            score += min(10, self.formula_count / 10)
         
         # Add points for external connections
         if self.has_external_connections:
             score += 15
         
-        return min(100, score)
+        # Add points for the structure of the formula dependency graph
+        graph = self.dependency_metrics
+        if graph:
+            # Long precedent chains are hard to follow and to test
+            score += min(15, max(0, graph['max_depth'] - 1))
+            # Cells read by many formulas are single points of failure
+            score += min(5, math.log10(1 + graph['max_fan_out']))
+            # Cross-sheet references spread the logic over the workbook
+            if graph['references']:
+                score += 5 * graph['cross_sheet_references'] / graph['references']
+            # Circular references rely on iterative calculation
+            if graph['circular_reference_groups']:
+                score += 10
+        
+        return min(100, round(score, 1))
     
     def get_summary(self):
         """Return a summary of the Excel file analysis"""
@@ -140,7 +326,13 @@ class ExcelAnalyzer:
             'has_macros': self.has_macros,
             'has_formulas': self.has_formulas,
             'has_external_connections': self.has_external_connections,
-            'formula_count': len(self.formulas),
-            'external_connection_count': len(self.external_connections),
+            'formula_count': self.formula_count,
+            'formula_types': dict(self.formula_types),
+            'formulas_sampled': self.formulas_sampled,
+            'formula_group_count': len(self.formula_groups),
+            'formula_groups_truncated': self._grouper.truncated,
+            'external_connection_count': self.external_connection_count,
+            'connection_types': dict(self.connection_types),
+            'dependency_metrics': self.dependency_metrics,
             'complexity_score': self.get_complexity_score()
         }
\ No newline at end of file
@@ -0,0 +1,206 @@
+# core/external_connections.py
+import io
+import re
+import base64
+import struct
+import posixpath
+import zipfile
+import xml.etree.ElementTree as ET
+from core.workbook_reader import read_part_xml
+
+# connection/@type in xl/connections.xml
+CONNECTION_TYPES = {
+    '1': 'odbc',
+    '2': 'dao',
+    '3': 'file',
+    '4': 'web',
+    '5': 'oledb',
+    '6': 'text',
+    '7': 'ado',
+    '8': 'dsp'
+}
+
+# Package parts that can declare an external data source
+CONNECTIONS_PART = 'xl/connections.xml'
+EXTERNAL_LINK_PART = re.compile(r'^xl/externalLinks/externalLink\d+\.xml$')
+QUERY_TABLE_PART = re.compile(r'^xl/queryTables/queryTable\d+\.xml$')
+PIVOT_CACHE_PART = re.compile(r'^xl/pivotCache/pivotCacheDefinition\d+\.xml$')
+CUSTOM_XML_PART = re.compile(r'^customXml/item\d+\.xml$')
+
+# Power Query keeps its queries in a base64 DataMashup package under customXml
+MASHUP_PROVIDER = 'Microsoft.Mashup.OleDb'
+MASHUP_FORMULAS = 'Formulas/Section1.m'
+M_QUERY_PATTERN = re.compile(r'\bshared\s+(#"(?:[^"]|"")*"|[\w.]+)\s*=')
+M_SOURCE_PATTERN = re.compile(r"""
+    \b(?P<function>(?:Sql|Oracle|Odbc|OleDb|Web|File|Folder|SharePoint|OData|AnalysisServices|
+        PostgreSQL|MySQL|Sybase|Teradata|DB2|Access|Salesforce|Snowflake|AzureStorage|Hdfs)\.\w+)
+    \s*\(\s*"(?P<target>(?:[^"]|"")*)"(?:\s*,\s*"(?P<database>(?:[^"]|"")*)")?
+""", re.VERBOSE)
+
+# Credentials are never copied out of a connection string
+PASSWORD_PATTERN = re.compile(r'\b((?:Password|Pwd)\s*=\s*)("[^"]*"|[^;]*)', re.IGNORECASE)
+
+
+def _local_name(tag):
+    """Strip the XML namespace from a tag or attribute name"""
+    return tag.rpartition('}')[2]
+
+
+def _attribute(elem, name):
+    """Read an attribute regardless of its namespace prefix"""
+    for key, value in elem.attrib.items():
+        if _local_name(key) == name:
+            return value
+    return None
+
+
+def redact(connection_string):
+    """Mask passwords in a connection string"""
+    return PASSWORD_PATTERN.sub(r'\1***', connection_string) if connection_string else connection_string
+
+
+def _read_xml(zip_file, path):
+    with zip_file.open(path) as f:
+        return ET.parse(f).getroot()
+
+
+def _relationship_targets(zip_file, part_path):
+    """Relationship targets of a part by id, keeping external targets as written"""
+    directory, filename = posixpath.split(part_path)
+    try:
+        root = read_part_xml(zip_file, posixpath.join(directory, '_rels', filename + '.rels'))
+    except KeyError:
+        return {}
+    return {rel.get('Id'): rel.get('Target') for rel in root}
+
+
+def _connection(connection_type, name, target, part, **details):
+    record = {'connection_type': connection_type, 'name': name, 'target': target, 'part': part}
+    record.update((key, value) for key, value in details.items() if value)
+    return record
+
+
+def _read_connections(zip_file):
+    """Connections declared in xl/connections.xml, by connection id"""
+    connections = {}
+    for elem in _read_xml(zip_file, CONNECTIONS_PART):
+        if _local_name(elem.tag) != 'connection':
+            continue
+        connection_type = CONNECTION_TYPES.get(elem.get('type'), 'unknown')
+        target = elem.get('sourceFile') or elem.get('odcFile')
+        command = None
+        for child in elem:
+            tag = _local_name(child.tag)
+            if tag == 'dbPr':
+                target = redact(child.get('connection'))
+                command = child.get('command')
+            elif tag == 'webPr':
+                target = child.get('url')
+            elif tag == 'textPr':
+                target = child.get('sourceFile') or target
+        if target and MASHUP_PROVIDER in target:
+            # A Power Query connection; the query itself is read from the DataMashup
+            location = re.search(r'Location=("[^"]*"|[^;]*)', target)
+            command = location.group(1).strip('"') if location else command
+            connection_type = 'power-query'
+        connections[elem.get('id')] = _connection(
+            connection_type, elem.get('name'), target, CONNECTIONS_PART, command=command
+        )
+    return connections
+
+
+def _read_external_link(zip_file, path):
+    """Linked workbooks, DDE and OLE links declared in an externalLink part"""
+    targets = _relationship_targets(zip_file, path)
+    links = []
+    for elem in _read_xml(zip_file, path):
+        tag = _local_name(elem.tag)
+        if tag == 'externalBook':
+            sheets = [sheet.get('val') for sheet in elem.iter() if _local_name(sheet.tag) == 'sheetName']
+            target = targets.get(_attribute(elem, 'id'))
+            links.append(_connection('external-workbook', posixpath.basename(target or '') or None, target, path,
+                                     sheets=sheets))
+        elif tag == 'ddeLink':
+            links.append(_connection('dde', elem.get('ddeService'), elem.get('ddeTopic'), path))
+        elif tag == 'oleLink':
+            links.append(_connection('ole', elem.get('progId'), targets.get(_attribute(elem, 'id')), path))
+    return links
+
+
+def _read_data_mashup(zip_file, path):
+    """Power Query queries and the data sources they read, from a DataMashup part"""
+    root = _read_xml(zip_file, path)
+    if _local_name(root.tag) != 'DataMashup' or not root.text:
+        return []
+
+    # Version (4 bytes), package length (4 bytes), then the package as a zip
+    data = base64.b64decode(root.text)
+    length = struct.unpack_from('<I', data, 4)[0]
+    with zipfile.ZipFile(io.BytesIO(data[8:8 + length])) as package:
+        section = package.read(MASHUP_FORMULAS).decode('utf-8-sig')
+
+    queries = []
+    matches = list(M_QUERY_PATTERN.finditer(section))
+    for position, match in enumerate(matches):
+        end = matches[position + 1].start() if position + 1 < len(matches) else len(section)
+        name = match.group(1)
+        if name.startswith('#"'):
+            name = name[2:-1].replace('""', '"')
+        for source in M_SOURCE_PATTERN.finditer(section, match.end(), end):
+            target = redact(source.group('target'))
+            if source.group('database'):
+                target = f"{target}/{source.group('database')}"
+            queries.append(_connection('power-query', name, target, path, function=source.group('function')))
+    return queries
+
+
+def find_external_connections(zip_file):
+    """Read every external data source declared in an open workbook package
+
+    The package directory is walked once and only the parts that can
+    declare a connection are parsed: xl/connections.xml, external links,
+    query tables, pivot caches with an external source and the Power
+    Query DataMashup. Returns one record per connection with its
+    connection_type, name, target and the part it was found in.
+    """
+    names = zip_file.namelist()
+    connections = {}
+    if CONNECTIONS_PART in names:
+        try:
+            connections = _read_connections(zip_file)
+        except ET.ParseError as e:
+            print(f"Error reading external connections from {CONNECTIONS_PART}: {str(e)}")
+    found = []
+    used = set()
+
+    for path in names:
+        try:
+            if EXTERNAL_LINK_PART.match(path):
+                found.extend(_read_external_link(zip_file, path))
+            elif QUERY_TABLE_PART.match(path) or PIVOT_CACHE_PART.match(path):
+                root = _read_xml(zip_file, path)
+                if QUERY_TABLE_PART.match(path):
+                    connection_id, connection_type = root.get('connectionId'), 'query-table'
+                else:
+                    source = next((e for e in root if _local_name(e.tag) == 'cacheSource'), None)
+                    if source is None or source.get('type') != 'external':
+                        continue
+                    connection_id, connection_type = source.get('connectionId'), 'pivot-cache'
+                connection = connections.get(connection_id, {})
+                used.add(connection_id)
+                found.append(_connection(connection_type, root.get('name') or connection.get('name'),
+                                         connection.get('target'), path, connection=connection.get('name'),
+                                         source_type=connection.get('connection_type')))
+            elif CUSTOM_XML_PART.match(path):
+                found.extend(_read_data_mashup(zip_file, path))
+        except (KeyError, ValueError, struct.error, zipfile.BadZipFile, ET.ParseError) as e:
+            print(f"Error reading external connections from {path}: {str(e)}")
+
+    # Connections are reported on their own unless a query table or pivot cache
+    # already reported them, or a Power Query connection's query was read above
+    queries = any(record['connection_type'] == 'power-query' for record in found)
+    found[:0] = [
+        connection for connection_id, connection in connections.items()
+        if connection_id not in used and not (queries and connection['connection_type'] == 'power-query')
+    ]
+    return found
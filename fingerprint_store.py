@@ -0,0 +1,152 @@
+# core/fingerprint_store.py
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import zipfile
+import threading
+
+# Bump when the scan summary changes shape so older cached results are rescanned
+RESULT_FORMAT = 1
+
+# Chunk size for hashing workbooks that are not zip packages (.xls)
+HASH_CHUNK_SIZE = 1024 * 1024
+
+
+def content_digest(file_path, reader=None):
+    """Digest of a workbook's content
+
+    For zip packages (.xlsx, .xlsm) the digest covers the name, CRC-32 and
+    size of every entry, read from the central directory, so only the end
+    of the file is read. Other files are hashed in full.
+    """
+    digest = hashlib.sha256()
+    try:
+        if reader is not None:
+            entries = reader.zip_file.infolist()
+        else:
+            with zipfile.ZipFile(file_path, 'r') as z:
+                entries = z.infolist()
+        digest.update(b'zip\0')
+        for info in sorted(entries, key=lambda info: info.filename):
+            digest.update(f"{info.filename}\0{info.CRC:08x}\0{info.file_size}\n".encode('utf-8'))
+    except zipfile.BadZipFile:
+        digest = hashlib.sha256(b'raw\0')
+        with open(file_path, 'rb') as f:
+            for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b''):
+                digest.update(chunk)
+    return digest.hexdigest()
+
+
+class FingerprintStore:
+    """Fingerprints of scanned workbooks and their scan results, kept in SQLite
+
+    A workbook is unchanged when its size and modification time match the
+    last scan. When only the modification time moved (a copy, a restore or
+    a save without edits) the content digest decides. Unchanged workbooks
+    are served their previous result instead of being scanned again.
+    """
+
+    def __init__(self, path):
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+
+        self.path = path
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+        self.conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=30)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS scans (
+                path TEXT PRIMARY KEY,
+                size INTEGER NOT NULL,
+                mtime_ns INTEGER NOT NULL,
+                digest TEXT,
+                options TEXT NOT NULL,
+                result TEXT NOT NULL,
+                scanned_at REAL NOT NULL
+            )
+        """)
+
+    @staticmethod
+    def make_options(**options):
+        """Scan options that change the result, as a stable key"""
+        return json.dumps(dict(options, result_format=RESULT_FORMAT), sort_keys=True)
+
+    @staticmethod
+    def stat(file_path):
+        """Return the (size, mtime_ns) fingerprint of a file, or None if it cannot be read"""
+        try:
+            st = os.stat(file_path)
+        except OSError:
+            return None
+        return st.st_size, st.st_mtime_ns
+
+    def lookup(self, file_path, options):
+        """Return (previous result or None, stat fingerprint) for a workbook"""
+        fingerprint = self.stat(file_path)
+        key = os.path.abspath(file_path)
+        with self._lock:
+            row = self.conn.execute(
+                "SELECT size, mtime_ns, digest, options, result FROM scans WHERE path = ?", (key,)
+            ).fetchone()
+
+        result = None
+        if fingerprint and row and row[3] == options and row[0] == fingerprint[0]:
+            if row[1] == fingerprint[1]:
+                result = row[4]
+            elif row[2]:
+                try:
+                    if content_digest(file_path) == row[2]:
+                        result = row[4]
+                        # Remember the new modification time so the digest is not needed next time
+                        with self._lock:
+                            self.conn.execute("UPDATE scans SET mtime_ns = ? WHERE path = ?", (fingerprint[1], key))
+                except OSError:
+                    pass
+
+        with self._lock:
+            if result is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return (json.loads(result) if result is not None else None), fingerprint
+
+    def record(self, file_path, fingerprint, digest, options, result):
+        """Store the result of a successful scan under the fingerprint taken before it"""
+        if not fingerprint:
+            return
+        stored = {key: value for key, value in result.items() if key not in ('metrics', 'elapsed', 'digest', 'cached')}
+        with self._lock:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO scans (path, size, mtime_ns, digest, options, result, scanned_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (os.path.abspath(file_path), fingerprint[0], fingerprint[1], digest, options,
+                 json.dumps(stored, default=str), time.time())
+            )
+
+    def forget(self, file_path):
+        """Drop the fingerprint of a workbook so it is scanned again"""
+        with self._lock:
+            self.conn.execute("DELETE FROM scans WHERE path = ?", (os.path.abspath(file_path),))
+
+    def stats(self):
+        """Return hit/miss counters and the number of fingerprinted workbooks"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            count = self.conn.execute("SELECT COUNT(*) FROM scans").fetchone()[0]
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'workbooks': count
+            }
+
+    def close(self):
+        """Close the fingerprint database"""
+        with self._lock:
+            self.conn.close()
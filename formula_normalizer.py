@@ -0,0 +1,113 @@
+# core/formula_normalizer.py
+from core.formula_scanner import REFERENCE_PATTERN, column_index, column_letter, split_cell
+
+
+def _offset(prefix, value, anchor, absolute):
+    """Format one R1C1 coordinate: R5 when absolute, R[-1] or R when relative"""
+    if absolute:
+        return f"{prefix}{value}"
+    offset = value - anchor
+    return f"{prefix}[{offset}]" if offset else prefix
+
+
+def normalize_formula(formula, row, col):
+    """Rewrite the A1 references of a formula in R1C1 form relative to its cell
+
+    Formulas that were filled across a range, like =VLOOKUP(A2,Ref!A:B,2,0)
+    in B2 and =VLOOKUP(A3,Ref!A:B,2,0) in B3, normalize to the same text.
+    Strings, quoted sheet names and bracketed references are left untouched.
+    """
+    def replace(match):
+        if match.group('col') is not None:
+            return (_offset('R', int(match.group('row')), row, match.group('row_abs')) +
+                    _offset('C', column_index(match.group('col')), col, match.group('col_abs')))
+        if match.group('c1') is not None:
+            return (_offset('C', column_index(match.group('c1')), col, match.group('c1_abs')) + ':' +
+                    _offset('C', column_index(match.group('c2')), col, match.group('c2_abs')))
+        if match.group('r1') is not None:
+            return (_offset('R', int(match.group('r1')), row, match.group('r1_abs')) + ':' +
+                    _offset('R', int(match.group('r2')), row, match.group('r2_abs')))
+        return match.group(0)
+
+    return REFERENCE_PATTERN.sub(replace, formula)
+
+
+def format_range(top, left, bottom, right):
+    """Format a rectangle of cells as an A1 range, or a single cell"""
+    start = f"{column_letter(left)}{top}"
+    if top == bottom and left == right:
+        return start
+    return f"{start}:{column_letter(right)}{bottom}"
+
+
+class FormulaGrouper:
+    """Group formula records by worksheet and normalized formula
+
+    Cells are folded into per-column runs of consecutive rows as they
+    arrive, so a formula filled down 100k rows is held as one run rather
+    than 100k cells. With max_groups, formulas that would open a group
+    beyond the limit are counted but not grouped.
+    """
+
+    def __init__(self, max_groups=None):
+        self.max_groups = max_groups
+        self.truncated = False
+        self._groups = {}
+
+    def add(self, formula_info):
+        """Add one formula record from ExcelAnalyzer"""
+        row, col = split_cell(formula_info['cell'])
+        normalized = formula_info.get('normalized') or normalize_formula(formula_info['formula'], row, col)
+        key = (formula_info['sheet'], normalized)
+
+        group = self._groups.get(key)
+        if group is None:
+            if self.max_groups is not None and len(self._groups) >= self.max_groups:
+                self.truncated = True
+                return
+            group = self._groups[key] = {
+                'sheet': formula_info['sheet'],
+                'cell': formula_info['cell'],
+                'formula': formula_info['formula'],
+                'type': formula_info['type'],
+                'normalized': normalized,
+                'cell_count': 0,
+                'runs': {}
+            }
+        group['cell_count'] += 1
+
+        # Cells arrive row by row, so a run only ever grows downwards
+        runs = group['runs'].setdefault(col, [])
+        if runs and runs[-1][1] + 1 == row:
+            runs[-1][1] = row
+        elif not runs or runs[-1][1] < row:
+            runs.append([row, row])
+
+    def groups(self):
+        """Return the groups in first-seen order, with their cells as A1 ranges"""
+        groups = []
+        for group in self._groups.values():
+            group = dict(group)
+            group['ranges'] = self._ranges(group.pop('runs'))
+            groups.append(group)
+        return groups
+
+    def _ranges(self, runs):
+        """Merge column runs that span the same rows in adjacent columns into rectangles"""
+        columns_by_span = {}
+        for col, spans in runs.items():
+            for top, bottom in spans:
+                columns_by_span.setdefault((top, bottom), []).append(col)
+
+        rectangles = []
+        for (top, bottom), columns in columns_by_span.items():
+            columns.sort()
+            left = previous = columns[0]
+            for col in columns[1:]:
+                if col != previous + 1:
+                    rectangles.append((top, left, bottom, previous))
+                    left = col
+                previous = col
+            rectangles.append((top, left, bottom, previous))
+
+        return [format_range(*rectangle) for rectangle in sorted(rectangles)]
@@ -0,0 +1,222 @@
+# core/formula_scanner.py
+import re
+import posixpath
+import xml.etree.ElementTree as ET
+from core.workbook_reader import read_part_xml
+
+# Relationship types used to locate the workbook and its sheets
+OFFICE_DOCUMENT_REL = 'officeDocument'
+WORKSHEET_REL = 'worksheet'
+
+# Matches the parts of a formula that can hold an A1 reference. Strings,
+# quoted sheet names and bracketed workbook/structured references are
+# matched first so that references are never rewritten inside them.
+REFERENCE_PATTERN = re.compile(r"""
+    (?P<string>"(?:[^"]|"")*")
+  | (?P<quoted>'(?:[^']|'')*'!)
+  | (?P<bracket>\[[^\]]*\])
+  | (?<![A-Za-z0-9_.$])(?P<col_abs>\$?)(?P<col>[A-Za-z]{1,3})(?P<row_abs>\$?)(?P<row>[0-9]+)(?![A-Za-z0-9_.(!])
+  | (?<![A-Za-z0-9_.$])(?P<c1_abs>\$?)(?P<c1>[A-Za-z]{1,3}):(?P<c2_abs>\$?)(?P<c2>[A-Za-z]{1,3})(?![A-Za-z0-9_.(!])
+  | (?<![A-Za-z0-9_.$:])(?P<r1_abs>\$?)(?P<r1>[0-9]+):(?P<r2_abs>\$?)(?P<r2>[0-9]+)(?![A-Za-z0-9_.(!:])
+""", re.VERBOSE)
+
+CELL_PATTERN = re.compile(r'^\$?([A-Za-z]{1,3})\$?([0-9]+)$')
+
+MAX_ROW = 1048576
+MAX_COLUMN = 16384
+
+
+def column_index(letters):
+    """Convert column letters to a 1-based column index"""
+    index = 0
+    for char in letters.upper():
+        index = index * 26 + (ord(char) - 64)
+    return index
+
+
+def column_letter(index):
+    """Convert a 1-based column index to column letters"""
+    letters = ''
+    while index > 0:
+        index, remainder = divmod(index - 1, 26)
+        letters = chr(65 + remainder) + letters
+    return letters
+
+
+def split_cell(coordinate):
+    """Split an A1 coordinate into a (row, column) pair"""
+    match = CELL_PATTERN.match(coordinate)
+    if not match:
+        raise ValueError(f"Invalid cell coordinate: {coordinate}")
+    return int(match.group(2)), column_index(match.group(1))
+
+
+def translate_formula(formula, row_offset, col_offset):
+    """Shift the relative references in a formula by the given offsets"""
+    if not row_offset and not col_offset:
+        return formula
+
+    def shift_row(row, absolute):
+        if absolute:
+            return row
+        row = int(row) + row_offset
+        return str(row) if 1 <= row <= MAX_ROW else None
+
+    def shift_col(col, absolute):
+        if absolute:
+            return col
+        col = column_index(col) + col_offset
+        return column_letter(col) if 1 <= col <= MAX_COLUMN else None
+
+    def replace(match):
+        if match.group('col') is not None:
+            col = shift_col(match.group('col'), match.group('col_abs'))
+            row = shift_row(match.group('row'), match.group('row_abs'))
+            if col is None or row is None:
+                return '#REF!'
+            return f"{match.group('col_abs')}{col}{match.group('row_abs')}{row}"
+        if match.group('c1') is not None:
+            c1 = shift_col(match.group('c1'), match.group('c1_abs'))
+            c2 = shift_col(match.group('c2'), match.group('c2_abs'))
+            if c1 is None or c2 is None:
+                return '#REF!'
+            return f"{match.group('c1_abs')}{c1}:{match.group('c2_abs')}{c2}"
+        if match.group('r1') is not None:
+            r1 = shift_row(match.group('r1'), match.group('r1_abs'))
+            r2 = shift_row(match.group('r2'), match.group('r2_abs'))
+            if r1 is None or r2 is None:
+                return '#REF!'
+            return f"{match.group('r1_abs')}{r1}:{match.group('r2_abs')}{r2}"
+        return match.group(0)
+
+    return REFERENCE_PATTERN.sub(replace, formula)
+
+
+def _local_name(tag):
+    """Strip the XML namespace from a tag"""
+    return tag.rpartition('}')[2]
+
+
+def _read_relationships(zip_file, part_path):
+    """Read the relationships of a package part as {id: (type, target path)}"""
+    directory, filename = posixpath.split(part_path)
+    rels_path = posixpath.join(directory, '_rels', filename + '.rels')
+    relationships = {}
+
+    try:
+        root = read_part_xml(zip_file, rels_path)
+    except KeyError:
+        return relationships
+
+    for rel in root:
+        target = rel.get('Target', '')
+        if rel.get('TargetMode') == 'External':
+            continue
+        if target.startswith('/'):
+            path = target.lstrip('/')
+        else:
+            path = posixpath.normpath(posixpath.join(directory, target))
+        rel_type = rel.get('Type', '').rpartition('/')[2]
+        relationships[rel.get('Id')] = (rel_type, path)
+
+    return relationships
+
+
+def find_workbook_part(zip_file):
+    """Locate the main workbook part of the package"""
+    for rel_type, path in _read_relationships(zip_file, '').values():
+        if rel_type == OFFICE_DOCUMENT_REL:
+            return path
+    return 'xl/workbook.xml'
+
+
+def read_sheet_paths(zip_file):
+    """Return (sheet name, part path) pairs in workbook order"""
+    workbook_part = find_workbook_part(zip_file)
+    relationships = _read_relationships(zip_file, workbook_part)
+    sheets = []
+
+    root = read_part_xml(zip_file, workbook_part)
+
+    for elem in root.iter():
+        if _local_name(elem.tag) != 'sheet':
+            continue
+        rel_id = None
+        for key, value in elem.attrib.items():
+            if _local_name(key) == 'id':
+                rel_id = value
+        rel_type, path = relationships.get(rel_id, (None, None))
+        sheets.append((elem.get('name'), path if rel_type == WORKSHEET_REL else None))
+
+    return sheets
+
+
+def iter_sheet_formulas(zip_file, sheet_path, used_range=None):
+    """Stream a worksheet part and yield (cell, formula, kind) for every formula cell
+
+    Only <f> elements are materialised: constant cells are discarded as soon as
+    they have been parsed. Shared formulas are expanded by translating the
+    master formula to each dependent cell. The formula text is returned without
+    the leading '='. When used_range is a list, it is set to the last row and
+    column holding a cell once the whole sheet has been read.
+    """
+    shared_formulas = {}
+    sheet_data = None
+    current_row = 0
+    current_col = 0
+    last_row = 0
+    last_col = 0
+    cell_ref = None
+    formula = None
+
+    with zip_file.open(sheet_path) as f:
+        for event, elem in ET.iterparse(f, events=('start', 'end')):
+            tag = _local_name(elem.tag)
+
+            if event == 'start':
+                if tag == 'c':
+                    ref = elem.get('r')
+                    if ref:
+                        current_row, current_col = split_cell(ref)
+                    else:
+                        current_col += 1
+                    cell_ref = ref or f"{column_letter(current_col)}{current_row}"
+                    formula = None
+                    if current_row > last_row:
+                        last_row = current_row
+                    if current_col > last_col:
+                        last_col = current_col
+                elif tag == 'row':
+                    row = elem.get('r')
+                    current_row = int(row) if row else current_row + 1
+                    current_col = 0
+                elif tag == 'sheetData':
+                    sheet_data = elem
+                continue
+
+            if tag == 'f':
+                kind = elem.get('t', 'normal')
+                text = elem.text or ''
+                if kind == 'shared':
+                    index = elem.get('si')
+                    if text:
+                        shared_formulas[index] = (text, current_row, current_col)
+                    elif index in shared_formulas:
+                        master, master_row, master_col = shared_formulas[index]
+                        text = translate_formula(master, current_row - master_row, current_col - master_col)
+                elif kind == 'dataTable':
+                    inputs = ','.join(elem.get(key) for key in ('r1', 'r2') if elem.get(key))
+                    text = f"TABLE({inputs})"
+                if text:
+                    formula = (text, kind)
+            elif tag == 'c':
+                if formula:
+                    yield cell_ref, formula[0], formula[1]
+                elem.clear()
+            elif tag == 'row':
+                elem.clear()
+                if sheet_data is not None:
+                    sheet_data.remove(elem)
+
+    if used_range is not None:
+        used_range[:] = [last_row, last_col]
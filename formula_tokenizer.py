@@ -0,0 +1,149 @@
+# core/formula_tokenizer.py
+import re
+from collections import namedtuple
+from functools import lru_cache
+
+# Distinct normalized formulas whose parse is kept; a workbook rarely has more
+PARSE_CACHE_SIZE = 65536
+
+# One alternative per token kind, tried in order. References are recognised
+# in both A1 and R1C1 form, so normalized formulas tokenize the same way as
+# the formulas stored in the workbook.
+TOKEN_PATTERN = re.compile(r"""
+    (?P<string>"(?:[^"]|"")*")
+  | (?P<error>\#(?:NULL!|DIV/0!|VALUE!|REF!|NAME\?|NUM!|N/A|GETTING_DATA|SPILL!|CALC!))
+  | (?P<prefix>(?:'(?:[^']|'')*'|\[[^\]]*\][\w.]*|[A-Za-z_\\][\w.]*(?::[A-Za-z_][\w.]*)?)!)
+  | (?P<function>[A-Za-z_][\w.]*)(?=\()
+  | (?P<bool>(?:TRUE|FALSE)(?![\w.]))
+  | (?P<reference>(?<![\w.$])(?:
+        (?:R(?:\[-?\d+\]|\d+)?C(?:\[-?\d+\]|\d+)?|R(?:\[-?\d+\]|\d+)?|C(?:\[-?\d+\]|\d+)?)
+        (?::(?:R(?:\[-?\d+\]|\d+)?C(?:\[-?\d+\]|\d+)?|R(?:\[-?\d+\]|\d+)?|C(?:\[-?\d+\]|\d+)?))?
+      | \$?[A-Za-z]{1,3}\$?\d+(?::\$?[A-Za-z]{1,3}\$?\d+)?
+      | \$?[A-Za-z]{1,3}:\$?[A-Za-z]{1,3}
+      | \$?\d+:\$?\d+
+    )(?![\w.(\[]))
+  | (?P<structured>(?:[A-Za-z_\\][\w.]*)?\[(?:[^\[\]]|\[[^\]]*\])*\])
+  | (?P<number>(?:\d+\.?\d*|\.\d+)(?:[Ee][+-]?\d+)?)
+  | (?P<name>[A-Za-z_\\][\w.?\\]*)
+  | (?P<operator><>|<=|>=|[-+*/^&=<>%:@\#])
+  | (?P<paren>[(){}])
+  | (?P<separator>[,;])
+  | (?P<space>\s+)
+  | (?P<other>.)
+""", re.VERBOSE)
+
+# Function names that decide the formula type, checked in this order
+LOOKUP_FUNCTIONS = frozenset({'VLOOKUP', 'HLOOKUP', 'XLOOKUP', 'LOOKUP'})
+AGGREGATION_FUNCTIONS = frozenset({
+    'SUM', 'SUMIF', 'SUMIFS', 'SUMPRODUCT', 'AVERAGE', 'AVERAGEIF', 'AVERAGEIFS',
+    'COUNT', 'COUNTA', 'COUNTIF', 'COUNTIFS', 'MIN', 'MAX', 'SUBTOTAL', 'AGGREGATE'
+})
+CONDITIONAL_FUNCTIONS = frozenset({'IF', 'IFS', 'IFERROR', 'IFNA', 'SWITCH'})
+
+# Worksheet functions that pull data from outside the workbook
+CONNECTION_FUNCTIONS = frozenset({
+    'SQL.REQUEST', 'RTD', 'DDE', 'WEBSERVICE', 'STOCKHISTORY', 'CUBEVALUE', 'CUBEMEMBER',
+    'CUBESET', 'CUBESETCOUNT', 'CUBERANKEDMEMBER', 'CUBEMEMBERPROPERTY', 'CUBEKPIMEMBER'
+})
+
+# Connection strings and add-in function names, such as DBConnect or
+# "DSN=Sales;Server=...", that point at an external data source
+CONNECTION_PATTERN = re.compile(
+    r'ODBC|OLE ?DB|\bADO(?:DB)?\b|connect|'
+    r'\b(?:DSN|Provider|Data Source|Driver|Server|Database|Initial Catalog)\s*=',
+    re.IGNORECASE
+)
+
+# Prefixes Excel writes in front of functions added after Excel 2007
+FUNCTION_PREFIXES = ('_xlfn._xlws.', '_xlfn.', '_xlws.')
+
+Token = namedtuple('Token', ['kind', 'text'])
+
+ParsedFormula = namedtuple('ParsedFormula', [
+    'tokens',           # tuple of Token, whitespace removed
+    'functions',        # distinct upper-case function names in order of appearance
+    'references',       # cell and range references, with their sheet prefix
+    'external_links',   # prefixes that point into another workbook, e.g. [1]Sheet1!
+    'literals',         # string, number, boolean and error constants
+    'formula_type',     # lookup, aggregation, conditional or other
+    'is_connection'     # whether the formula reads from an external data source
+])
+
+
+def tokenize(formula):
+    """Split a formula into tokens; the leading '=' is dropped"""
+    if formula.startswith('='):
+        formula = formula[1:]
+    tokens = []
+    for match in TOKEN_PATTERN.finditer(formula):
+        kind = match.lastgroup
+        if kind != 'space':
+            tokens.append(Token(kind, match.group(kind)))
+    return tuple(tokens)
+
+
+def _function_name(text):
+    """Upper-case a function name and drop the _xlfn. style prefixes"""
+    name = text.upper()
+    for prefix in FUNCTION_PREFIXES:
+        if name.startswith(prefix.upper()):
+            return name[len(prefix):]
+    return name
+
+
+def classify(functions):
+    """Formula type from the functions it calls"""
+    if not LOOKUP_FUNCTIONS.isdisjoint(functions):
+        return 'lookup'
+    if not AGGREGATION_FUNCTIONS.isdisjoint(functions):
+        return 'aggregation'
+    if not CONDITIONAL_FUNCTIONS.isdisjoint(functions):
+        return 'conditional'
+    return 'other'
+
+
+@lru_cache(maxsize=PARSE_CACHE_SIZE)
+def parse_formula(formula):
+    """Tokenize a formula and extract what the analyzer needs in one pass
+
+    Call it with the normalized (R1C1) formula so that a formula filled
+    across a range is parsed once and served from the cache afterwards.
+    """
+    tokens = tokenize(formula)
+    functions = {}
+    references = []
+    external_links = []
+    literals = []
+    is_connection = False
+    prefix = ''
+
+    for kind, text in tokens:
+        if kind == 'function':
+            name = _function_name(text)
+            functions[name] = None
+            if name in CONNECTION_FUNCTIONS or CONNECTION_PATTERN.search(name):
+                is_connection = True
+        elif kind == 'prefix':
+            prefix = text
+            # [1]Sheet1! in the file, [Book.xlsx]Sheet1! or 'C:\dir\[Book.xlsx]Sheet1'! when typed
+            if '[' in text:
+                external_links.append(text)
+                is_connection = True
+            continue
+        elif kind in ('reference', 'structured'):
+            references.append(prefix + text)
+        elif kind in ('string', 'number', 'bool', 'error'):
+            literals.append(text)
+            if kind == 'string' and CONNECTION_PATTERN.search(text):
+                is_connection = True
+        prefix = ''
+
+    return ParsedFormula(
+        tokens=tokens,
+        functions=tuple(functions),
+        references=tuple(references),
+        external_links=tuple(external_links),
+        literals=tuple(literals),
+        formula_type=classify(functions),
+        is_connection=is_connection
+    )
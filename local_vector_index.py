@@ -0,0 +1,513 @@
+# embedding/local_vector_index.py
+import os
+import json
+import threading
+import numpy as np
+from itertools import islice
+from operator import itemgetter
+from config.settings import (
+    EMBEDDING_DIMENSION, STORE_BATCH_SIZE, LOCAL_VECTOR_STORE_PATH,
+    VECTOR_QUANTIZATION, VECTOR_RERANK_FACTOR
+)
+
+# Content types are stored as one byte per row in the sidecar table
+CONTENT_TYPES = ('euda', 'macro', 'formula')
+
+# Rows scored per matrix multiplication during a search
+SEARCH_BLOCK_ROWS = 16384
+
+# Compact matrix used for candidate retrieval, per quantization mode
+QUANTIZED_DTYPES = {'halfvec': np.float16, 'int8': np.int8}
+
+
+class LocalVectorIndex:
+    """Append-only float32 vector matrix in memory-mapped files with a sidecar id table
+
+    Files in the index directory:
+        vectors.f32   unit-normalised embeddings, capacity x dimension
+        euda_ids.i64  owning EUDA id per row
+        content_ids.i64  id of the embedded EUDA, macro or formula per row
+        types.u8      content type code per row
+        quantized.*   compact copy of the vectors, when quantization is enabled
+        scales.f32    per-row int8 scale factors
+        meta.json     row count, capacity, dimension and quantization
+
+    Rows past the count in meta.json are ignored, so a crash during an
+    append leaves the index at its last committed state.
+
+    With quantization, searches scan the float16 or int8 matrix for
+    candidates and re-rank them against the float32 rows, so only the
+    compact matrix has to stay resident in memory.
+    """
+
+    def __init__(self, directory, dimension=EMBEDDING_DIMENSION, initial_capacity=1024,
+                 quantization=None, rerank_factor=None):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+
+        meta = self._read_meta()
+        self.dimension = meta.get('dimension', dimension)
+        self.count = meta.get('count', 0)
+        self.capacity = meta.get('capacity', initial_capacity)
+        self.quantization = (quantization or VECTOR_QUANTIZATION).lower()
+        if self.quantization != 'none' and self.quantization not in QUANTIZED_DTYPES:
+            raise ValueError(f"Unsupported vector quantization for the local index: {self.quantization}")
+        self.rerank_factor = rerank_factor or VECTOR_RERANK_FACTOR
+        # Rows appended since the last commit
+        self._pending = 0
+        self._open_files()
+
+        # Quantize existing rows when the index was built with another mode
+        if meta and self.quantization != meta.get('quantization', 'none'):
+            if self.quantization != 'none':
+                for start in range(0, self.count, SEARCH_BLOCK_ROWS):
+                    stop = min(self.count, start + SEARCH_BLOCK_ROWS)
+                    self._quantize(start, stop, self.vectors[start:stop])
+                self.flush()
+            self._write_meta()
+
+    def _path(self, name):
+        return os.path.join(self.directory, name)
+
+    def _read_meta(self):
+        try:
+            with open(self._path('meta.json'), 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+
+    def _write_meta(self):
+        """Atomically record the committed row count"""
+        temp_path = self._path('meta.json.tmp')
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump({
+                'count': self.count,
+                'capacity': self.capacity,
+                'dimension': self.dimension,
+                'quantization': self.quantization
+            }, f)
+        os.replace(temp_path, self._path('meta.json'))
+
+    def _map(self, name, dtype, shape):
+        """Memory-map a file, creating or growing it to the given shape"""
+        path = self._path(name)
+        size = int(np.prod(shape)) * np.dtype(dtype).itemsize
+        with open(path, 'ab') as f:
+            if f.tell() < size:
+                f.truncate(size)
+        return np.memmap(path, dtype=dtype, mode='r+', shape=shape)
+
+    def _open_files(self):
+        self.vectors = self._map('vectors.f32', np.float32, (self.capacity, self.dimension))
+        self.euda_ids = self._map('euda_ids.i64', np.int64, (self.capacity,))
+        self.content_ids = self._map('content_ids.i64', np.int64, (self.capacity,))
+        self.types = self._map('types.u8', np.uint8, (self.capacity,))
+        self.quantized = None
+        self.scales = None
+        if self.quantization != 'none':
+            dtype = QUANTIZED_DTYPES[self.quantization]
+            self.quantized = self._map(f'quantized.{np.dtype(dtype).name}', dtype, (self.capacity, self.dimension))
+        if self.quantization == 'int8':
+            self.scales = self._map('scales.f32', np.float32, (self.capacity,))
+
+    def _quantize(self, start, stop, matrix):
+        """Write the compact copy of rows start:stop"""
+        if self.quantization == 'halfvec':
+            self.quantized[start:stop] = matrix
+        elif self.quantization == 'int8':
+            # Symmetric per-row scaling onto [-127, 127]
+            scales = np.abs(matrix).max(axis=1) / 127
+            scales[scales == 0] = 1
+            self.quantized[start:stop] = np.rint(matrix / scales[:, None])
+            self.scales[start:stop] = scales
+
+    def _reserve(self, rows):
+        """Grow the files geometrically so appends stay amortised O(1)"""
+        needed = self._pending_end() + rows
+        if needed <= self.capacity:
+            return
+        capacity = self.capacity
+        while capacity < needed:
+            capacity *= 2
+        self.flush()
+        self.capacity = capacity
+        self._open_files()
+
+    def append(self, euda_id, content_type, content_ids, embeddings):
+        """Append embeddings for content of one type; they are searchable after commit()"""
+        if not len(content_ids):
+            return
+        matrix = np.asarray(embeddings, dtype=np.float32).reshape(len(content_ids), self.dimension)
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        matrix = matrix / np.where(norms == 0, 1, norms)
+
+        with self._lock:
+            self._reserve(len(matrix))
+            rows = slice(self._pending_end(), self._pending_end() + len(matrix))
+            self.vectors[rows] = matrix
+            self.euda_ids[rows] = euda_id
+            self.content_ids[rows] = content_ids
+            self.types[rows] = CONTENT_TYPES.index(content_type)
+            if self.quantization != 'none':
+                self._quantize(rows.start, rows.stop, matrix)
+            self._pending += len(matrix)
+
+    def _pending_end(self):
+        return self.count + self._pending
+
+    def commit(self):
+        """Flush appended rows and make them visible"""
+        with self._lock:
+            self.flush()
+            self.count = self._pending_end()
+            self._pending = 0
+            self._write_meta()
+
+    def rollback(self):
+        """Discard rows appended since the last commit"""
+        with self._lock:
+            self._pending = 0
+
+    def flush(self):
+        for array in (self.vectors, self.euda_ids, self.content_ids, self.types, self.quantized, self.scales):
+            if array is not None:
+                array.flush()
+
+    def _block_scores(self, start, stop, queries):
+        """Score rows start:stop against the queries on the matrix used for retrieval"""
+        if self.quantization == 'none':
+            return self.vectors[start:stop] @ queries.T
+        scores = self.quantized[start:stop].astype(np.float32) @ queries.T
+        if self.scales is not None:
+            scores *= self.scales[start:stop, None]
+        return scores
+
+    def search(self, queries, k=5, content_type=None, euda_ids=None):
+        """Return the top-k (row, score) pairs by cosine similarity for each query
+
+        Queries are scored together with one matrix multiplication per block of
+        rows, and the running top-k is kept with argpartition, so the cost is
+        one pass over the matrix regardless of the number of queries.
+        euda_ids restricts the search to rows owned by those EUDAs.
+        """
+        queries = np.atleast_2d(np.asarray(queries, dtype=np.float32))
+        norms = np.linalg.norm(queries, axis=1, keepdims=True)
+        queries = queries / np.where(norms == 0, 1, norms)
+        count = self.count
+        type_code = CONTENT_TYPES.index(content_type) if content_type else None
+        if euda_ids is not None:
+            euda_ids = np.asarray(list(euda_ids), dtype=np.int64)
+        candidates = k if self.quantization == 'none' else k * self.rerank_factor
+
+        best_scores = np.full((0, len(queries)), -np.inf, dtype=np.float32)
+        best_rows = np.zeros((0, len(queries)), dtype=np.int64)
+
+        for start in range(0, count, SEARCH_BLOCK_ROWS):
+            stop = min(count, start + SEARCH_BLOCK_ROWS)
+            scores = self._block_scores(start, stop, queries)
+            if type_code is not None:
+                scores[self.types[start:stop] != type_code] = -np.inf
+            if euda_ids is not None:
+                scores[~np.isin(self.euda_ids[start:stop], euda_ids)] = -np.inf
+
+            rows = np.broadcast_to(np.arange(start, stop)[:, None], scores.shape)
+            scores = np.concatenate([best_scores, scores])
+            rows = np.concatenate([best_rows, rows])
+            if len(scores) > candidates:
+                top = np.argpartition(-scores, candidates - 1, axis=0)[:candidates]
+                scores = np.take_along_axis(scores, top, axis=0)
+                rows = np.take_along_axis(rows, top, axis=0)
+            best_scores, best_rows = scores, rows
+
+        results = []
+        for column in range(len(queries)):
+            valid = np.isfinite(best_scores[:, column])
+            rows = best_rows[valid, column]
+            scores = best_scores[valid, column]
+            if self.quantization != 'none' and len(rows):
+                # Re-rank the candidates against the full-precision rows
+                rows = np.sort(rows)
+                scores = self.vectors[rows] @ queries[column]
+            order = np.argsort(-scores, kind='stable')[:k]
+            results.append([(int(rows[i]), float(scores[i])) for i in order])
+        return results
+
+class LocalVectorStore:
+    """VectorStore backend that keeps embeddings in a local memory-mapped index
+
+    Intended for offline analysis runs and CI where PostgreSQL with pgvector
+    is not available. EUDA, macro and formula records are kept in append-only
+    JSON lines files next to the index.
+    """
+
+    # Records are append-only, so store_euda cannot update an EUDA in place
+    supports_upsert = False
+
+    def __init__(self, directory=None, embedder=None, quantization=None, rerank_factor=None):
+        self.directory = directory or LOCAL_VECTOR_STORE_PATH
+        self.index = LocalVectorIndex(
+            os.path.join(self.directory, 'index'),
+            quantization=quantization,
+            rerank_factor=rerank_factor
+        )
+        if embedder is None:
+            from embedding.vector_embedder import TitanEmbedder
+            embedder = TitanEmbedder.shared()
+        self.embedder = embedder
+        self._lock = threading.Lock()
+
+        self.eudas = {}
+        self.next_ids = {'euda': 1, 'macro': 1, 'formula': 1}
+        for record in self._read_records('eudas.jsonl'):
+            self.eudas[record['id']] = record
+        self._load_counters()
+
+    def _path(self, name):
+        return os.path.join(self.directory, name)
+
+    def _read_records(self, name):
+        try:
+            with open(self._path(name), 'r', encoding='utf-8') as f:
+                for line in f:
+                    if line.strip():
+                        yield json.loads(line)
+        except FileNotFoundError:
+            return
+
+    def _load_counters(self):
+        try:
+            with open(self._path('counters.json'), 'r', encoding='utf-8') as f:
+                self.next_ids.update(json.load(f))
+        except FileNotFoundError:
+            pass
+
+    def _save_counters(self):
+        temp_path = self._path('counters.json.tmp')
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.next_ids, f)
+        os.replace(temp_path, self._path('counters.json'))
+
+    def _allocate(self, kind, count):
+        start = self.next_ids[kind]
+        self.next_ids[kind] += count
+        return list(range(start, start + count))
+
+    def _append_records(self, name, records):
+        with open(self._path(name), 'a', encoding='utf-8') as f:
+            for record in records:
+                f.write(json.dumps(record, default=str) + '\n')
+
+    def store_euda(self, euda_info, analysis=None):
+        """Store EUDA information and generate embeddings"""
+        with self._lock:
+            try:
+                euda_id = self._allocate('euda', 1)[0]
+                record = {
+                    'id': euda_id,
+                    'filename': euda_info.get('filename'),
+                    'file_path': euda_info.get('file_path'),
+                    'complexity_score': euda_info.get('complexity_score'),
+                    'has_macros': euda_info.get('has_macros'),
+                    'has_formulas': euda_info.get('has_formulas'),
+                    'has_external_connections': euda_info.get('has_external_connections'),
+                    'data_sensitivity': analysis.get('data_sensitivity') if analysis else 'Unknown',
+                    'description': analysis.get('description') if analysis else None,
+                    'purpose': analysis.get('purpose') if analysis else None,
+                    'dependency_metrics': euda_info.get('dependency_metrics')
+                }
+
+                embedding = self.embedder.generate_euda_embedding(euda_info)
+                if embedding:
+                    self.index.append(euda_id, 'euda', [euda_id], [embedding])
+
+                macros = euda_info.get('macros') or []
+                macro_ids = self._allocate('macro', len(macros))
+                self._store_content(euda_id, 'macro', macro_ids,
+                                    self._iter_embeddings(self.embedder.generate_macro_embeddings, macros))
+                self._append_records('macros.jsonl', (
+                    {'id': macro_id, 'euda_id': euda_id, 'macro_name': macro.get('name'),
+                     'purpose': macro.get('purpose'), 'complexity_score': macro.get('complexity', 0)}
+                    for macro_id, macro in zip(macro_ids, macros)
+                ))
+
+                # Formula groups share one embedding per logical formula, like VectorStore
+                if euda_info.get('formula_groups'):
+                    formulas = sorted(euda_info['formula_groups'], key=itemgetter('normalized'))
+                    embeddings = self.embedder.iter_formula_group_embeddings(formulas)
+                else:
+                    formulas = euda_info.get('formulas') or []
+                    embeddings = self._iter_embeddings(self.embedder.generate_formula_embeddings, formulas)
+                formula_ids = self._allocate('formula', len(formulas))
+                self._store_content(euda_id, 'formula', formula_ids, embeddings)
+                self._append_records('formulas.jsonl', (
+                    {'id': formula_id, 'euda_id': euda_id, 'worksheet': formula.get('sheet'),
+                     'cell_reference': formula.get('cell'), 'formula': formula.get('formula'),
+                     'normalized_formula': formula.get('normalized'),
+                     'cell_ranges': ' '.join(formula['ranges']) if formula.get('ranges') else None,
+                     'cell_count': formula.get('cell_count', 1)}
+                    for formula_id, formula in zip(formula_ids, formulas)
+                ))
+
+                # The EUDA record is written last and marks the EUDA as stored
+                self.index.commit()
+                self._append_records('eudas.jsonl', [record])
+                self._save_counters()
+                self.eudas[euda_id] = record
+                return euda_id
+            except Exception as e:
+                print(f"Error storing EUDA: {str(e)}")
+                self.index.rollback()
+                return None
+
+    def _iter_embeddings(self, generate, items):
+        """Yield embeddings for items, generating them one batch at a time"""
+        for start in range(0, len(items), STORE_BATCH_SIZE):
+            yield from generate(items[start:start + STORE_BATCH_SIZE])
+
+    def _store_content(self, euda_id, content_type, content_ids, embeddings):
+        """Append the successful embeddings to the index in batches"""
+        pairs = zip(content_ids, embeddings)
+        while True:
+            batch = list(islice(pairs, STORE_BATCH_SIZE))
+            if not batch:
+                break
+            kept = [(content_id, embedding) for content_id, embedding in batch if embedding]
+            if kept:
+                self.index.append(euda_id, content_type, [c for c, _ in kept], [e for _, e in kept])
+
+    def search_similar_eudas(self, query, limit=5, ef_search=None, probes=None):
+        """Search for similar EUDAs using vector similarity
+
+        ef_search and probes are accepted for compatibility with VectorStore;
+        the local index is searched exhaustively.
+        """
+        try:
+            query_embedding = self.embedder.embed_text(query)
+            if not query_embedding:
+                return []
+
+            results = []
+            for row, score in self.index.search([query_embedding], limit, 'euda')[0]:
+                record = self.eudas.get(int(self.index.content_ids[row]))
+                if not record:
+                    continue
+                results.append({
+                    'id': record['id'],
+                    'filename': record['filename'],
+                    'complexity_score': record['complexity_score'],
+                    'description': record['description'],
+                    'purpose': record['purpose'],
+                    'similarity': score
+                })
+            return results
+        except Exception as e:
+            print(f"Error searching similar EUDAs: {str(e)}")
+            return []
+
+    def _matches(self, record, filters):
+        """Evaluate EUDA filters with the same semantics as VectorStore._filter_sql"""
+        for name, value in filters.items():
+            if value is None:
+                continue
+            if name in ('has_macros', 'has_formulas', 'has_external_connections'):
+                if record.get(name) is None or bool(record[name]) != bool(value):
+                    return False
+            elif name in ('min_complexity', 'max_complexity'):
+                score = record.get('complexity_score')
+                if score is None:
+                    return False
+                if name == 'min_complexity' and score < value:
+                    return False
+                if name == 'max_complexity' and score > value:
+                    return False
+            elif name == 'data_sensitivity':
+                allowed = [value] if isinstance(value, str) else list(value)
+                if record.get('data_sensitivity') not in allowed:
+                    return False
+            else:
+                raise ValueError(f"Unknown search filter: {name}")
+        return True
+
+    def _content_records(self, content_type, ids):
+        """Load macro or formula records by id from their JSON lines file"""
+        wanted = set(ids)
+        records = {}
+        if not wanted:
+            return records
+        for record in self._read_records(f'{content_type}s.jsonl'):
+            if record['id'] in wanted:
+                records[record['id']] = record
+        return records
+
+    def search_many(self, queries, content_type='euda', limit=5, filters=None,
+                    ef_search=None, probes=None, iterative_scan=None):
+        """Run many similarity searches with one batch of embeddings and one index pass
+
+        Mirrors VectorStore.search_many; index tuning parameters are ignored.
+        """
+        if content_type not in CONTENT_TYPES:
+            raise ValueError(f"Unknown content type: {content_type}")
+        queries = list(queries)
+        if not queries:
+            return []
+
+        euda_ids = None
+        if filters:
+            euda_ids = [euda_id for euda_id, record in self.eudas.items() if self._matches(record, filters)]
+
+        try:
+            embeddings = self.embedder.embed_texts(queries)
+            positions = [i for i, embedding in enumerate(embeddings) if embedding]
+            results = [[] for _ in queries]
+            if not positions:
+                return results
+
+            found = self.index.search([embeddings[i] for i in positions], limit, content_type, euda_ids)
+            hits = [
+                [(int(self.index.euda_ids[row]), int(self.index.content_ids[row]), score) for row, score in matches]
+                for matches in found
+            ]
+            details = {}
+            if content_type != 'euda':
+                details = self._content_records(content_type, (hit[1] for matches in hits for hit in matches))
+
+            for position, matches in zip(positions, hits):
+                for euda_id, content_id, score in matches:
+                    record = self.eudas.get(euda_id)
+                    if not record:
+                        continue
+                    result = {
+                        'id': content_id,
+                        'euda_id': euda_id,
+                        'content_type': content_type,
+                        'filename': record['filename'],
+                        'complexity_score': record['complexity_score'],
+                        'description': record['description'],
+                        'purpose': record['purpose'],
+                        'similarity': score
+                    }
+                    detail = details.get(content_id, {})
+                    if content_type == 'macro':
+                        result.update({
+                            'macro_name': detail.get('macro_name'),
+                            'macro_purpose': detail.get('purpose'),
+                            'macro_complexity': detail.get('complexity_score')
+                        })
+                    elif content_type == 'formula':
+                        result.update({
+                            'worksheet': detail.get('worksheet'),
+                            'cell_reference': detail.get('cell_reference'),
+                            'formula': detail.get('formula'),
+                            'cell_ranges': detail.get('cell_ranges'),
+                            'cell_count': detail.get('cell_count', 1)
+                        })
+                    results[position].append(result)
+            return results
+        except Exception as e:
+            print(f"Error running batched similarity search: {str(e)}")
+            return [[] for _ in queries]
+
+    def close(self):
+        """Flush the index files"""
+        self.index.flush()
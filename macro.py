@@ -1,18 +1,30 @@
 # core/macro_extractor.py
 import os
-import zipfile
-import re
-import xml.etree.ElementTree as ET
-from io import BytesIO
+from contextlib import nullcontext
+from core.workbook_reader import WorkbookReader
+from core.vba_project import VBAProject, VBAProjectError
+from core.vba_lexer import analyze_vba, uses_category, is_event_handler
+from core import metrics
 
 class MacroExtractor:
-    def __init__(self, file_path):
+    def __init__(self, file_path, reader=None):
         self.file_path = file_path
+        # A WorkbookReader shared with the analyzer, so the file is not opened again
+        self.reader = reader
         self.macros = []
         self.error = None
         
+    @metrics.timed('macro_extract_seconds')
     def extract_macros(self):
         """Extract VBA macros from Excel files"""
+        extracted = self._extract_macros()
+        if metrics.registry.enabled:
+            metrics.increment('macro_files_extracted_total', status='ok' if extracted else 'failed')
+            metrics.increment('macro_modules_extracted_total', len(self.macros))
+            metrics.increment('macro_code_bytes_total', sum(len(macro['code']) for macro in self.macros))
+        return extracted
+    
+    def _extract_macros(self):
         try:
             # Check if file exists
             if not os.path.exists(self.file_path):
@@ -38,95 +50,31 @@ class MacroExtractor:
     def _extract_macros_from_xlsm(self):
         """Extract macros from XLSM file (ZIP archive)"""
         try:
-            with zipfile.ZipFile(self.file_path, 'r') as z:
+            with nullcontext(self.reader) if self.reader else WorkbookReader(self.file_path) as z:
                 # Look for vbaProject.bin
-                if 'xl/vbaProject.bin' not in z.namelist():
+                if not z.has_part('xl/vbaProject.bin'):
                     self.error = "No VBA project found in the file"
                     return False
                 
-                # Extract module information from the XML files
-                vba_modules = self._find_vba_modules(z)
-                
-                # For each module, extract the code
-                for module in vba_modules:
-                    module_code = self._extract_module_code(z, module)
-                    if module_code:
-                        self.macros.append({
-                            'name': module['name'],
-                            'type': module['type'],
-                            'code': module_code
-                        })
-                
-                return len(self.macros) > 0
+                vba_data = z.read('xl/vbaProject.bin')
         except Exception as e:
             self.error = f"Error opening ZIP archive: {str(e)}"
             return False
-    
-    def _find_vba_modules(self, zip_file):
-        """Find VBA modules in the Excel file"""
-        modules = []
         
         try:
-            # Check if we have the vbaProject.xml file that contains module info
-            if 'xl/vbaProject.xml' in zip_file.namelist():
-                with zip_file.open('xl/vbaProject.xml') as f:
-                    tree = ET.parse(f)
-                    root = tree.getroot()
-                    
-                    # Find modules in the XML
-                    for module_elem in root.findall('.//{*}module'):
-                        name = module_elem.get('name', 'Unknown')
-                        module_type = module_elem.get('type', 'Standard')
-                        modules.append({
-                            'name': name,
-                            'type': module_type
-                        })
-            
-            # If we couldn't find the XML, try to deduce from file structure
-            if not modules:
-                for filename in zip_file.namelist():
-                    if filename.startswith('xl/vba/'):
-                        name = os.path.splitext(os.path.basename(filename))[0]
-                        modules.append({
-                            'name': name,
-                            'type': 'Standard'  # Assume standard module
-                        })
-        except Exception as e:
-            print(f"Error finding VBA modules: {str(e)}")
+            # Parse the dir stream once and decompress every module's source
+            project = VBAProject(vba_data)
+            for module in project.iter_modules():
+                self.macros.append({
+                    'name': module['name'],
+                    'type': module['type'],
+                    'code': module['code']
+                })
+        except VBAProjectError as e:
+            self.error = f"Error parsing VBA project: {str(e)}"
+            return False
         
-        return modules
-    
-    def _extract_module_code(self, zip_file, module):
-        """Extract code from a VBA module"""
-        # Note: This is a simplified approach. Advanced macro extraction
-        # requires specialized libraries to parse the binary vbaProject.bin
-        
-        # Try some common paths where code might be stored
-        potential_paths = [
-            f"xl/vba/{module['name']}.bas",
-            f"xl/vba/{module['name']}.cls",
-            f"xl/modules/{module['name']}.bas"
-        ]
-        
-        for path in potential_paths:
-            if path in zip_file.namelist():
-                with zip_file.open(path) as f:
-                    return f.read().decode('utf-8', errors='ignore')
-        
-        # If we couldn't find the module file, try to extract from vbaProject.bin
-        # This is a very simplistic approach as proper extraction requires specialized parsing
-        try:
-            with zip_file.open('xl/vbaProject.bin') as f:
-                content = f.read()
-                # Look for the module name followed by potential code
-                pattern = f"{module['name']}.*?Sub|Function|Property".encode('utf-8')
-                matches = re.findall(pattern, content, re.DOTALL)
-                if matches:
-                    return matches[0].decode('utf-8', errors='ignore')
-        except Exception:
-            pass
-        
-        return f"// Code extraction not possible. Module: {module['name']}"
+        return len(self.macros) > 0
     
     def analyze_macros(self):
         """Analyze the extracted macros to determine their purpose and complexity"""
@@ -151,45 +99,45 @@ class MacroExtractor:
             'has_user_interface': False
         }
         
-        # Convert to lowercase for case-insensitive matching
-        code_lower = code.lower()
+        # Tokenize the module once, ignoring comments and string literals
+        vba_metrics = analyze_vba(code)
+        api_usage = vba_metrics['api_usage']
+        identifiers = vba_metrics['identifiers']
         
         # Check for database interactions
-        if ('adodb' in code_lower or 'connection' in code_lower or 'recordset' in code_lower or 
-            'sql' in code_lower or 'query' in code_lower):
+        if uses_category(api_usage, 'database') or vba_metrics['sql_strings']:
             result['interacts_with_database'] = True
             result['complexity'] += 15
         
         # Check for external file interactions
-        if ('open' in code_lower and ('for input' in code_lower or 'for output' in code_lower) or
-            'filesystemobject' in code_lower or 'createtextfile' in code_lower):
+        if vba_metrics['file_io'] or uses_category(api_usage, 'files'):
             result['interacts_with_external_files'] = True
             result['complexity'] += 10
         
         # Check for event handlers
-        if 'sub worksheet_' in code_lower or 'sub workbook_' in code_lower:
+        if any(is_event_handler(procedure) for procedure in vba_metrics['procedures']):
             result['handles_events'] = True
             result['complexity'] += 8
         
         # Check for UI elements
-        if ('msgbox' in code_lower or 'inputbox' in code_lower or 'userform' in code_lower or
-            'dialog' in code_lower):
+        if uses_category(api_usage, 'ui'):
             result['has_user_interface'] = True
             result['complexity'] += 12
         
         # Count loops and conditionals
-        loop_count = code_lower.count('for ') + code_lower.count('do while') + code_lower.count('do until')
-        if_count = code_lower.count('if ') 
-        result['complexity'] += (loop_count * 3) + (if_count * 2)
+        result['complexity'] += (vba_metrics['loop_count'] * 3) + (vba_metrics['branch_count'] * 2)
         
-        # Determine purpose based on keywords
-        if 'report' in code_lower or 'print' in code_lower:
+        # Determine purpose based on the identifiers used in the code
+        def mentions(*words):
+            return any(word in identifier for identifier in identifiers for word in words)
+        
+        if mentions('report', 'print'):
             result['purpose'] = 'Reporting'
-        elif 'import' in code_lower or 'export' in code_lower:
+        elif mentions('import', 'export'):
             result['purpose'] = 'Data Import/Export'
-        elif 'calculate' in code_lower or 'computation' in code_lower:
+        elif mentions('calculate', 'computation'):
             result['purpose'] = 'Calculation'
-        elif 'format' in code_lower or 'style' in code_lower:
+        elif mentions('format', 'style'):
             result['purpose'] = 'Formatting'
         elif result['has_user_interface']:
             result['purpose'] = 'User Interface'
@@ -199,6 +147,12 @@ class MacroExtractor:
         # Cap complexity at 100
         result['complexity'] = min(100, result['complexity'])
         
+        # Keep the detailed metrics alongside the summary flags
+        result['loop_count'] = vba_metrics['loop_count']
+        result['branch_count'] = vba_metrics['branch_count']
+        result['api_usage'] = dict(api_usage)
+        result['procedures'] = vba_metrics['procedures']
+        
         return result
     
     def get_summary(self):
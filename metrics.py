@@ -0,0 +1,229 @@
+# core/metrics.py
+import sys
+import json
+import time
+import threading
+from bisect import bisect_left
+from functools import wraps
+from config.settings import METRICS_ENABLED
+
+# Upper bounds of the latency histogram buckets, in seconds
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+def _label_key(labels):
+    return tuple(sorted(labels.items())) if labels else ()
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(key, extra=None):
+    items = list(key) + (list(extra) if extra else [])
+    if not items:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in items) + '}'
+
+
+class _NullTimer:
+    """Context manager used while metrics are disabled"""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+_NULL_TIMER = _NullTimer()
+
+
+class _Timer:
+    """Record the duration of a block, and count it as a failure if it raises"""
+
+    def __init__(self, registry, name, labels):
+        self.registry = registry
+        self.name = name
+        self.labels = labels
+        # excel_analyze_seconds counts failures in excel_analyze_failures_total
+        base = name[:-len('_seconds')] if name.endswith('_seconds') else name
+        self.failure_name = f'{base}_failures_total'
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.registry.observe(self.name, time.perf_counter() - self.started, **self.labels)
+        if exc_type is not None:
+            self.registry.increment(self.failure_name, **self.labels)
+        return False
+
+
+class MetricsRegistry:
+    """In-process counters and histograms with Prometheus text and JSON export
+
+    Every recording method returns immediately while the registry is
+    disabled, so instrumented code pays one attribute check per call.
+    """
+
+    def __init__(self, enabled=False, buckets=LATENCY_BUCKETS):
+        self.enabled = enabled
+        self.buckets = tuple(buckets)
+        self.counters = {}
+        self.histograms = {}
+        self._lock = threading.Lock()
+
+    def enable(self, enabled=True):
+        self.enabled = enabled
+
+    def increment(self, name, value=1, **labels):
+        """Add to a counter"""
+        if not self.enabled:
+            return
+        key = (name, _label_key(labels))
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name, value, **labels):
+        """Record a value in a histogram"""
+        if not self.enabled:
+            return
+        key = (name, _label_key(labels))
+        with self._lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = {
+                    'buckets': [0] * (len(self.buckets) + 1),
+                    'sum': 0.0,
+                    'count': 0
+                }
+            histogram['buckets'][bisect_left(self.buckets, value)] += 1
+            histogram['sum'] += value
+            histogram['count'] += 1
+
+    def timer(self, name, **labels):
+        """Context manager recording the duration of a block in seconds"""
+        if not self.enabled:
+            return _NULL_TIMER
+        return _Timer(self, name, labels)
+
+    def timed(self, name, **labels):
+        """Decorator recording the duration of each call in seconds"""
+        def decorator(func):
+            @wraps(func)
+            def wrapper(*args, **kwargs):
+                if not self.enabled:
+                    return func(*args, **kwargs)
+                with _Timer(self, name, labels):
+                    return func(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def snapshot(self, reset=False):
+        """Return a picklable copy of the metrics, optionally clearing them"""
+        with self._lock:
+            snapshot = {
+                'counters': [(name, list(key), value) for (name, key), value in self.counters.items()],
+                'histograms': [
+                    (name, list(key), list(h['buckets']), h['sum'], h['count'])
+                    for (name, key), h in self.histograms.items()
+                ]
+            }
+            if reset:
+                self.counters = {}
+                self.histograms = {}
+        return snapshot
+
+    def merge(self, snapshot):
+        """Add a snapshot from another process, e.g. a batch scan worker"""
+        if not snapshot:
+            return
+        with self._lock:
+            for name, key, value in snapshot['counters']:
+                key = (name, tuple(tuple(item) for item in key))
+                self.counters[key] = self.counters.get(key, 0) + value
+            for name, key, buckets, total, count in snapshot['histograms']:
+                key = (name, tuple(tuple(item) for item in key))
+                histogram = self.histograms.setdefault(key, {
+                    'buckets': [0] * (len(self.buckets) + 1),
+                    'sum': 0.0,
+                    'count': 0
+                })
+                histogram['buckets'] = [a + b for a, b in zip(histogram['buckets'], buckets)]
+                histogram['sum'] += total
+                histogram['count'] += count
+
+    def reset(self):
+        with self._lock:
+            self.counters = {}
+            self.histograms = {}
+
+    def export_prometheus(self):
+        """Render all metrics in the Prometheus text exposition format"""
+        lines = []
+        with self._lock:
+            counters = sorted(self.counters.items())
+            histograms = sorted(self.histograms.items())
+
+        declared = set()
+        for (name, key), value in counters:
+            if name not in declared:
+                lines.append(f'# TYPE {name} counter')
+                declared.add(name)
+            lines.append(f'{name}{_format_labels(key)} {value}')
+
+        for (name, key), histogram in histograms:
+            if name not in declared:
+                lines.append(f'# TYPE {name} histogram')
+                declared.add(name)
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), histogram['buckets']):
+                cumulative += count
+                le = '+Inf' if bound == float('inf') else repr(bound)
+                lines.append(f'{name}_bucket{_format_labels(key, [("le", le)])} {cumulative}')
+            lines.append(f'{name}_sum{_format_labels(key)} {histogram["sum"]}')
+            lines.append(f'{name}_count{_format_labels(key)} {histogram["count"]}')
+        return '\n'.join(lines) + '\n'
+
+    def export_json(self):
+        """Return the metrics as JSON-serialisable records"""
+        records = []
+        with self._lock:
+            for (name, key), value in sorted(self.counters.items()):
+                records.append({'metric': name, 'type': 'counter', 'labels': dict(key), 'value': value})
+            for (name, key), histogram in sorted(self.histograms.items()):
+                records.append({
+                    'metric': name,
+                    'type': 'histogram',
+                    'labels': dict(key),
+                    'count': histogram['count'],
+                    'sum': histogram['sum'],
+                    'buckets': dict(zip([str(b) for b in self.buckets] + ['+Inf'], histogram['buckets']))
+                })
+        return records
+
+    def log_json(self, stream=None):
+        """Write one structured JSON log line per metric"""
+        stream = stream or sys.stderr
+        timestamp = time.time()
+        for record in self.export_json():
+            record['timestamp'] = timestamp
+            stream.write(json.dumps(record) + '\n')
+
+    def write(self, path):
+        """Write Prometheus text, or JSON lines when the path ends in .json/.jsonl"""
+        with open(path, 'w', encoding='utf-8') as f:
+            if path.endswith(('.json', '.jsonl')):
+                self.log_json(f)
+            else:
+                f.write(self.export_prometheus())
+
+
+# Process-wide registry used by the instrumented modules
+registry = MetricsRegistry(enabled=METRICS_ENABLED)
+increment = registry.increment
+observe = registry.observe
+timer = registry.timer
+timed = registry.timed
@@ -0,0 +1,365 @@
+# core/pipeline.py
+import sys
+import json
+import time
+import asyncio
+import argparse
+import threading
+import multiprocessing
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from core.batch_scanner import PortfolioScanner, scan_file
+from core import metrics
+from config.settings import (
+    SCAN_MAX_WORKERS,
+    PIPELINE_EMBED_CONCURRENCY,
+    PIPELINE_STORE_CONCURRENCY,
+    PIPELINE_STORE_BATCH,
+    PIPELINE_QUEUE_SIZE
+)
+
+STAGES = ('parse', 'embed', 'store')
+
+# Marks the end of the work on a stage queue
+_DONE = object()
+
+
+def parse_workbook(file_path, max_formulas=None):
+    """Analyze a workbook in a worker process, returning its EUDA info and the worker's metrics"""
+    result = scan_file(file_path, include_details=True, max_formulas=max_formulas)
+    euda_info = result['summary']
+    if euda_info is None:
+        raise RuntimeError(result['error'])
+    euda_info.setdefault('macros', [])
+    # The macros are already on the EUDA; do not send them back twice
+    euda_info.get('macro_summary', {}).pop('macros', None)
+    # Formulas are stored and embedded as groups when there are any, so the
+    # per-cell records are not sent back or held in the stage queues
+    if euda_info.get('formula_groups'):
+        euda_info.pop('formulas', None)
+    return euda_info, result.get('metrics')
+
+
+class _StagedEmbeddings:
+    """Embeddings computed by the embed stage and held until the store stage has written them
+
+    It has the lookup interface of EmbeddingCache, so the store's embedder
+    serves these embeddings instead of calling Bedrock again. Misses fall
+    through to the persistent cache, when there is one.
+    """
+
+    def __init__(self, cache=None):
+        self.cache = cache
+        self._embeddings = {}
+        self._references = Counter()
+        self._lock = threading.Lock()
+
+    def hold(self, texts):
+        """Keep the embeddings of these texts until an EUDA using them is released"""
+        with self._lock:
+            self._references.update(texts)
+
+    def add(self, texts, embeddings):
+        with self._lock:
+            for text, embedding in zip(texts, embeddings):
+                if embedding and text in self._references:
+                    self._embeddings[text] = embedding
+
+    def missing(self, texts):
+        """The texts with no staged embedding"""
+        with self._lock:
+            return [text for text in texts if text not in self._embeddings]
+
+    def release(self, texts):
+        """Drop the embeddings of a stored EUDA unless another EUDA in flight uses them"""
+        with self._lock:
+            for text in texts:
+                self._references[text] -= 1
+                if self._references[text] <= 0:
+                    del self._references[text]
+                    self._embeddings.pop(text, None)
+
+    def get(self, model_id, text):
+        return self.get_many(model_id, [text])[0]
+
+    def get_many(self, model_id, texts):
+        with self._lock:
+            results = [self._embeddings.get(text) for text in texts]
+        missing = [index for index, result in enumerate(results) if result is None]
+        if missing and self.cache:
+            found = self.cache.get_many(model_id, [texts[index] for index in missing])
+            for index, embedding in zip(missing, found):
+                results[index] = embedding
+        return results
+
+    def put(self, model_id, text, embedding):
+        self.put_many(model_id, [(text, embedding)])
+
+    def put_many(self, model_id, items):
+        if self.cache:
+            self.cache.put_many(model_id, items)
+
+
+class _StageStats:
+    """Items, failures and busy time of one pipeline stage"""
+
+    def __init__(self, concurrency):
+        self.concurrency = concurrency
+        self.items = 0
+        self.failed = 0
+        self.busy = 0.0
+        self.max_queue = 0
+
+    def report(self, elapsed):
+        return {
+            'concurrency': self.concurrency,
+            'items': self.items,
+            'failed': self.failed,
+            'busy_seconds': round(self.busy, 3),
+            # Share of the stage's capacity that was in use over the run
+            'utilization': round(self.busy / (elapsed * self.concurrency), 3) if elapsed else 0.0,
+            'max_queue_depth': self.max_queue
+        }
+
+
+class IngestionPipeline:
+    """Parse, embed and store workbooks as concurrent stages joined by bounded queues
+
+    Parsing is CPU-bound and runs in a process pool, embedding waits on
+    Bedrock and runs in threads, storing waits on the database and writes
+    several EUDAs per batch. Each stage has its own concurrency limit and
+    the queues between stages hold at most queue_size workbooks, so a slow
+    stage holds back the ones before it. A queued workbook carries its
+    formula groups rather than per-cell records; with max_formulas the
+    records and groups of each workbook are bounded too. The embed stage
+    skips macros and formulas whose content the store already has.
+    """
+
+    def __init__(self, store=None, embedder=None, parse_workers=None, embed_concurrency=None,
+                 store_concurrency=None, store_batch_size=None, queue_size=None, max_formulas=None,
+                 upsert=False):
+        if embedder is None:
+            from embedding.vector_embedder import TitanEmbedder
+            embedder = TitanEmbedder.shared()
+        self.embedder = embedder
+        self.parse_workers = parse_workers or SCAN_MAX_WORKERS
+        self.embed_concurrency = embed_concurrency or PIPELINE_EMBED_CONCURRENCY
+        self.store_concurrency = store_concurrency or PIPELINE_STORE_CONCURRENCY
+        self.store_batch_size = store_batch_size or PIPELINE_STORE_BATCH
+        self.queue_size = queue_size or PIPELINE_QUEUE_SIZE
+        self.max_formulas = max_formulas
+        self.upsert = upsert
+        # Only the PostgreSQL store updates EUDAs in place; checked before a store is created
+        if upsert:
+            from embedding.vector_store import vector_store_class
+            store_class = type(store) if store is not None else vector_store_class()
+            if not getattr(store_class, 'supports_upsert', False):
+                raise ValueError(f"{store_class.__name__} does not support upsert")
+
+        # The store embeds through the staged embeddings, so it does not call Bedrock again
+        self._staged = _StagedEmbeddings(embedder.cache)
+        store_embedder = type(embedder)(bedrock_client=embedder.bedrock_client, cache=self._staged)
+        if store is None:
+            from embedding.vector_store import create_vector_store
+            store = create_vector_store(embedder=store_embedder)
+        else:
+            store.embedder = store_embedder
+        self.store = store
+
+    def run(self, source):
+        """Ingest every workbook of a directory tree, manifest or list of paths; returns the report"""
+        return asyncio.run(self.run_async(PortfolioScanner(max_workers=1).discover(source)))
+
+    async def run_async(self, paths):
+        """Ingest the given workbook paths and return per-file results and stage utilization"""
+        loop = asyncio.get_running_loop()
+        stats = {
+            'parse': _StageStats(self.parse_workers),
+            'embed': _StageStats(self.embed_concurrency),
+            'store': _StageStats(self.store_concurrency)
+        }
+        parsed = asyncio.Queue(self.queue_size)
+        embedded = asyncio.Queue(self.queue_size)
+        paths_queue = asyncio.Queue(self.queue_size)
+        results = []
+        # Text being embedded -> future resolved once its embedding is staged
+        in_flight = {}
+        started = time.perf_counter()
+
+        context = multiprocessing.get_context('spawn')
+        with ProcessPoolExecutor(max_workers=self.parse_workers, mp_context=context) as processes, \
+                ThreadPoolExecutor(max_workers=self.embed_concurrency + self.store_concurrency,
+                                   thread_name_prefix='pipeline') as threads:
+
+            async def feed():
+                for path in paths:
+                    await paths_queue.put(path)
+                    stats['parse'].max_queue = max(stats['parse'].max_queue, paths_queue.qsize())
+                for _ in range(self.parse_workers):
+                    await paths_queue.put(_DONE)
+
+            async def parse_worker():
+                while (path := await paths_queue.get()) is not _DONE:
+                    began = time.perf_counter()
+                    try:
+                        euda_info, snapshot = await loop.run_in_executor(
+                            processes, parse_workbook, path, self.max_formulas
+                        )
+                        metrics.registry.merge(snapshot)
+                    except Exception as e:
+                        stats['parse'].failed += 1
+                        results.append({'file_path': path, 'euda_id': None, 'error': str(e)})
+                        continue
+                    finally:
+                        stats['parse'].busy += time.perf_counter() - began
+                    stats['parse'].items += 1
+                    await parsed.put(euda_info)
+                    stats['embed'].max_queue = max(stats['embed'].max_queue, parsed.qsize())
+
+            async def embed_worker():
+                while (euda_info := await parsed.get()) is not _DONE:
+                    began = time.perf_counter()
+                    texts = list(dict.fromkeys(self.embedder.content_texts(euda_info)))
+                    # Held before the store is checked, so content another EUDA stores meanwhile
+                    # is either found in the store or still staged
+                    self._staged.hold(texts)
+                    unstored = await loop.run_in_executor(threads, self._unstored_texts, euda_info)
+                    # Texts another worker is already embedding are waited for, not embedded twice
+                    waiting = {in_flight[text] for text in unstored if text in in_flight}
+                    claimed = [text for text in self._staged.missing(unstored) if text not in in_flight]
+                    done = loop.create_future()
+                    in_flight.update((text, done) for text in claimed)
+                    try:
+                        embeddings = await loop.run_in_executor(threads, self.embedder.embed_texts, claimed)
+                    except Exception as e:
+                        # Failed embeddings are retried by the store's embedder
+                        print(f"Error embedding {euda_info.get('file_path')}: {str(e)}")
+                        stats['embed'].failed += 1
+                        embeddings = []
+                    finally:
+                        self._staged.add(claimed, embeddings)
+                        for text in claimed:
+                            del in_flight[text]
+                        done.set_result(None)
+                        stats['embed'].busy += time.perf_counter() - began
+                    if waiting:
+                        await asyncio.gather(*waiting)
+                    stats['embed'].items += 1
+                    await embedded.put((euda_info, texts))
+                    stats['store'].max_queue = max(stats['store'].max_queue, embedded.qsize())
+
+            async def store_worker():
+                finished = False
+                while not finished:
+                    # Wait for one EUDA, then take whatever else is ready up to the batch size
+                    batch = []
+                    item = await embedded.get()
+                    while item is not _DONE:
+                        batch.append(item)
+                        if len(batch) >= self.store_batch_size or embedded.empty():
+                            break
+                        item = embedded.get_nowait()
+                    finished = item is _DONE
+                    if not batch:
+                        continue
+
+                    began = time.perf_counter()
+                    stored = await loop.run_in_executor(threads, self._store_batch, batch)
+                    stats['store'].busy += time.perf_counter() - began
+                    for (euda_info, texts), euda_id in zip(batch, stored):
+                        self._staged.release(texts)
+                        if euda_id is None:
+                            stats['store'].failed += 1
+                        else:
+                            stats['store'].items += 1
+                        results.append({
+                            'file_path': euda_info.get('file_path'),
+                            'euda_id': euda_id,
+                            'error': None if euda_id is not None else "Failed to store EUDA"
+                        })
+
+            async def stage(workers, downstream, count):
+                """Run a stage's workers, then tell the next stage there is no more work"""
+                await asyncio.gather(*workers)
+                for _ in range(count):
+                    await downstream.put(_DONE)
+
+            await asyncio.gather(
+                feed(),
+                stage([parse_worker() for _ in range(self.parse_workers)], parsed, self.embed_concurrency),
+                stage([embed_worker() for _ in range(self.embed_concurrency)], embedded, self.store_concurrency),
+                *(store_worker() for _ in range(self.store_concurrency))
+            )
+
+        elapsed = time.perf_counter() - started
+        return {
+            'elapsed': round(elapsed, 3),
+            'files': len(results),
+            'failed': sum(1 for result in results if result['error']),
+            'stages': {name: stats[name].report(elapsed) for name in STAGES},
+            'results': results
+        }
+
+    def _unstored_texts(self, euda_info):
+        """Distinct texts of an EUDA, leaving out content whose embedding the store already has"""
+        macros = euda_info.get('macros') or []
+        formulas = euda_info.get('formula_groups') or euda_info.get('formulas') or []
+        # The PostgreSQL store keeps one embedding per content hash; the local store has no such lookup
+        missing_content = getattr(self.store, 'missing_content', None)
+        if missing_content:
+            macros = missing_content('macro', macros)
+            formulas = missing_content('formula', formulas)
+        return list(dict.fromkeys(self.embedder.content_texts(euda_info, macros, formulas)))
+
+    def _store_batch(self, batch):
+        """Store a batch of embedded EUDAs, each in its own transaction"""
+        # upsert is only passed when set, as the local store has no such parameter
+        options = {'upsert': True} if self.upsert else {}
+        return [self.store.store_euda(euda_info, **options) for euda_info, _ in batch]
+
+    def close(self):
+        self.store.close()
+
+
+def main(argv=None):
+    """Command line entry point for pipelined ingestion"""
+    parser = argparse.ArgumentParser(description="Analyze, embed and store EUDA workbooks as a pipeline")
+    parser.add_argument('source', help="Directory tree to walk or manifest file with one path per line")
+    parser.add_argument('--parse-workers', type=int, default=None, help="Processes analyzing workbooks")
+    parser.add_argument('--embed-concurrency', type=int, default=None, help="Workbooks embedded at once")
+    parser.add_argument('--store-concurrency', type=int, default=None, help="Store batches written at once")
+    parser.add_argument('--store-batch', type=int, default=None, help="Workbooks per store batch")
+    parser.add_argument('--queue-size', type=int, default=None, help="Workbooks waiting between two stages")
+    parser.add_argument('--max-formulas', type=int, default=None,
+                        help="Keep at most this many formula records per workbook (a uniform sample)")
+    parser.add_argument('--upsert', action='store_true', help="Update EUDAs already stored for the same file")
+    parser.add_argument('--output', default=None, help="Write the JSON report to this file instead of stdout")
+    args = parser.parse_args(argv)
+
+    try:
+        pipeline = IngestionPipeline(
+            parse_workers=args.parse_workers, embed_concurrency=args.embed_concurrency,
+            store_concurrency=args.store_concurrency, store_batch_size=args.store_batch,
+            queue_size=args.queue_size, max_formulas=args.max_formulas, upsert=args.upsert
+        )
+    except ValueError as e:
+        parser.error(str(e))
+    try:
+        report = pipeline.run(args.source)
+    finally:
+        pipeline.close()
+
+    text = json.dumps(report, indent=2, default=str)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(text)
+    else:
+        print(text)
+    print(f"Ingested {report['files']} files ({report['failed']} failed) in {report['elapsed']:.1f}s; utilization " +
+          ', '.join(f"{name} {stage['utilization']:.0%}" for name, stage in report['stages'].items()),
+          file=sys.stderr)
+    return 0 if report['failed'] == 0 else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
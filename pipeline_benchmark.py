@@ -0,0 +1,229 @@
+# benchmarks/pipeline_benchmark.py
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import tempfile
+import resource
+import multiprocessing
+from contextlib import contextmanager
+from concurrent.futures import ProcessPoolExecutor
+from benchmarks.synthetic_workbook import generate_workbook
+
+# Workbook shapes, from a typical departmental tool to a large model
+BENCHMARK_CASES = {
+    'small': {'sheets': 2, 'rows': 200, 'columns': 10, 'vba_modules': 2},
+    'medium': {'sheets': 5, 'rows': 1000, 'columns': 15, 'vba_modules': 10, 'external_links': 2},
+    'large': {'sheets': 10, 'rows': 5000, 'columns': 25, 'vba_modules': 30, 'external_links': 5}
+}
+
+# Stages faster than this are too noisy to flag as regressions
+REGRESSION_NOISE_FLOOR = 0.05  # seconds
+
+
+def peak_rss_mb():
+    """Peak resident set size of this process in MB"""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is reported in bytes on macOS and kilobytes elsewhere
+    if sys.platform == 'darwin':
+        return peak / (1024 * 1024)
+    return peak / 1024
+
+
+def run_case(name, params, workdir, backend='local', embed_latency=0.0):
+    """Generate one workbook and time every pipeline stage on it"""
+    from core.excel_analyzer import ExcelAnalyzer
+    from core.macro_extractor import MacroExtractor
+    from core.workbook_reader import WorkbookReader
+    from embedding.embedding_cache import EmbeddingCache
+    from embedding.stub_client import StubBedrockClient
+    from embedding.vector_embedder import TitanEmbedder
+
+    result = {'name': name, 'params': params, 'backend': backend, 'stages': {}, 'errors': []}
+
+    @contextmanager
+    def stage(stage_name):
+        started = time.perf_counter()
+        try:
+            yield
+        except Exception as e:
+            result['errors'].append(f"{stage_name}: {str(e)}")
+        finally:
+            result['stages'][stage_name] = {
+                'seconds': round(time.perf_counter() - started, 4),
+                'peak_rss_mb': round(peak_rss_mb(), 1)
+            }
+
+    extension = '.xlsm' if params.get('vba_modules') else '.xlsx'
+    path = os.path.join(workdir, f'{name}{extension}')
+    with stage('generate'):
+        result['workbook'] = generate_workbook(path, **params)
+
+    euda_info = {}
+    # As in a scan, the analyzer and the extractor share one open of the workbook
+    with WorkbookReader(path) as reader:
+        if not result['errors']:
+            with stage('analyze'):
+                analyzer = ExcelAnalyzer(path, reader=reader)
+                if not analyzer.analyze():
+                    raise RuntimeError(analyzer.error)
+                euda_info = analyzer.get_summary()
+                euda_info['formulas'] = analyzer.formulas
+                euda_info['formula_groups'] = analyzer.formula_groups
+
+        if not result['errors']:
+            with stage('macros'):
+                euda_info['macros'] = []
+                if euda_info.get('has_macros'):
+                    extractor = MacroExtractor(path, reader=reader)
+                    if extractor.extract_macros():
+                        extractor.analyze_macros()
+                    euda_info['macros'] = extractor.macros
+
+    # The later stages would only time work on a missing or partial workbook
+    if result['errors']:
+        result['peak_rss_mb'] = round(peak_rss_mb(), 1)
+        return result
+
+    # The embed stage fills the cache, so the store stage measures writes rather than embedding
+    cache = EmbeddingCache(os.path.join(workdir, f'{name}_embeddings.sqlite'))
+    client = StubBedrockClient(latency=embed_latency)
+    embedder = TitanEmbedder(bedrock_client=client, cache=cache)
+
+    with stage('embed'):
+        embedder.generate_euda_embedding(euda_info)
+        embedder.generate_macro_embeddings(euda_info.get('macros', []))
+        # Like the stores, embed each logical formula once rather than every cell
+        formula_groups = sorted(euda_info.get('formula_groups', []), key=lambda group: group['normalized'])
+        list(embedder.iter_formula_group_embeddings(formula_groups))
+    result['embedding_calls'] = client.calls
+    result['formula_groups'] = len(euda_info.get('formula_groups', []))
+
+    with stage('store'):
+        if backend == 'postgres':
+            from core.database import Database
+            from embedding.vector_store import VectorStore
+            database = Database()
+            if not database.connect() or not database.create_tables():
+                raise RuntimeError("PostgreSQL is not available")
+            database.close()
+            store = VectorStore(embedder=embedder)
+        else:
+            from embedding.local_vector_index import LocalVectorStore
+            store = LocalVectorStore(os.path.join(workdir, f'{name}_store'), embedder=embedder)
+        if store.store_euda(euda_info) is None:
+            raise RuntimeError("store_euda failed")
+        store.close()
+
+    cache.close()
+    result['peak_rss_mb'] = round(peak_rss_mb(), 1)
+    return result
+
+
+def run_benchmarks(cases, backend='local', embed_latency=0.0, scale=1.0, workdir=None, label=None):
+    """Run each case in a fresh process so peak RSS is measured per case"""
+    workdir = workdir or tempfile.mkdtemp(prefix='euda_benchmark_')
+    os.makedirs(workdir, exist_ok=True)
+    report = {
+        'label': label,
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'backend': backend,
+        'embed_latency': embed_latency,
+        'cases': []
+    }
+
+    try:
+        for name in cases:
+            params = dict(BENCHMARK_CASES[name])
+            params['rows'] = max(1, int(params['rows'] * scale))
+            context = multiprocessing.get_context('spawn')
+            with ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+                result = executor.submit(run_case, name, params, workdir, backend, embed_latency).result()
+            report['cases'].append(result)
+            print(f"{name}: " + ', '.join(
+                f"{stage} {timing['seconds']:.2f}s" for stage, timing in result['stages'].items()
+            ) + f", peak RSS {result['peak_rss_mb']:.0f} MB", file=sys.stderr)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    return report
+
+
+def compare_reports(report, baseline, tolerance=0.2):
+    """Return stage timings that are slower than the baseline by more than the tolerance"""
+    baseline_cases = {case['name']: case for case in baseline.get('cases', [])}
+    regressions = []
+    for case in report['cases']:
+        previous = baseline_cases.get(case['name'])
+        if not previous:
+            continue
+        for stage, timing in case['stages'].items():
+            before = previous['stages'].get(stage)
+            if not before or timing['seconds'] < REGRESSION_NOISE_FLOOR:
+                continue
+            ratio = timing['seconds'] / max(before['seconds'], 1e-9)
+            if ratio > 1 + tolerance:
+                regressions.append({
+                    'case': case['name'],
+                    'stage': stage,
+                    'baseline_seconds': before['seconds'],
+                    'seconds': timing['seconds'],
+                    'ratio': round(ratio, 2)
+                })
+        if previous.get('peak_rss_mb') and case.get('peak_rss_mb', 0) > previous['peak_rss_mb'] * (1 + tolerance):
+            regressions.append({
+                'case': case['name'],
+                'stage': 'peak_rss_mb',
+                'baseline_seconds': None,
+                'seconds': None,
+                'ratio': round(case['peak_rss_mb'] / previous['peak_rss_mb'], 2)
+            })
+    return regressions
+
+
+def main(argv=None):
+    """Command line entry point for the pipeline benchmark"""
+    parser = argparse.ArgumentParser(description="Benchmark the EUDA analysis pipeline on synthetic workbooks")
+    parser.add_argument('--cases', default='small,medium', help=f"Comma separated cases: {', '.join(BENCHMARK_CASES)}")
+    parser.add_argument('--scale', type=float, default=1.0, help="Multiply the rows of every case")
+    parser.add_argument('--postgres', action='store_true', help="Store into PostgreSQL instead of the local index")
+    parser.add_argument('--embed-latency', type=float, default=0.0, help="Simulated seconds per embedding call")
+    parser.add_argument('--label', default=None, help="Version label recorded in the results")
+    parser.add_argument('--output', default=None, help="Write JSON results to this file")
+    parser.add_argument('--baseline', default=None, help="Earlier results to compare against")
+    parser.add_argument('--tolerance', type=float, default=0.2, help="Allowed slowdown before flagging a regression")
+    args = parser.parse_args(argv)
+
+    cases = [name.strip() for name in args.cases.split(',') if name.strip()]
+    unknown = [name for name in cases if name not in BENCHMARK_CASES]
+    if unknown:
+        parser.error(f"Unknown cases: {', '.join(unknown)}")
+
+    report = run_benchmarks(cases, 'postgres' if args.postgres else 'local', args.embed_latency,
+                            args.scale, label=args.label)
+
+    output = json.dumps(report, indent=2, default=str)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(output)
+    else:
+        print(output)
+
+    if args.baseline:
+        with open(args.baseline, 'r', encoding='utf-8') as f:
+            regressions = compare_reports(report, json.load(f), args.tolerance)
+        for regression in regressions:
+            print(f"Regression in {regression['case']}/{regression['stage']}: {regression['ratio']}x baseline",
+                  file=sys.stderr)
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,191 @@
+# embedding/quantization_benchmark.py
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import numpy as np
+from embedding.local_vector_index import LocalVectorIndex, QUANTIZED_DTYPES
+
+
+def clustered_vectors(rows, dimension, clusters, seed=0):
+    """Generate unit vectors around random centroids, like embeddings of similar content"""
+    rng = np.random.default_rng(seed)
+    centroids = rng.standard_normal((clusters, dimension)).astype(np.float32)
+    labels = rng.integers(0, clusters, rows)
+    vectors = centroids[labels] + 0.5 * rng.standard_normal((rows, dimension)).astype(np.float32)
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def recall_at_k(results, truth):
+    """Fraction of the exact top-k rows that were returned"""
+    hits = sum(len({row for row, _ in found} & {row for row, _ in exact}) for found, exact in zip(results, truth))
+    total = sum(len(exact) for exact in truth)
+    return hits / total if total else 1.0
+
+
+def retrieval_bytes(index):
+    """Bytes of the matrix scanned for candidates"""
+    if index.quantization == 'none':
+        return index.count * index.dimension * 4
+    itemsize = np.dtype(QUANTIZED_DTYPES[index.quantization]).itemsize
+    scales = index.count * 4 if index.scales is not None else 0
+    return index.count * index.dimension * itemsize + scales
+
+
+def benchmark_local(rows=100000, dimension=1536, queries=100, k=10, clusters=256,
+                    modes=('none', 'halfvec', 'int8'), rerank_factor=4, seed=0):
+    """Compare recall@k, latency and memory of the local index quantization modes"""
+    vectors = clustered_vectors(rows, dimension, clusters, seed)
+    rng = np.random.default_rng(seed + 1)
+    picks = rng.integers(0, rows, queries)
+    query_vectors = vectors[picks] + 0.1 * rng.standard_normal((queries, dimension)).astype(np.float32)
+
+    results = []
+    truth = None
+    for mode in modes:
+        directory = tempfile.mkdtemp(prefix=f'vector_bench_{mode}_')
+        try:
+            index = LocalVectorIndex(directory, dimension=dimension, quantization=mode,
+                                     rerank_factor=rerank_factor)
+            started = time.perf_counter()
+            for start in range(0, rows, 10000):
+                batch = vectors[start:start + 10000]
+                index.append(0, 'formula', np.arange(start, start + len(batch)), batch)
+            index.commit()
+            build_seconds = time.perf_counter() - started
+
+            started = time.perf_counter()
+            found = index.search(query_vectors, k)
+            search_seconds = time.perf_counter() - started
+
+            if mode == 'none':
+                truth = found
+            if truth is None:
+                # Exact results are needed as the reference for recall
+                exact = LocalVectorIndex(directory, dimension=dimension, quantization='none')
+                truth = exact.search(query_vectors, k)
+
+            size = retrieval_bytes(index)
+            results.append({
+                'backend': 'local',
+                'quantization': mode,
+                'rows': rows,
+                'dimension': dimension,
+                'k': k,
+                'rerank_factor': rerank_factor if mode != 'none' else None,
+                f'recall@{k}': recall_at_k(found, truth),
+                'build_seconds': round(build_seconds, 3),
+                'search_ms_per_query': round(search_seconds * 1000 / queries, 3),
+                'retrieval_bytes': size,
+                'memory_saved': 1 - size / (rows * dimension * 4)
+            })
+        finally:
+            shutil.rmtree(directory, ignore_errors=True)
+    return results
+
+
+def benchmark_postgres(queries=50, k=10, modes=('none', 'halfvec', 'binary'), rerank_factor=4):
+    """Compare EUDA search recall@k and index sizes for the PostgreSQL quantization modes
+
+    Stored EUDA embeddings are used as queries. The vector indexes for each
+    mode must exist (Database.create_vector_indexes(quantization=...)).
+    """
+    from embedding.vector_store import VectorStore, _vector_literal
+
+    class _FixedEmbedder:
+        """Return a preset vector so searches skip Bedrock"""
+        vector = None
+
+        def embed_text(self, text):
+            return self.vector
+
+    embedder = _FixedEmbedder()
+    stores = {mode: VectorStore(embedder=embedder, quantization=mode, rerank_factor=rerank_factor) for mode in modes}
+    pool = stores[modes[0]].pool
+
+    with pool.cursor() as cursor:
+        cursor.execute("""
+            SELECT embedding::text FROM embeddings
+            WHERE content_type = 'euda' ORDER BY random() LIMIT %s
+        """, (queries,))
+        query_vectors = [json.loads(row[0]) for row in cursor.fetchall()]
+
+        cursor.execute("""
+            SELECT indexrelname, pg_relation_size(indexrelid)
+            FROM pg_stat_user_indexes WHERE relname = 'embeddings'
+        """)
+        index_sizes = dict(cursor.fetchall())
+
+    # Exact neighbours with index scans disabled
+    truth = []
+    for vector in query_vectors:
+        with pool.cursor() as cursor:
+            cursor.execute("SELECT set_config('enable_indexscan', 'off', true)")
+            cursor.execute("""
+                SELECT euda_id FROM embeddings WHERE content_type = 'euda'
+                ORDER BY embedding <=> %s::vector LIMIT %s
+            """, (_vector_literal(vector), k))
+            truth.append([(row[0], None) for row in cursor.fetchall()])
+
+    results = []
+    for mode, store in stores.items():
+        found = []
+        started = time.perf_counter()
+        for vector in query_vectors:
+            embedder.vector = vector
+            found.append([(row['id'], row['similarity']) for row in store.search_similar_eudas('', k)])
+        search_seconds = time.perf_counter() - started
+
+        names = [f"embeddings_euda_{method}_idx" if mode == 'none' else f"embeddings_euda_{method}_{mode}_idx"
+                 for method in ('hnsw', 'ivfflat')]
+        size = sum(index_sizes.get(name, 0) for name in names)
+        results.append({
+            'backend': 'postgres',
+            'quantization': mode,
+            'k': k,
+            'rerank_factor': rerank_factor if mode != 'none' else None,
+            f'recall@{k}': recall_at_k(found, truth),
+            'search_ms_per_query': round(search_seconds * 1000 / max(1, len(query_vectors)), 3),
+            'index_bytes': size
+        })
+
+    baseline = next((r['index_bytes'] for r in results if r['quantization'] == 'none'), 0)
+    for result in results:
+        result['memory_saved'] = 1 - result['index_bytes'] / baseline if baseline else None
+    return results
+
+
+def main(argv=None):
+    """Command line entry point for the quantization benchmark"""
+    parser = argparse.ArgumentParser(description="Measure recall@k and memory of quantized vector search")
+    parser.add_argument('--backend', choices=('local', 'postgres'), default='local')
+    parser.add_argument('--rows', type=int, default=100000, help="Synthetic vectors for the local backend")
+    parser.add_argument('--dimension', type=int, default=1536)
+    parser.add_argument('--clusters', type=int, default=256)
+    parser.add_argument('--queries', type=int, default=100)
+    parser.add_argument('--k', type=int, default=10)
+    parser.add_argument('--rerank-factor', type=int, default=4)
+    parser.add_argument('--modes', default=None, help="Comma separated quantization modes")
+    parser.add_argument('--output', default=None, help="Write JSON results to this file")
+    args = parser.parse_args(argv)
+
+    if args.backend == 'local':
+        modes = tuple(args.modes.split(',')) if args.modes else ('none', 'halfvec', 'int8')
+        results = benchmark_local(args.rows, args.dimension, args.queries, args.k, args.clusters,
+                                  modes, args.rerank_factor)
+    else:
+        modes = tuple(args.modes.split(',')) if args.modes else ('none', 'halfvec', 'binary')
+        results = benchmark_postgres(args.queries, args.k, modes, args.rerank_factor)
+
+    for result in results:
+        print(json.dumps(result))
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -25,4 +25,57 @@ ANTHROPIC_API_KEY = os.getenv("ANTHROPIC_API_KEY")
 ANTHROPIC_MODEL = os.getenv("ANTHROPIC_MODEL", "claude-3-5-sonnet-20240620")
 
 # Vector embedding dimensions
-EMBEDDING_DIMENSION = 1536  # Amazon Titan embeddings dimension
\ No newline at end of file
+EMBEDDING_DIMENSION = 1536  # Amazon Titan embeddings dimension
+
+# Batch scanning settings
+SCAN_MAX_WORKERS = int(os.getenv("SCAN_MAX_WORKERS", os.cpu_count() or 1))
+# Fingerprints and results of previous scans, used by incremental scans
+SCAN_CACHE_PATH = os.getenv(
+    "SCAN_CACHE_PATH",
+    os.path.join(os.path.expanduser("~"), ".cache", "euda_remediation", "scan_cache.sqlite")
+)
+# Distributed scan queue: job lease, attempts per job and idle polling interval
+SCAN_LEASE_SECONDS = int(os.getenv("SCAN_LEASE_SECONDS", "300"))
+SCAN_MAX_ATTEMPTS = int(os.getenv("SCAN_MAX_ATTEMPTS", "3"))
+SCAN_POLL_INTERVAL = float(os.getenv("SCAN_POLL_INTERVAL", "5"))  # seconds
+
+# Ingestion pipeline (core/pipeline.py): per-stage concurrency and queue bound between stages
+PIPELINE_EMBED_CONCURRENCY = int(os.getenv("PIPELINE_EMBED_CONCURRENCY", "4"))  # workbooks embedded at once
+PIPELINE_STORE_CONCURRENCY = int(os.getenv("PIPELINE_STORE_CONCURRENCY", "2"))  # concurrent store batches
+PIPELINE_STORE_BATCH = int(os.getenv("PIPELINE_STORE_BATCH", "8"))  # workbooks per store batch
+PIPELINE_QUEUE_SIZE = int(os.getenv("PIPELINE_QUEUE_SIZE", "8"))  # workbooks waiting between two stages
+
+# Embedding request settings
+EMBED_MAX_WORKERS = int(os.getenv("EMBED_MAX_WORKERS", "16"))
+EMBED_MAX_RETRIES = int(os.getenv("EMBED_MAX_RETRIES", "5"))
+EMBED_BACKOFF_BASE = float(os.getenv("EMBED_BACKOFF_BASE", "0.5"))  # seconds
+EMBED_BACKOFF_MAX = float(os.getenv("EMBED_BACKOFF_MAX", "20"))  # seconds
+
+# Embedding cache settings (set EMBEDDING_CACHE_PATH to an empty string to disable)
+EMBEDDING_CACHE_PATH = os.getenv(
+    "EMBEDDING_CACHE_PATH",
+    os.path.join(os.path.expanduser("~"), ".cache", "euda_remediation", "embeddings.sqlite")
+)
+EMBEDDING_CACHE_MAX_BYTES = int(os.getenv("EMBEDDING_CACHE_MAX_MB", "1024")) * 1024 * 1024
+
+# Number of rows embedded and written per batch when storing an EUDA
+STORE_BATCH_SIZE = int(os.getenv("STORE_BATCH_SIZE", "1000"))
+
+# Vector store backend: "postgres" (pgvector) or "local" (memory-mapped NumPy index)
+VECTOR_STORE_BACKEND = os.getenv("VECTOR_STORE_BACKEND", "postgres")
+LOCAL_VECTOR_STORE_PATH = os.getenv(
+    "LOCAL_VECTOR_STORE_PATH",
+    os.path.join(os.path.expanduser("~"), ".cache", "euda_remediation", "vector_store")
+)
+
+# Compact vector storage for candidate retrieval: "none", "halfvec" or "binary" (PostgreSQL),
+# "none", "halfvec" or "int8" (local backend). Candidates are re-ranked at full precision.
+VECTOR_QUANTIZATION = os.getenv("VECTOR_QUANTIZATION", "none")
+VECTOR_RERANK_FACTOR = int(os.getenv("VECTOR_RERANK_FACTOR", "4"))  # candidates fetched per result
+
+# Timing and counter instrumentation (see core/metrics.py); disabled by default
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "false").lower() in ("1", "true", "yes")
+
+# Formula records kept in memory per workbook; beyond this a uniform sample is kept, and formula
+# groups and dependency graph nodes stop at this many, flagged as truncated (unset = no limit)
+ANALYZER_MAX_FORMULAS = int(os.getenv("ANALYZER_MAX_FORMULAS")) if os.getenv("ANALYZER_MAX_FORMULAS") else None
@@ -0,0 +1,60 @@
+# embedding/stub_client.py
+import io
+import json
+import time
+import random
+import hashlib
+import threading
+from config.settings import EMBEDDING_DIMENSION
+
+class StubThrottlingError(Exception):
+    """Mimics a botocore ClientError raised for a throttled request"""
+    
+    def __init__(self, code='ThrottlingException'):
+        super().__init__(f"An error occurred ({code}) when calling the InvokeModel operation")
+        self.response = {'Error': {'Code': code, 'Message': 'Rate exceeded'}}
+
+class StubBedrockClient:
+    """Local stand-in for the bedrock-runtime client used by TitanEmbedder"""
+    
+    def __init__(self, dimension=EMBEDDING_DIMENSION, latency=0.0, max_concurrency=None,
+                 throttle_rate=0.0, seed=None):
+        self.dimension = dimension
+        self.latency = latency
+        self.max_concurrency = max_concurrency
+        self.throttle_rate = throttle_rate
+        self.random = random.Random(seed)
+        self.calls = 0
+        self.throttled = 0
+        self.in_flight = 0
+        self.peak_in_flight = 0
+        self._lock = threading.Lock()
+    
+    def embedding_for(self, text):
+        """Deterministic unit-length pseudo embedding derived from the text"""
+        seed = int.from_bytes(hashlib.sha256(text.encode('utf-8')).digest()[:8], 'little')
+        rng = random.Random(seed)
+        vector = [rng.gauss(0.0, 1.0) for _ in range(self.dimension)]
+        norm = sum(v * v for v in vector) ** 0.5 or 1.0
+        return [v / norm for v in vector]
+    
+    def invoke_model(self, modelId, contentType, accept, body):
+        """Return a Titan-shaped response, throttling like the real service when overloaded"""
+        with self._lock:
+            self.calls += 1
+            overloaded = self.max_concurrency is not None and self.in_flight >= self.max_concurrency
+            if overloaded or (self.throttle_rate and self.random.random() < self.throttle_rate):
+                self.throttled += 1
+                raise StubThrottlingError()
+            self.in_flight += 1
+            self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+        
+        try:
+            if self.latency:
+                time.sleep(self.latency)
+            request = json.loads(body)
+            embedding = self.embedding_for(request.get('inputText', ''))
+            return {'body': io.BytesIO(json.dumps({'embedding': embedding}).encode('utf-8'))}
+        finally:
+            with self._lock:
+                self.in_flight -= 1
@@ -0,0 +1,512 @@
+# benchmarks/synthetic_workbook.py
+import os
+import random
+import struct
+import zipfile
+from xml.sax.saxutils import escape
+from core.formula_scanner import column_letter
+from core.vba_project import (
+    ENDOFCHAIN, FREESECT, NOSTREAM, STGTY_STORAGE, STGTY_STREAM, STGTY_ROOT,
+    PROJECTCODEPAGE, PROJECTVERSION, PROJECTMODULES, DIR_TERMINATOR, MODULENAME,
+    MODULESTREAMNAME, MODULETYPE_PROCEDURAL, MODULETYPE_DOCUMENT, MODULE_TERMINATOR,
+    MODULEOFFSET, MODULESTREAMNAMEUNICODE, MODULENAMEUNICODE
+)
+
+MAIN_NS = 'http://schemas.openxmlformats.org/spreadsheetml/2006/main'
+REL_NS = 'http://schemas.openxmlformats.org/officeDocument/2006/relationships'
+PACKAGE_REL_NS = 'http://schemas.openxmlformats.org/package/2006/relationships'
+CONTENT_TYPES_NS = 'http://schemas.openxmlformats.org/package/2006/content-types'
+SPREADSHEET_TYPE = 'application/vnd.openxmlformats-officedocument.spreadsheetml'
+
+FATSECT = 0xFFFFFFFD
+SECTOR_SIZE = 512
+MINI_SECTOR_SIZE = 64
+MINI_STREAM_CUTOFF = 4096
+
+# Formula templates per formula column; {r} is the row, {data} the first data sheet
+FORMULA_TEMPLATES = (
+    'SUM(A{r}:C{r})',
+    'IF(A{r}>500,B{r}*2,C{r}-B{r})',
+    "VLOOKUP(A{r},'{data}'!$A$2:$C$101,2,FALSE)",
+    'INDEX(B:B,MATCH(A{r},A:A,0))',
+    'ROUND(AVERAGE(A{r}:D{r}),2)',
+    'SUMIF(A:A,">"&A{r},B:B)',
+    'IFERROR(A{r}/B{r},0)',
+    'CONCATENATE(E{r}," - ",TEXT(A{r},"0.00"))'
+)
+
+
+# ---------------------------------------------------------------------------
+# VBA project writer (MS-OVBA compression and a version 3 compound file)
+# ---------------------------------------------------------------------------
+
+def compress(data):
+    """Compress data into an MS-OVBA compressed container"""
+    out = bytearray(b'\x01')
+    for chunk_start in range(0, len(data), 4096):
+        chunk = data[chunk_start:chunk_start + 4096]
+        body = _compress_chunk(chunk)
+        if len(body) > 4096:
+            # Incompressible chunk: store it raw, padded to 4096 bytes
+            out += struct.pack('<H', 0x3000 | 4095)
+            out += chunk.ljust(4096, b'\x00')
+        else:
+            out += struct.pack('<H', 0xB000 | (len(body) - 1))
+            out += body
+    return bytes(out)
+
+
+def _compress_chunk(chunk):
+    """Greedy LZ77 compression of one 4096-byte chunk"""
+    out = bytearray()
+    positions = {}
+    pos = 0
+    end = len(chunk)
+    while pos < end:
+        flag_index = len(out)
+        out.append(0)
+        flags = 0
+        for bit in range(8):
+            if pos >= end:
+                break
+            # The offset/length split depends on the position in the chunk
+            bit_count = max((pos - 1).bit_length(), 4) if pos else 4
+            max_length = (0xFFFF >> bit_count) + 3
+            best_length = 0
+            best_distance = 0
+            key = chunk[pos:pos + 3]
+            if len(key) == 3:
+                for candidate in reversed(positions.get(key, [])[-32:]):
+                    length = 0
+                    limit = min(max_length, end - pos)
+                    while length < limit and chunk[candidate + length] == chunk[pos + length]:
+                        length += 1
+                    if length > best_length:
+                        best_length = length
+                        best_distance = pos - candidate
+                        if length == limit:
+                            break
+            if best_length >= 3:
+                token = ((best_distance - 1) << (16 - bit_count)) | (best_length - 3)
+                out += struct.pack('<H', token)
+                flags |= 1 << bit
+                step = best_length
+            else:
+                out.append(chunk[pos])
+                step = 1
+            for i in range(pos, pos + step):
+                positions.setdefault(chunk[i:i + 3], []).append(i)
+            pos += step
+        out[flag_index] = flags
+    return bytes(out)
+
+
+def _record(record_id, value=b''):
+    return struct.pack('<HI', record_id, len(value)) + value
+
+
+def build_dir_stream(project_name, modules, codepage=1252):
+    """Build the uncompressed dir stream for (name, is_document) modules"""
+    codec = f'cp{codepage}'
+    out = bytearray()
+    out += _record(0x0001, struct.pack('<I', 1))  # SysKind: Win32
+    out += _record(0x0002, struct.pack('<I', 0x409))  # Lcid
+    out += _record(0x0014, struct.pack('<I', 0x409))  # LcidInvoke
+    out += _record(PROJECTCODEPAGE, struct.pack('<H', codepage))
+    out += _record(0x0004, project_name.encode(codec))  # Name
+    out += _record(0x0005) + _record(0x0040)  # DocString
+    out += _record(0x0006) + _record(0x003D)  # HelpFilePath
+    out += _record(0x0007, struct.pack('<I', 0))  # HelpContext
+    out += _record(0x0008, struct.pack('<I', 0))  # LibFlags
+    out += struct.pack('<HIIH', PROJECTVERSION, 4, 1, 0)
+    out += _record(0x000C) + _record(0x003C)  # Constants
+    out += _record(PROJECTMODULES, struct.pack('<H', len(modules)))
+    out += _record(0x0013, struct.pack('<H', 0xFFFF))  # ProjectCookie
+    for name, is_document in modules:
+        out += _record(MODULENAME, name.encode(codec))
+        out += _record(MODULENAMEUNICODE, name.encode('utf-16-le'))
+        out += _record(MODULESTREAMNAME, name.encode(codec))
+        out += _record(MODULESTREAMNAMEUNICODE, name.encode('utf-16-le'))
+        out += _record(0x001C) + _record(0x0048)  # DocString
+        out += _record(MODULEOFFSET, struct.pack('<I', 0))
+        out += _record(0x001E, struct.pack('<I', 0))  # HelpContext
+        out += _record(0x002C, struct.pack('<H', 0xFFFF))  # Cookie
+        out += _record(MODULETYPE_DOCUMENT if is_document else MODULETYPE_PROCEDURAL)
+        out += _record(MODULE_TERMINATOR)
+    out += _record(DIR_TERMINATOR)
+    return bytes(out)
+
+
+def build_compound_file(streams):
+    """Build a version 3 compound file from a {path: bytes} mapping"""
+    root = {'name': 'Root Entry', 'type': STGTY_ROOT, 'children': {}, 'data': b''}
+    for path, data in streams.items():
+        node = root
+        parts = path.split('/')
+        for part in parts[:-1]:
+            node = node['children'].setdefault(part, {'name': part, 'type': STGTY_STORAGE, 'children': {}, 'data': b''})
+        node['children'][parts[-1]] = {'name': parts[-1], 'type': STGTY_STREAM, 'children': {}, 'data': data}
+
+    # Flatten the tree; siblings form a right-leaning chain, which is a valid red-black tree
+    entries = []
+
+    def add(node):
+        node['index'] = len(entries)
+        entries.append(node)
+        children = sorted(node['children'].values(), key=lambda n: (len(n['name']), n['name'].upper()))
+        for child in children:
+            add(child)
+        node['child'] = children[0]['index'] if children else NOSTREAM
+        for current, following in zip(children, children[1:] + [None]):
+            current['right'] = following['index'] if following else NOSTREAM
+
+    add(root)
+    root['right'] = NOSTREAM
+
+    # Small streams live in the mini stream
+    mini_stream = bytearray()
+    mini_fat = []
+    big = []
+    for entry in entries:
+        entry['start'] = ENDOFCHAIN
+        if entry['type'] != STGTY_STREAM or not entry['data']:
+            continue
+        data = entry['data']
+        if len(data) < MINI_STREAM_CUTOFF:
+            count = (len(data) + MINI_SECTOR_SIZE - 1) // MINI_SECTOR_SIZE
+            entry['start'] = len(mini_fat)
+            mini_fat.extend(range(len(mini_fat) + 1, len(mini_fat) + count))
+            mini_fat.append(ENDOFCHAIN)
+            mini_stream += data.ljust(count * MINI_SECTOR_SIZE, b'\x00')
+        else:
+            big.append(entry)
+
+    def sectors(length):
+        return (length + SECTOR_SIZE - 1) // SECTOR_SIZE
+
+    n_dir = sectors(len(entries) * 128)
+    n_minifat = sectors(len(mini_fat) * 4)
+    n_data = n_dir + n_minifat + sectors(len(mini_stream)) + sum(sectors(len(e['data'])) for e in big)
+    n_fat = 1
+    while n_fat * (SECTOR_SIZE // 4) < n_data + n_fat:
+        n_fat += 1
+    if n_fat > 109:
+        raise ValueError("VBA project too large for a header-only DIFAT")
+
+    fat = [FATSECT] * n_fat
+    body = bytearray()
+
+    def allocate(data):
+        count = sectors(len(data))
+        start = len(fat)
+        fat.extend(range(start + 1, start + count))
+        fat.append(ENDOFCHAIN)
+        body.extend(data.ljust(count * SECTOR_SIZE, b'\x00'))
+        return start
+
+    # Reserve the directory sectors first so its location is known
+    dir_start = allocate(b'\x00' * n_dir * SECTOR_SIZE)
+    minifat_start = allocate(b''.join(struct.pack('<I', v) for v in mini_fat)) if mini_fat else ENDOFCHAIN
+    root['start'] = allocate(bytes(mini_stream)) if mini_stream else ENDOFCHAIN
+    for entry in big:
+        entry['start'] = allocate(entry['data'])
+
+    directory = bytearray()
+    for entry in entries:
+        name = entry['name'].encode('utf-16-le')
+        record = name.ljust(64, b'\x00')
+        record += struct.pack('<HBB', len(name) + 2, entry['type'], 1)
+        record += struct.pack('<III', NOSTREAM, entry.get('right', NOSTREAM), entry['child'])
+        record += b'\x00' * 16 + struct.pack('<I', 0) + b'\x00' * 16
+        size = len(mini_stream) if entry['type'] == STGTY_ROOT else len(entry['data'])
+        record += struct.pack('<IQ', entry['start'], size)
+        directory += record
+    body[:len(directory)] = directory
+
+    fat.extend([FREESECT] * (n_fat * (SECTOR_SIZE // 4) - len(fat)))
+
+    header = bytearray(b'\xd0\xcf\x11\xe0\xa1\xb1\x1a\xe1' + b'\x00' * 16)
+    header += struct.pack('<HHHHH', 0x3E, 3, 0xFFFE, 9, 6)
+    header += b'\x00' * 6
+    header += struct.pack('<IIIII', 0, n_fat, dir_start, 0, MINI_STREAM_CUTOFF)
+    header += struct.pack('<IIII', minifat_start, n_minifat if mini_fat else 0, ENDOFCHAIN, 0)
+    header += b''.join(struct.pack('<I', v) for v in list(range(n_fat)) + [FREESECT] * (109 - n_fat))
+    return bytes(header) + b''.join(struct.pack('<I', v) for v in fat) + bytes(body)
+
+
+def build_vba_project(modules, project_name='VBAProject'):
+    """Build vbaProject.bin from (name, type, code) modules, type Standard/Document/Class"""
+    project_lines = ['ID="{00000000-0000-0000-0000-000000000000}"']
+    for name, module_type, _ in modules:
+        if module_type == 'Document':
+            project_lines.append(f'Document={name}/&H00000000')
+        elif module_type == 'Class':
+            project_lines.append(f'Class={name}')
+        else:
+            project_lines.append(f'Module={name}')
+    project_lines += [
+        f'Name="{project_name}"', 'HelpContextID="0"', 'VersionCompatible32="393222000"',
+        'CMG=""', 'DPB=""', 'GC=""', '',
+        '[Host Extender Info]', '&H00000001={3832D640-CF90-11CF-8E43-00A0C911005A};VBE;&H00000000', ''
+    ]
+    streams = {
+        'PROJECT': '\r\n'.join(project_lines).encode('cp1252'),
+        'VBA/_VBA_PROJECT': b'\xcc\x61\xff\xff\x00\x00\x00',
+        'VBA/dir': compress(build_dir_stream(project_name, [(n, t != 'Standard') for n, t, _ in modules]))
+    }
+    for name, _, code in modules:
+        streams[f'VBA/{name}'] = compress(code.encode('cp1252'))
+    return build_compound_file(streams)
+
+
+# ---------------------------------------------------------------------------
+# VBA source generation
+# ---------------------------------------------------------------------------
+
+def _vba_procedure(rng, module_index, index, sheet_names):
+    """Generate one procedure with loops, branches and the occasional API call"""
+    name = f"Process{module_index}_{index}"
+    sheet = rng.choice(sheet_names)
+    lines = [
+        f"Public Sub {name}()",
+        "    Dim i As Long, total As Double",
+        f'    Dim ws As Worksheet: Set ws = ThisWorkbook.Worksheets("{sheet}")',
+        "    For i = 2 To ws.UsedRange.Rows.Count",
+        "        If ws.Cells(i, 1).Value > 500 Then",
+        "            total = total + ws.Cells(i, 2).Value",
+        "        ElseIf ws.Cells(i, 1).Value < 0 Then",
+        "            ws.Cells(i, 3).Value = 0",
+        "        End If",
+        "    Next i"
+    ]
+    kind = rng.random()
+    if kind < 0.2:
+        lines += [
+            '    Dim conn As Object: Set conn = CreateObject("ADODB.Connection")',
+            '    conn.Open "Provider=SQLOLEDB;Data Source=finance-db;Initial Catalog=Ledger"',
+            '    conn.Execute "SELECT * FROM positions WHERE book = \'' + sheet + '\'"',
+            "    conn.Close"
+        ]
+    elif kind < 0.35:
+        lines += [
+            '    Open "C:\\Reports\\' + name + '.csv" For Output As #1',
+            '    Print #1, total',
+            "    Close #1"
+        ]
+    elif kind < 0.5:
+        lines += ['    MsgBox "Total: " & total']
+    lines += [
+        "    Do While total > 1000",
+        "        total = total / 2",
+        "    Loop",
+        "End Sub",
+        ""
+    ]
+    return lines
+
+
+def generate_vba_modules(count, procedures=5, sheet_names=('Sheet1',), seed=0):
+    """Generate ThisWorkbook plus count standard modules as (name, type, code)"""
+    rng = random.Random(seed)
+    modules = [('ThisWorkbook', 'Document', '\r\n'.join([
+        'Attribute VB_Name = "ThisWorkbook"',
+        "Private Sub Workbook_Open()",
+        "    Application.Calculation = xlCalculationManual",
+        "    Process1_0",
+        "End Sub",
+        ""
+    ]))]
+    for module_index in range(1, count + 1):
+        lines = [f'Attribute VB_Name = "Module{module_index}"', "Option Explicit", ""]
+        for index in range(procedures):
+            lines += _vba_procedure(rng, module_index, index, list(sheet_names))
+        modules.append((f"Module{module_index}", 'Standard', '\r\n'.join(lines)))
+    return modules
+
+
+# ---------------------------------------------------------------------------
+# Workbook parts
+# ---------------------------------------------------------------------------
+
+def _content_types(sheet_count, external_links, macro_enabled):
+    workbook_type = ('application/vnd.ms-excel.sheet.macroEnabled.main+xml' if macro_enabled
+                     else f'{SPREADSHEET_TYPE}.sheet.main+xml')
+    parts = [
+        f'<Types xmlns="{CONTENT_TYPES_NS}">',
+        '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>',
+        '<Default Extension="xml" ContentType="application/xml"/>',
+        '<Default Extension="bin" ContentType="application/vnd.ms-office.vbaProject"/>' if macro_enabled else '',
+        f'<Override PartName="/xl/workbook.xml" ContentType="{workbook_type}"/>',
+        f'<Override PartName="/xl/styles.xml" ContentType="{SPREADSHEET_TYPE}.styles+xml"/>'
+    ]
+    for index in range(1, sheet_count + 1):
+        parts.append(f'<Override PartName="/xl/worksheets/sheet{index}.xml" '
+                     f'ContentType="{SPREADSHEET_TYPE}.worksheet+xml"/>')
+    for index in range(1, external_links + 1):
+        parts.append(f'<Override PartName="/xl/externalLinks/externalLink{index}.xml" '
+                     f'ContentType="{SPREADSHEET_TYPE}.externalLink+xml"/>')
+    parts.append('</Types>')
+    return ''.join(parts)
+
+
+def _relationships(relationships):
+    parts = [f'<Relationships xmlns="{PACKAGE_REL_NS}">']
+    for rel_id, rel_type, target, external in relationships:
+        mode = ' TargetMode="External"' if external else ''
+        parts.append(f'<Relationship Id="{rel_id}" Type="{rel_type}" Target="{escape(target)}"{mode}/>')
+    parts.append('</Relationships>')
+    return ''.join(parts)
+
+
+def _workbook(sheet_names, external_links, macro_enabled):
+    code_name = ' codeName="ThisWorkbook"' if macro_enabled else ''
+    parts = [f'<workbook xmlns="{MAIN_NS}" xmlns:r="{REL_NS}"><workbookPr{code_name}/><sheets>']
+    for index, name in enumerate(sheet_names, 1):
+        parts.append(f'<sheet name="{escape(name)}" sheetId="{index}" r:id="rId{index}"/>')
+    parts.append('</sheets>')
+    if external_links:
+        parts.append('<externalReferences>')
+        for index in range(1, external_links + 1):
+            parts.append(f'<externalReference r:id="rId{len(sheet_names) + 1 + index}"/>')
+        parts.append('</externalReferences>')
+    parts.append('</workbook>')
+    return ''.join(parts)
+
+
+STYLES = (
+    f'<styleSheet xmlns="{MAIN_NS}">'
+    '<fonts count="1"><font><sz val="11"/><name val="Calibri"/></font></fonts>'
+    '<fills count="2"><fill><patternFill patternType="none"/></fill><fill><patternFill patternType="gray125"/></fill></fills>'
+    '<borders count="1"><border><left/><right/><top/><bottom/><diagonal/></border></borders>'
+    '<cellStyleXfs count="1"><xf numFmtId="0" fontId="0" fillId="0" borderId="0"/></cellStyleXfs>'
+    '<cellXfs count="1"><xf numFmtId="0" fontId="0" fillId="0" borderId="0" xfId="0"/></cellXfs>'
+    '<cellStyles count="1"><cellStyle name="Normal" xfId="0" builtinId="0"/></cellStyles>'
+    '</styleSheet>'
+)
+
+
+def _external_link():
+    return (f'<externalLink xmlns="{MAIN_NS}" xmlns:r="{REL_NS}"><externalBook r:id="rId1">'
+            f'<sheetNames><sheetName val="Rates"/></sheetNames></externalBook></externalLink>')
+
+
+def _write_sheet(stream, rng, rows, data_columns, formula_columns, data_sheet,
+                 shared_formulas, external_link, shared_index):
+    """Write one worksheet row by row; returns (formula cells, shared groups)"""
+    last_row = rows + 1
+    columns = data_columns + len(formula_columns)
+    stream.write(f'<worksheet xmlns="{MAIN_NS}"><dimension ref="A1:{column_letter(columns)}{last_row}"/><sheetData>'.encode('utf-8'))
+
+    header = ''.join(
+        f'<c r="{column_letter(c)}1" t="inlineStr"><is><t>Column {c}</t></is></c>' for c in range(1, columns + 1)
+    )
+    stream.write(f'<row r="1">{header}</row>'.encode('utf-8'))
+
+    formula_cells = 0
+    groups = {}
+    for row in range(2, last_row + 1):
+        cells = []
+        for c in range(1, data_columns + 1):
+            ref = f'{column_letter(c)}{row}'
+            if c == 5:
+                cells.append(f'<c r="{ref}" t="inlineStr"><is><t>Item {rng.randrange(1000)}</t></is></c>')
+            else:
+                cells.append(f'<c r="{ref}"><v>{rng.randrange(1, 1000)}</v></c>')
+
+        for offset, template in enumerate(formula_columns):
+            column = column_letter(data_columns + 1 + offset)
+            ref = f'{column}{row}'
+            if shared_formulas and row > 2:
+                cells.append(f'<c r="{ref}"><f t="shared" si="{groups[column]}"/></c>')
+            else:
+                formula = escape(template.format(r=row, data=data_sheet, link=external_link))
+                if shared_formulas:
+                    groups[column] = shared_index + len(groups)
+                    cells.append(f'<c r="{ref}"><f t="shared" ref="{column}2:{column}{last_row}" '
+                                 f'si="{groups[column]}">{formula}</f></c>')
+                else:
+                    cells.append(f'<c r="{ref}"><f>{formula}</f></c>')
+            formula_cells += 1
+
+        stream.write(f'<row r="{row}">{"".join(cells)}</row>'.encode('utf-8'))
+
+    stream.write(b'</sheetData></worksheet>')
+    return formula_cells, len(groups)
+
+
+def generate_workbook(path, sheets=3, rows=1000, columns=10, formula_density=0.3,
+                      shared_formulas=True, external_links=0, vba_modules=0,
+                      vba_procedures=5, seed=0):
+    """Write a synthetic .xlsx/.xlsm workbook and return a description of its contents
+
+    Each sheet has `columns` columns, of which `formula_density` are formula
+    columns filled down every row. Formula columns are written as shared
+    formulas unless shared_formulas is False. external_links adds linked
+    workbooks referenced from an extra formula column on every sheet, and
+    vba_modules adds a VBA project (the path must then end in .xlsm).
+    """
+    macro_enabled = vba_modules > 0
+    if macro_enabled and not path.lower().endswith('.xlsm'):
+        raise ValueError("Workbooks with VBA modules must use the .xlsm extension")
+
+    rng = random.Random(seed)
+    sheet_names = ['Data'] + [f'Sheet{index}' for index in range(2, sheets + 1)]
+    formula_count = max(1, round(columns * formula_density)) if formula_density > 0 else 0
+    data_columns = max(5, columns - formula_count)
+
+    stats = {
+        'path': path,
+        'sheets': sheets,
+        'rows': rows,
+        'columns': data_columns + formula_count,
+        'formula_cells': 0,
+        'shared_formula_groups': 0,
+        'external_links': external_links,
+        'vba_modules': vba_modules,
+        'vba_lines': 0
+    }
+
+    with zipfile.ZipFile(path, 'w', zipfile.ZIP_DEFLATED) as z:
+        z.writestr('[Content_Types].xml', _content_types(sheets, external_links, macro_enabled))
+        z.writestr('_rels/.rels', _relationships([
+            ('rId1', f'{REL_NS}/officeDocument', 'xl/workbook.xml', False)
+        ]))
+        z.writestr('xl/workbook.xml', _workbook(sheet_names, external_links, macro_enabled))
+
+        relationships = [(f'rId{index}', f'{REL_NS}/worksheet', f'worksheets/sheet{index}.xml', False)
+                         for index in range(1, sheets + 1)]
+        relationships.append((f'rId{sheets + 1}', f'{REL_NS}/styles', 'styles.xml', False))
+        for index in range(1, external_links + 1):
+            relationships.append((f'rId{sheets + 1 + index}', f'{REL_NS}/externalLink',
+                                  f'externalLinks/externalLink{index}.xml', False))
+            z.writestr(f'xl/externalLinks/externalLink{index}.xml', _external_link())
+            z.writestr(f'xl/externalLinks/_rels/externalLink{index}.xml.rels', _relationships([
+                ('rId1', f'{REL_NS}/externalLinkPath', f'file:///C:/Shared/rates{index}.xlsx', True)
+            ]))
+        if macro_enabled:
+            relationships.append((f'rId{sheets + external_links + 2}',
+                                  'http://schemas.microsoft.com/office/2006/relationships/vbaProject',
+                                  'vbaProject.bin', False))
+        z.writestr('xl/_rels/workbook.xml.rels', _relationships(relationships))
+        z.writestr('xl/styles.xml', STYLES)
+
+        for index, name in enumerate(sheet_names, 1):
+            templates = [FORMULA_TEMPLATES[(index + i) % len(FORMULA_TEMPLATES)] for i in range(formula_count)]
+            if external_links:
+                templates.append('A{r}*[{link}]Rates!$B$2')
+            with z.open(f'xl/worksheets/sheet{index}.xml', 'w', force_zip64=True) as stream:
+                cells, groups = _write_sheet(
+                    stream, rng, rows, data_columns, templates, sheet_names[0],
+                    shared_formulas, (index - 1) % external_links + 1 if external_links else 0,
+                    stats['shared_formula_groups']
+                )
+            stats['formula_cells'] += cells
+            stats['shared_formula_groups'] += groups
+
+        if macro_enabled:
+            modules = generate_vba_modules(vba_modules, vba_procedures, sheet_names, seed)
+            stats['vba_lines'] = sum(code.count('\r\n') + 1 for _, _, code in modules)
+            z.writestr('xl/vbaProject.bin', build_vba_project(modules))
+
+    stats['bytes'] = os.path.getsize(path)
+    return stats
@@ -0,0 +1,228 @@
+# core/vba_lexer.py
+import re
+from collections import Counter
+
+# One alternation per token kind; re.finditer walks the module once.
+# Line continuations are matched before plain whitespace so that a
+# logical statement spanning several physical lines stays together.
+TOKEN_PATTERN = re.compile(r"""
+    (?P<newline>\r\n|\r|\n)
+  | (?P<continuation>[ \t]+_[ \t]*(?:\r\n|\r|\n))
+  | (?P<whitespace>[ \t]+)
+  | (?P<comment>'[^\r\n]*)
+  | (?P<string>"(?:[^"\r\n]|"")*"?)
+  | (?P<identifier>[A-Za-z][A-Za-z0-9_]*[$%&!#@]?)
+  | (?P<number>&[HhOo][0-9A-Fa-f]+&?|[0-9]*\.?[0-9]+(?:[eE][+-]?[0-9]+)?[#!@%&^]?)
+  | (?P<separator>:(?!=))
+  | (?P<other>.)
+""", re.VERBOSE)
+
+VBA_KEYWORDS = frozenset((
+    'as', 'byref', 'byval', 'call', 'case', 'const', 'declare', 'dim', 'do', 'each',
+    'else', 'elseif', 'end', 'enum', 'exit', 'for', 'function', 'goto', 'if', 'in',
+    'loop', 'new', 'next', 'on', 'open', 'option', 'private', 'property', 'public',
+    'redim', 'resume', 'select', 'set', 'static', 'step', 'sub', 'then', 'to', 'type',
+    'until', 'wend', 'while', 'with'
+))
+PROCEDURE_KINDS = ('sub', 'function', 'property')
+PROCEDURE_MODIFIERS = ('public', 'private', 'friend', 'static')
+LOOP_KEYWORDS = ('for', 'do', 'while')
+BRANCH_KEYWORDS = ('if', 'elseif', 'case')
+FILE_MODES = ('input', 'output', 'append', 'binary', 'random')
+EVENT_PREFIXES = ('worksheet_', 'workbook_', 'chart_', 'userform_')
+SQL_PREFIXES = ('select ', 'insert ', 'update ', 'delete ', 'exec ', 'execute ')
+
+# Identifiers that indicate use of a particular API, keyed by lower-case name
+API_IDENTIFIERS = {
+    'adodb': 'ADODB',
+    'recordset': 'Recordset',
+    'connection': 'Connection',
+    'dao': 'DAO',
+    'filesystemobject': 'FileSystemObject',
+    'createtextfile': 'CreateTextFile',
+    'opentextfile': 'OpenTextFile',
+    'msgbox': 'MsgBox',
+    'inputbox': 'InputBox',
+    'dialogs': 'Dialogs',
+    'getopenfilename': 'GetOpenFilename',
+    'getsaveasfilename': 'GetSaveAsFilename'
+}
+
+# ProgIDs passed as strings to CreateObject / GetObject
+API_PROGIDS = {
+    'adodb.': 'ADODB',
+    'dao.': 'DAO',
+    'scripting.filesystemobject': 'FileSystemObject'
+}
+
+API_CATEGORIES = {
+    'database': ('ADODB', 'Recordset', 'Connection', 'DAO'),
+    'files': ('FileSystemObject', 'CreateTextFile', 'OpenTextFile'),
+    'ui': ('MsgBox', 'InputBox', 'Dialogs', 'GetOpenFilename', 'GetSaveAsFilename', 'UserForm')
+}
+
+
+def tokenize(code):
+    """Yield (kind, text, line) tokens, skipping whitespace, comments and continuations"""
+    line = 1
+    rem_comment = False
+    statement_start = True
+
+    for match in TOKEN_PATTERN.finditer(code):
+        kind = match.lastgroup
+        if kind == 'newline':
+            yield 'newline', '\n', line
+            line += 1
+            rem_comment = False
+            statement_start = True
+            continue
+        if kind == 'continuation':
+            line += 1
+            continue
+        if rem_comment or kind in ('whitespace', 'comment'):
+            continue
+
+        text = match.group()
+        if kind == 'identifier' and statement_start and text.lower() == 'rem':
+            # Rem comments run to the end of the line
+            rem_comment = True
+            continue
+
+        statement_start = kind == 'separator'
+        yield kind, text, line
+
+
+def _new_procedure(name, kind, line):
+    return {
+        'name': name,
+        'kind': kind,
+        'start_line': line,
+        'end_line': line,
+        'loop_count': 0,
+        'branch_count': 0,
+        'complexity': 1
+    }
+
+
+def analyze_vba(code):
+    """Collect keyword, control flow, API and per-procedure metrics in one pass"""
+    keywords = Counter()
+    api_usage = Counter()
+    identifiers = set()
+    procedures = []
+    procedure = None
+    loop_count = 0
+    branch_count = 0
+    file_io = False
+    sql_strings = 0
+    line = 1
+
+    # State of the statement currently being read
+    statement = []
+    statement_names = []
+    statement_line = 1
+    previous = None
+
+    def finish_statement():
+        nonlocal procedure, loop_count, branch_count, file_io
+        if not statement:
+            return
+
+        # Skip Public/Private/Friend/Static in front of declarations
+        start = 0
+        while start < len(statement) and statement[start] in PROCEDURE_MODIFIERS:
+            start += 1
+        if start == len(statement):
+            return
+        first = statement[start]
+
+        if first in LOOP_KEYWORDS:
+            loop_count += 1
+            if procedure:
+                procedure['loop_count'] += 1
+        elif first in BRANCH_KEYWORDS and statement[start:start + 2] != ['case', 'else']:
+            branch_count += 1
+            if procedure:
+                procedure['branch_count'] += 1
+        elif first == 'open' and 'for' in statement:
+            mode = statement.index('for') + 1
+            if mode < len(statement) and statement[mode] in FILE_MODES:
+                file_io = True
+        elif first == 'end' and len(statement) > start + 1 and statement[start + 1] in PROCEDURE_KINDS:
+            if procedure:
+                procedure['end_line'] = line
+                procedure['complexity'] = 1 + procedure['loop_count'] + procedure['branch_count']
+                procedures.append(procedure)
+                procedure = None
+        elif first in PROCEDURE_KINDS:
+            # Property procedures carry Get/Let/Set before their name
+            name_index = start + (2 if first == 'property' else 1)
+            if name_index < len(statement):
+                kind = f"property {statement[start + 1]}" if first == 'property' else first
+                procedure = _new_procedure(statement_names[name_index], kind, statement_line)
+
+    for kind, text, line in tokenize(code):
+        if kind in ('newline', 'separator'):
+            finish_statement()
+            statement = []
+            statement_names = []
+            previous = None
+            continue
+
+        if kind == 'identifier':
+            lower = text.lower().rstrip('$%&!#@')
+            if not statement:
+                statement_line = line
+            statement.append(lower)
+            statement_names.append(text)
+            identifiers.add(lower)
+            if lower in VBA_KEYWORDS:
+                keywords[lower] += 1
+
+            api = API_IDENTIFIERS.get(lower)
+            if api:
+                api_usage[api] += 1
+            elif lower.startswith('userform'):
+                api_usage['UserForm'] += 1
+        elif kind == 'string':
+            value = text.strip('"').lower()
+            if previous in ('createobject', 'getobject'):
+                for prefix, api in API_PROGIDS.items():
+                    if value.startswith(prefix):
+                        api_usage[api] += 1
+            elif value.startswith(SQL_PREFIXES):
+                sql_strings += 1
+        elif kind == 'other' and text == '(' and previous:
+            # Keep the function name visible to the following string token
+            continue
+
+        previous = statement[-1] if kind == 'identifier' else None
+
+    finish_statement()
+    if procedure:
+        # Unterminated procedure at the end of the module
+        procedure['end_line'] = line
+        procedure['complexity'] = 1 + procedure['loop_count'] + procedure['branch_count']
+        procedures.append(procedure)
+
+    return {
+        'line_count': line,
+        'keywords': keywords,
+        'identifiers': identifiers,
+        'api_usage': api_usage,
+        'loop_count': loop_count,
+        'branch_count': branch_count,
+        'file_io': file_io,
+        'sql_strings': sql_strings,
+        'procedures': procedures
+    }
+
+
+def uses_category(api_usage, category):
+    """Check whether any API of a category was used"""
+    return any(api_usage.get(api) for api in API_CATEGORIES[category])
+
+
+def is_event_handler(procedure):
+    """Check whether a procedure is a workbook, worksheet or form event handler"""
+    return procedure['name'].lower().startswith(EVENT_PREFIXES)
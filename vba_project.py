@@ -0,0 +1,370 @@
+# core/vba_project.py
+import codecs
+import struct
+
+# Compound File Binary format constants [MS-CFB]
+OLE_SIGNATURE = b'\xd0\xcf\x11\xe0\xa1\xb1\x1a\xe1'
+MAX_REGULAR_SECTOR = 0xFFFFFFFA
+ENDOFCHAIN = 0xFFFFFFFE
+FREESECT = 0xFFFFFFFF
+NOSTREAM = 0xFFFFFFFF
+DIRECTORY_ENTRY_SIZE = 128
+STGTY_STORAGE = 1
+STGTY_STREAM = 2
+STGTY_ROOT = 5
+
+# dir stream record ids [MS-OVBA 2.3.4.2]
+PROJECTCODEPAGE = 0x0003
+PROJECTVERSION = 0x0009
+PROJECTMODULES = 0x000F
+DIR_TERMINATOR = 0x0010
+MODULENAME = 0x0019
+MODULESTREAMNAME = 0x001A
+MODULETYPE_PROCEDURAL = 0x0021
+MODULETYPE_DOCUMENT = 0x0022
+MODULE_TERMINATOR = 0x002B
+MODULEOFFSET = 0x0031
+MODULESTREAMNAMEUNICODE = 0x0032
+MODULENAMEUNICODE = 0x0047
+
+# Module kinds declared in the PROJECT stream [MS-OVBA 2.3.1.7]
+PROJECT_MODULE_TYPES = {
+    'module': 'Standard',
+    'document': 'Document',
+    'class': 'Class',
+    'baseclass': 'Form'
+}
+
+
+class VBAProjectError(Exception):
+    """Raised when a vbaProject.bin cannot be parsed"""
+
+
+class CompoundFile:
+    """Minimal reader for OLE compound files such as vbaProject.bin"""
+
+    def __init__(self, data):
+        self.data = memoryview(data)
+        if len(self.data) < 512 or bytes(self.data[:8]) != OLE_SIGNATURE:
+            raise VBAProjectError("Not an OLE compound file")
+
+        self.sector_size = 1 << struct.unpack_from('<H', self.data, 0x1E)[0]
+        self.mini_sector_size = 1 << struct.unpack_from('<H', self.data, 0x20)[0]
+        (self.first_directory_sector,) = struct.unpack_from('<I', self.data, 0x30)
+        (self.mini_stream_cutoff,
+         self.first_mini_fat_sector,
+         self.mini_fat_sector_count,
+         self.first_difat_sector,
+         self.difat_sector_count) = struct.unpack_from('<5I', self.data, 0x38)
+
+        self.fat = self._read_fat()
+        self.entries = self._read_directory()
+        self.paths = self._build_paths()
+
+        root = self.entries[0]
+        self.mini_fat = self._read_mini_fat()
+        self.mini_stream = self._read_chain(root['start'], root['size'])
+
+    def _sector(self, sector_id):
+        """Return a view of a regular sector"""
+        offset = (sector_id + 1) * self.sector_size
+        return self.data[offset:offset + self.sector_size]
+
+    def _follow(self, start, table):
+        """Yield the sector ids of a chain, guarding against loops"""
+        sector_id = start
+        for _ in range(len(table) + 1):
+            if sector_id > MAX_REGULAR_SECTOR:
+                return
+            if sector_id >= len(table):
+                raise VBAProjectError(f"Sector {sector_id} outside of allocation table")
+            yield sector_id
+            sector_id = table[sector_id]
+        raise VBAProjectError("Loop detected in sector chain")
+
+    def _read_fat(self):
+        """Read the sector allocation table using the header and DIFAT sectors"""
+        per_sector = self.sector_size // 4
+        difat = [sid for sid in struct.unpack_from('<109I', self.data, 0x4C) if sid <= MAX_REGULAR_SECTOR]
+
+        sector_id = self.first_difat_sector
+        for _ in range(self.difat_sector_count):
+            if sector_id > MAX_REGULAR_SECTOR:
+                break
+            values = struct.unpack_from(f'<{per_sector}I', self._sector(sector_id))
+            difat.extend(sid for sid in values[:-1] if sid <= MAX_REGULAR_SECTOR)
+            sector_id = values[-1]
+
+        fat = []
+        for sid in difat:
+            fat.extend(struct.unpack_from(f'<{per_sector}I', self._sector(sid)))
+        return fat
+
+    def _read_chain(self, start, size=None):
+        """Read a stream stored in regular sectors"""
+        data = b''.join(self._sector(sid) for sid in self._follow(start, self.fat))
+        return data if size is None else data[:size]
+
+    def _read_mini_fat(self):
+        """Read the mini sector allocation table"""
+        if self.mini_fat_sector_count == 0 or self.first_mini_fat_sector > MAX_REGULAR_SECTOR:
+            return []
+        data = self._read_chain(self.first_mini_fat_sector)
+        return list(struct.unpack_from(f'<{len(data) // 4}I', data))
+
+    def _read_mini_chain(self, start, size):
+        """Read a stream stored in the mini stream"""
+        view = memoryview(self.mini_stream)
+        step = self.mini_sector_size
+        data = b''.join(view[sid * step:(sid + 1) * step] for sid in self._follow(start, self.mini_fat))
+        return data[:size]
+
+    def _read_directory(self):
+        """Parse all directory entries"""
+        data = memoryview(self._read_chain(self.first_directory_sector))
+        entries = []
+
+        for offset in range(0, len(data) - DIRECTORY_ENTRY_SIZE + 1, DIRECTORY_ENTRY_SIZE):
+            name_length = struct.unpack_from('<H', data, offset + 64)[0]
+            entry_type = data[offset + 66]
+            left, right, child = struct.unpack_from('<III', data, offset + 68)
+            start, size = struct.unpack_from('<IQ', data, offset + 116)
+            if self.sector_size == 512:
+                # Version 3 files only use the low 32 bits of the size
+                size &= 0xFFFFFFFF
+            name = bytes(data[offset:offset + max(0, name_length - 2)]).decode('utf-16-le', errors='replace')
+            entries.append({
+                'name': name,
+                'type': entry_type,
+                'left': left,
+                'right': right,
+                'child': child,
+                'start': start,
+                'size': size
+            })
+
+        if not entries or entries[0]['type'] != STGTY_ROOT:
+            raise VBAProjectError("Missing root directory entry")
+        return entries
+
+    def _build_paths(self):
+        """Map lower-case slash separated paths to directory entry indexes"""
+        paths = {}
+        visited = set()
+        stack = [(self.entries[0]['child'], '')]
+
+        while stack:
+            index, parent = stack.pop()
+            if index == NOSTREAM or index >= len(self.entries) or index in visited:
+                continue
+            visited.add(index)
+            entry = self.entries[index]
+            path = f"{parent}/{entry['name']}" if parent else entry['name']
+            paths[path.lower()] = index
+
+            stack.append((entry['left'], parent))
+            stack.append((entry['right'], parent))
+            if entry['type'] == STGTY_STORAGE:
+                stack.append((entry['child'], path))
+
+        return paths
+
+    def exists(self, path):
+        """Check whether a stream or storage exists"""
+        return path.lower() in self.paths
+
+    def open_stream(self, path):
+        """Return the content of a stream"""
+        index = self.paths.get(path.lower())
+        if index is None:
+            raise VBAProjectError(f"Stream not found: {path}")
+
+        entry = self.entries[index]
+        if entry['type'] != STGTY_STREAM:
+            raise VBAProjectError(f"Not a stream: {path}")
+        if entry['size'] < self.mini_stream_cutoff:
+            return self._read_mini_chain(entry['start'], entry['size'])
+        return self._read_chain(entry['start'], entry['size'])
+
+
+def decompress(data, offset=0):
+    """Decompress an MS-OVBA compressed container starting at offset"""
+    view = memoryview(data)
+    end = len(view)
+    if offset >= end or view[offset] != 0x01:
+        raise VBAProjectError("Invalid compressed container signature")
+
+    out = bytearray()
+    pos = offset + 1
+
+    while pos + 2 <= end:
+        header = view[pos] | (view[pos + 1] << 8)
+        chunk_end = min(pos + (header & 0x0FFF) + 3, end)
+        pos += 2
+        chunk_start = len(out)
+
+        if not header & 0x8000:
+            # Uncompressed chunk of raw bytes
+            out += view[pos:pos + 4096]
+            pos += 4096
+            continue
+
+        while pos < chunk_end:
+            flags = view[pos]
+            pos += 1
+            if flags == 0 and pos + 8 <= chunk_end:
+                # Fast path for a run of eight literal bytes
+                out += view[pos:pos + 8]
+                pos += 8
+                continue
+            for bit in range(8):
+                if pos >= chunk_end:
+                    break
+                if not flags & (1 << bit):
+                    out.append(view[pos])
+                    pos += 1
+                    continue
+
+                # Copy token: offset and length share 16 bits depending on
+                # how far into the chunk the decompression has progressed
+                token = view[pos] | (view[pos + 1] << 8) if pos + 1 < end else view[pos]
+                pos += 2
+                bit_count = max((len(out) - chunk_start - 1).bit_length(), 4)
+                length = (token & (0xFFFF >> bit_count)) + 3
+                distance = (token >> (16 - bit_count)) + 1
+                source = len(out) - distance
+                if source < chunk_start:
+                    raise VBAProjectError("Copy token points before the start of the chunk")
+                if distance >= length:
+                    out += out[source:source + length]
+                else:
+                    pattern = out[source:]
+                    out += (pattern * (length // distance + 1))[:length]
+
+        pos = chunk_end
+
+    return bytes(out)
+
+
+def _codec(codepage):
+    """Return a Python codec name for a Windows code page"""
+    names = {65001: 'utf-8', 10000: 'mac_roman', 1200: 'utf-16-le'}
+    name = names.get(codepage, f'cp{codepage}')
+    try:
+        codecs.lookup(name)
+        return name
+    except LookupError:
+        return 'latin-1'
+
+
+def parse_dir_stream(data):
+    """Parse a decompressed dir stream into (code page, module records)"""
+    view = memoryview(data)
+    codepage = 1252
+    modules = []
+    module = None
+    pos = 0
+
+    while pos + 6 <= len(view):
+        record_id, size = struct.unpack_from('<HI', view, pos)
+        pos += 6
+
+        if record_id == PROJECTVERSION:
+            # The size field is reserved; the record always carries 6 bytes
+            pos += 6
+            continue
+
+        value = view[pos:pos + size]
+        pos += size
+
+        if record_id == PROJECTCODEPAGE:
+            codepage = struct.unpack_from('<H', value)[0]
+        elif record_id == MODULENAME:
+            module = {
+                'name': bytes(value).decode(_codec(codepage), errors='replace'),
+                'stream': None,
+                'offset': 0,
+                'procedural': True
+            }
+            modules.append(module)
+        elif module is None:
+            if record_id == DIR_TERMINATOR:
+                break
+        elif record_id == MODULENAMEUNICODE:
+            module['name'] = bytes(value).decode('utf-16-le', errors='replace')
+        elif record_id == MODULESTREAMNAME:
+            module['stream'] = bytes(value).decode(_codec(codepage), errors='replace')
+        elif record_id == MODULESTREAMNAMEUNICODE:
+            module['stream'] = bytes(value).decode('utf-16-le', errors='replace')
+        elif record_id == MODULEOFFSET:
+            module['offset'] = struct.unpack_from('<I', value)[0]
+        elif record_id == MODULETYPE_DOCUMENT:
+            module['procedural'] = False
+        elif record_id == MODULE_TERMINATOR:
+            module = None
+        elif record_id == DIR_TERMINATOR:
+            break
+
+    return codepage, modules
+
+
+def parse_project_stream(data, codec):
+    """Read the module kinds declared in the PROJECT stream"""
+    types = {}
+    for line in data.decode(codec, errors='replace').splitlines():
+        if line.startswith('['):
+            break
+        key, _, value = line.partition('=')
+        module_type = PROJECT_MODULE_TYPES.get(key.strip().lower())
+        if module_type:
+            # Document modules are declared as Name/&H00000000
+            types[value.split('/')[0].strip()] = module_type
+    return types
+
+
+class VBAProject:
+    """Reads VBA module source code from a vbaProject.bin"""
+
+    def __init__(self, data):
+        self.ole = CompoundFile(data)
+        self.vba_storage = self._find_vba_storage()
+
+        # The dir stream is read and decompressed exactly once
+        dir_data = decompress(self.ole.open_stream(f"{self.vba_storage}/dir"))
+        self.codepage, self.modules = parse_dir_stream(dir_data)
+        self.codec = _codec(self.codepage)
+
+        self.module_types = {}
+        project_path = self.vba_storage.rpartition('/')[0]
+        project_path = f"{project_path}/PROJECT" if project_path else 'PROJECT'
+        if self.ole.exists(project_path):
+            self.module_types = parse_project_stream(self.ole.open_stream(project_path), self.codec)
+
+    def _find_vba_storage(self):
+        """Locate the storage holding the dir stream"""
+        if self.ole.exists('VBA/dir'):
+            return 'VBA'
+        for path in self.ole.paths:
+            if path.endswith('/vba/dir'):
+                return path[:-len('/dir')]
+        raise VBAProjectError("No VBA dir stream found")
+
+    def iter_modules(self):
+        """Yield every module with its decompressed source code"""
+        for module in self.modules:
+            if not module['stream']:
+                continue
+
+            stream = self.ole.open_stream(f"{self.vba_storage}/{module['stream']}")
+            # The source follows the compiled p-code at the recorded offset
+            code = decompress(stream, module['offset']).decode(self.codec, errors='replace')
+
+            module_type = self.module_types.get(module['name'])
+            if not module_type:
+                module_type = 'Standard' if module['procedural'] else 'Class'
+
+            yield {
+                'name': module['name'],
+                'type': module_type,
+                'code': code
+            }
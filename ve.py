@@ -1,20 +1,105 @@
 # embedding/vector_embedder.py
+import os
 import boto3
 import json
 import base64
 import uuid
+import time
+import random
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from config.settings import (
     AWS_ACCESS_KEY_ID, 
     AWS_SECRET_ACCESS_KEY, 
     AWS_REGION,
     TITAN_TEXT_MODEL,
-    TITAN_IMAGE_MODEL
+    TITAN_IMAGE_MODEL,
+    EMBED_MAX_WORKERS,
+    EMBED_MAX_RETRIES,
+    EMBED_BACKOFF_BASE,
+    EMBED_BACKOFF_MAX,
+    EMBEDDING_CACHE_PATH,
+    EMBEDDING_CACHE_MAX_BYTES,
+    STORE_BATCH_SIZE
 )
+from embedding.embedding_cache import EmbeddingCache
+from core import metrics
+
+# Bedrock error codes that mean the request rate should come down
+THROTTLING_ERROR_CODES = {
+    'ThrottlingException',
+    'TooManyRequestsException',
+    'ServiceQuotaExceededException'
+}
+
+# Transient error codes that are worth retrying
+RETRYABLE_ERROR_CODES = THROTTLING_ERROR_CODES | {
+    'ServiceUnavailableException',
+    'InternalServerException',
+    'ModelNotReadyException',
+    'ModelTimeoutException'
+}
+
+def _error_code(error):
+    """Return the AWS error code of a botocore ClientError, if any"""
+    response = getattr(error, 'response', None)
+    if isinstance(response, dict):
+        return response.get('Error', {}).get('Code')
+    return None
+
+class AdaptiveConcurrencyLimiter:
+    """Limit in-flight requests, halving the limit on throttling and growing it back slowly"""
+    
+    def __init__(self, max_limit, min_limit=1):
+        self.max_limit = max_limit
+        self.min_limit = min_limit
+        self.limit = float(max_limit)
+        self.in_flight = 0
+        self.throttle_count = 0
+        # Smoothed request latency; throttles within one latency of the last
+        # decrease are the same congestion event and only halve the limit once
+        self.latency = 0.0
+        self._last_decrease = 0.0
+        self._condition = threading.Condition()
+    
+    def acquire(self):
+        """Wait until a request slot is available"""
+        with self._condition:
+            while self.in_flight >= int(self.limit):
+                self._condition.wait()
+            self.in_flight += 1
+    
+    def release(self):
+        """Give a request slot back"""
+        with self._condition:
+            self.in_flight -= 1
+            self._condition.notify()
+    
+    def on_success(self, latency):
+        """Additively increase the limit, by about one slot per window of successes"""
+        with self._condition:
+            self.latency = latency if not self.latency else 0.8 * self.latency + 0.2 * latency
+            if self.limit < self.max_limit:
+                self.limit = min(self.max_limit, self.limit + 1.0 / self.limit)
+                self._condition.notify_all()
+    
+    def on_throttle(self):
+        """Multiplicatively decrease the limit once per congestion event"""
+        with self._condition:
+            self.throttle_count += 1
+            now = time.monotonic()
+            if now - self._last_decrease >= self.latency:
+                self.limit = max(self.min_limit, self.limit / 2)
+                self._last_decrease = now
 
 class TitanEmbedder:
-    def __init__(self):
-        # Initialize Bedrock client
-        self.bedrock_client = boto3.client(
+    _shared = None
+    _shared_pid = None
+    _shared_lock = threading.Lock()
+    
+    def __init__(self, bedrock_client=None, cache=None):
+        # Initialize Bedrock client unless one is provided (e.g. a local stub)
+        self.bedrock_client = bedrock_client or boto3.client(
             service_name='bedrock-runtime',
             region_name=AWS_REGION,
             aws_access_key_id=AWS_ACCESS_KEY_ID,
@@ -22,38 +107,146 @@ class TitanEmbedder:
         )
         self.text_model_id = TITAN_TEXT_MODEL
         self.image_model_id = TITAN_IMAGE_MODEL
+        self.max_workers = EMBED_MAX_WORKERS
+        self.max_retries = EMBED_MAX_RETRIES
+        
+        # Content-addressed embedding cache; an empty path disables it
+        if cache is None and EMBEDDING_CACHE_PATH:
+            try:
+                cache = EmbeddingCache(EMBEDDING_CACHE_PATH, max_bytes=EMBEDDING_CACHE_MAX_BYTES)
+            except Exception as e:
+                print(f"Error opening embedding cache: {str(e)}")
+        self.cache = cache or None
     
-    def embed_text(self, text):
-        """Generate embeddings for text using Amazon Titan"""
-        try:
-            # Prepare the request body
-            request_body = {
-                "inputText": text
-            }
-            
-            # Convert the request body to JSON
-            body = json.dumps(request_body)
-            
-            # Make the API call
+    @classmethod
+    def shared(cls):
+        """Return the process-wide embedder; boto3 clients are safe to share between threads"""
+        with cls._shared_lock:
+            if cls._shared is None or cls._shared_pid != os.getpid():
+                cls._shared = cls()
+                cls._shared_pid = os.getpid()
+            return cls._shared
+    
+    def _invoke_text_model(self, text):
+        """Call the text embedding model once, raising on API errors"""
+        # Prepare the request body
+        request_body = {
+            "inputText": text
+        }
+        
+        # Convert the request body to JSON
+        body = json.dumps(request_body)
+        
+        # Make the API call
+        metrics.increment('bedrock_calls_total', model=self.text_model_id)
+        metrics.increment('bedrock_request_bytes_total', len(body), model=self.text_model_id)
+        with metrics.timer('bedrock_invoke_seconds', model=self.text_model_id):
             response = self.bedrock_client.invoke_model(
                 modelId=self.text_model_id,
                 contentType='application/json',
                 accept='application/json',
                 body=body
             )
-            
-            # Parse the response
-            response_body = json.loads(response['body'].read())
-            
-            # Extract and return the embedding
-            if 'embedding' in response_body:
-                return response_body['embedding']
-            else:
-                print(f"Error: Unexpected response format: {response_body}")
-                return None
+        
+        # Parse the response
+        response_body = json.loads(response['body'].read())
+        
+        # Extract and return the embedding
+        if 'embedding' in response_body:
+            return response_body['embedding']
+        else:
+            print(f"Error: Unexpected response format: {response_body}")
+            return None
+    
+    def embed_text(self, text):
+        """Generate embeddings for text using Amazon Titan"""
+        if self.cache:
+            embedding = self.cache.get(self.text_model_id, text)
+            if embedding:
+                return embedding
+        
+        try:
+            embedding = self._invoke_text_model(text)
         except Exception as e:
             print(f"Error generating text embedding: {str(e)}")
             return None
+        
+        if self.cache and embedding:
+            self.cache.put(self.text_model_id, text, embedding)
+        return embedding
+    
+    def embed_texts(self, texts, max_workers=None):
+        """Generate embeddings for many texts concurrently, returned in input order"""
+        texts = list(texts)
+        results = [None] * len(texts)
+        if not texts:
+            return results
+        
+        # Serve cached texts without touching the network
+        if self.cache:
+            results = self.cache.get_many(self.text_model_id, texts)
+        
+        # Identical texts within the batch are only embedded once
+        pending = {}
+        for index, text in enumerate(texts):
+            if results[index] is None:
+                pending.setdefault(text, []).append(index)
+        if not pending:
+            return results
+        
+        unique_texts = list(pending)
+        embeddings = [None] * len(unique_texts)
+        max_workers = min(max_workers or self.max_workers, len(unique_texts))
+        limiter = AdaptiveConcurrencyLimiter(max_workers)
+        
+        def embed(position):
+            embeddings[position] = self._embed_with_retry(unique_texts[position], limiter)
+        
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            # Consume the iterator so worker exceptions are raised here
+            list(executor.map(embed, range(len(unique_texts))))
+        
+        for text, embedding in zip(unique_texts, embeddings):
+            for index in pending[text]:
+                results[index] = embedding
+        
+        if self.cache:
+            self.cache.put_many(self.text_model_id, zip(unique_texts, embeddings))
+        
+        return results
+    
+    def _embed_with_retry(self, text, limiter):
+        """Embed one text, retrying transient failures with jittered exponential backoff"""
+        for attempt in range(self.max_retries + 1):
+            limiter.acquire()
+            started = time.monotonic()
+            try:
+                embedding = self._invoke_text_model(text)
+                limiter.on_success(time.monotonic() - started)
+                return embedding
+            except Exception as e:
+                code = _error_code(e)
+                if code in THROTTLING_ERROR_CODES:
+                    metrics.increment('bedrock_throttled_total', model=self.text_model_id)
+                    limiter.on_throttle()
+                elif code is not None and code not in RETRYABLE_ERROR_CODES:
+                    print(f"Error generating text embedding: {str(e)}")
+                    metrics.increment('embedding_failures_total', reason=code)
+                    return None
+                
+                if attempt == self.max_retries:
+                    print(f"Error generating text embedding after {attempt + 1} attempts: {str(e)}")
+                    metrics.increment('embedding_failures_total', reason='retries_exhausted')
+                    return None
+                metrics.increment('bedrock_retries_total', model=self.text_model_id)
+            finally:
+                limiter.release()
+            
+            # Full jitter keeps concurrent workers from retrying in lockstep
+            delay = min(EMBED_BACKOFF_MAX, EMBED_BACKOFF_BASE * (2 ** attempt))
+            time.sleep(random.uniform(0, delay))
+        
+        return None
     
     def embed_image(self, image_path):
         """Generate embeddings for an image using Amazon Titan"""
@@ -94,10 +287,9 @@ class TitanEmbedder:
             print(f"Error generating image embedding: {str(e)}")
             return None
 
-    def generate_euda_embedding(self, euda_info):
-        """Generate embeddings for an EUDA based on its summary information"""
-        # Create a descriptive text about the EUDA
-        euda_description = f"""
+    def _euda_description(self, euda_info):
+        """Create a descriptive text about the EUDA"""
+        return f"""
         Filename: {euda_info.get('filename', 'Unknown')}
         Number of sheets: {len(euda_info.get('sheets', []))}
         Has macros: {euda_info.get('has_macros', False)}
@@ -107,14 +299,15 @@ class TitanEmbedder:
         Formula count: {euda_info.get('formula_count', 0)}
         Sheet names: {', '.join(euda_info.get('sheets', []))}
         """
-        
+    
+    def generate_euda_embedding(self, euda_info):
+        """Generate embeddings for an EUDA based on its summary information"""
         # Generate embedding for the EUDA description
-        return self.embed_text(euda_description)
+        return self.embed_text(self._euda_description(euda_info))
     
-    def generate_macro_embedding(self, macro_info):
-        """Generate embeddings for a macro based on its code and metadata"""
-        # Create a descriptive text about the macro
-        macro_description = f"""
+    def _macro_description(self, macro_info):
+        """Create a descriptive text about the macro"""
+        return f"""
         Macro name: {macro_info.get('name', 'Unknown')}
         Macro type: {macro_info.get('type', 'Unknown')}
         Purpose: {macro_info.get('purpose', 'Unknown')}
@@ -127,19 +320,80 @@ class TitanEmbedder:
         Code:
         {macro_info.get('code', '')}
         """
-        
+    
+    def generate_macro_embedding(self, macro_info):
+        """Generate embeddings for a macro based on its code and metadata"""
         # Generate embedding for the macro description
-        return self.embed_text(macro_description)
+        return self.embed_text(self._macro_description(macro_info))
     
-    def generate_formula_embedding(self, formula_info):
-        """Generate embeddings for a formula based on its details"""
-        # Create a descriptive text about the formula
-        formula_description = f"""
+    def generate_macro_embeddings(self, macro_infos):
+        """Generate embeddings for many macros in one concurrent batch"""
+        return self.embed_texts(self._macro_description(macro_info) for macro_info in macro_infos)
+    
+    def _formula_description(self, formula_info):
+        """Create a descriptive text about the formula"""
+        return f"""
         Sheet: {formula_info.get('sheet', 'Unknown')}
         Cell: {formula_info.get('cell', 'Unknown')}
         Formula: {formula_info.get('formula', 'Unknown')}
         Formula type: {formula_info.get('type', 'Unknown')}
         """
-        
+    
+    def generate_formula_embedding(self, formula_info):
+        """Generate embeddings for a formula based on its details"""
         # Generate embedding for the formula description
-        return self.embed_text(formula_description)
\ No newline at end of file
+        return self.embed_text(self._formula_description(formula_info))
+    
+    def generate_formula_embeddings(self, formula_infos):
+        """Generate embeddings for many formulas in one concurrent batch"""
+        return self.embed_texts(self._formula_description(formula_info) for formula_info in formula_infos)
+    
+    def _formula_group_description(self, formula_group):
+        """Create a descriptive text about a logical formula, independent of where it is used"""
+        return f"""
+        Formula (R1C1): {formula_group.get('normalized', 'Unknown')}
+        Formula type: {formula_group.get('type', 'Unknown')}
+        """
+    
+    def generate_formula_group_embeddings(self, formula_groups):
+        """Generate embeddings for many formula groups in one concurrent batch"""
+        return self.embed_texts(self._formula_group_description(formula_group) for formula_group in formula_groups)
+    
+    def content_texts(self, euda_info, macros=None, formulas=None):
+        """Yield every text embedded when an EUDA is stored: its summary, macros and formulas
+        
+        macros and formulas default to those of the EUDA; pass a subset to
+        yield the texts of only that content.
+        """
+        yield self._euda_description(euda_info)
+        if macros is None:
+            macros = euda_info.get('macros') or []
+        if formulas is None:
+            formulas = euda_info.get('formula_groups') or euda_info.get('formulas') or []
+        for macro_info in macros:
+            yield self._macro_description(macro_info)
+        for formula_info in formulas:
+            if 'ranges' in formula_info:
+                yield self._formula_group_description(formula_info)
+            else:
+                yield self._formula_description(formula_info)
+    
+    def iter_formula_group_embeddings(self, formula_groups, batch_size=STORE_BATCH_SIZE):
+        """Yield one embedding per formula group, embedding each logical formula once
+        
+        Groups must be sorted by their normalized formula, so that the groups
+        of one logical formula on different sheets are adjacent.
+        """
+        distinct = []
+        for formula_group in formula_groups:
+            if distinct and distinct[-1][0]['normalized'] == formula_group['normalized']:
+                distinct[-1][1] += 1
+            else:
+                distinct.append([formula_group, 1])
+        
+        for start in range(0, len(distinct), batch_size):
+            batch = distinct[start:start + batch_size]
+            embeddings = self.generate_formula_group_embeddings(formula_group for formula_group, _ in batch)
+            for (_, count), embedding in zip(batch, embeddings):
+                for _ in range(count):
+                    yield embedding
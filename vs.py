@@ -1,151 +1,595 @@
 # embedding/vector_store.py
 import psycopg2
-from psycopg2.extras import execute_values
-from core.database import Database
+import hashlib
+from itertools import islice
+from operator import itemgetter
+from psycopg2.extras import execute_values, execute_batch
+from core.database import DatabasePool, VECTOR_CONTENT_TYPES, VECTOR_QUANTIZATIONS
+from core import metrics
 from embedding.vector_embedder import TitanEmbedder
+from config.settings import STORE_BATCH_SIZE, VECTOR_STORE_BACKEND, VECTOR_QUANTIZATION, VECTOR_RERANK_FACTOR
 import json
 
+def _vector_literal(embedding):
+    """Format an embedding in pgvector's text representation"""
+    return '[' + ','.join(map(str, embedding)) + ']'
+
+def _copy_value(value):
+    """Escape a value for COPY ... FROM STDIN in text format"""
+    if value is None:
+        return '\\N'
+    if isinstance(value, (list, tuple)):
+        return _vector_literal(value)
+    return (str(value).replace('\\', '\\\\').replace('\t', '\\t')
+            .replace('\n', '\\n').replace('\r', '\\r'))
+
+# Extra result columns and link table per searchable content type. Macro and formula
+# embeddings are shared by content hash; a match is reported through the first row
+# linking to it (see find_macro_clones for all of them).
+SEARCH_CONTENT_COLUMNS = {
+    'euda': ('', None),
+    'macro': (', c.macro_name, c.purpose, c.complexity_score', 'macros'),
+    'formula': (', c.worksheet, c.cell_reference, c.formula, c.cell_ranges, c.cell_count', 'formulas')
+}
+SEARCH_RESULT_FIELDS = {
+    'euda': (),
+    'macro': ('macro_name', 'macro_purpose', 'macro_complexity'),
+    'formula': ('worksheet', 'cell_reference', 'formula', 'cell_ranges', 'cell_count')
+}
+
+def _formula_columns(formula):
+    """Values of the formula group columns; ungrouped formulas are a group of one cell"""
+    ranges = formula.get('ranges')
+    return (
+        formula.get('normalized'),
+        ' '.join(ranges) if ranges else None,
+        formula.get('cell_count', 1)
+    )
+
+def _formula_records(euda_info):
+    """Formula records to store: the formula groups when the analyzer produced them
+    
+    Groups are ordered by normalized formula so that each logical formula is
+    embedded once, even when it is used on several sheets.
+    """
+    if euda_info.get('formula_groups'):
+        return sorted(euda_info['formula_groups'], key=itemgetter('normalized'))
+    return euda_info.get('formulas') or []
+
+def _content_hash(*values):
+    """Hash of the values an embedding is generated from"""
+    digest = hashlib.sha256()
+    for value in values:
+        digest.update(repr(value).encode('utf-8'))
+        digest.update(b'\0')
+    return digest.hexdigest()
+
+def _euda_hash(euda_info):
+    """Content hash of the EUDA summary fields that are embedded"""
+    return _content_hash(*(euda_info.get(key) for key in (
+        'filename', 'sheets', 'has_macros', 'has_formulas', 'has_external_connections',
+        'complexity_score', 'formula_count'
+    )))
+
+def _macro_hash(macro):
+    """Content hash of the macro fields that are embedded"""
+    return _content_hash(*(macro.get(key) for key in (
+        'name', 'type', 'purpose', 'complexity', 'interacts_with_database',
+        'interacts_with_external_files', 'handles_events', 'has_user_interface', 'code'
+    )))
+
+def _formula_hash(formula):
+    """Content hash of a formula; a group is embedded from its normalized formula only"""
+    if 'ranges' in formula:
+        return _content_hash(formula.get('normalized'), formula.get('type'))
+    return _content_hash(formula.get('sheet'), formula.get('cell'), formula.get('formula'), formula.get('type'))
+
+def _code_hash(code):
+    """Address of a module's code in macro_code: the SHA-256 of the code text"""
+    if code is None:
+        return None
+    return hashlib.sha256(code.encode('utf-8')).hexdigest()
+
+def _macro_values(macro):
+    return (macro.get('name'), _code_hash(macro.get('code')), macro.get('purpose'), macro.get('complexity', 0))
+
+def _formula_values(formula):
+    return (formula.get('sheet'), formula.get('cell'), formula.get('formula'),
+            formula.get('purpose', 'Unknown')) + _formula_columns(formula)
+
+def _formula_key(values):
+    """Identity of a formula row: its sheet and normalized formula for a group, its cell otherwise"""
+    worksheet, cell_reference, _, _, normalized_formula, cell_ranges, _ = values
+    return (worksheet, normalized_formula) if cell_ranges else (worksheet, cell_reference)
+
+# Per content type: table, compared columns, row values, row identity and content hash.
+# Macro code and macro and formula embeddings are stored once per hash and shared
+# by the rows of every EUDA that has the same content.
+UPSERT_CONTENT = {
+    'macro': ('macros', ('macro_name', 'code_hash', 'purpose', 'complexity_score'),
+              _macro_values, itemgetter(0), _macro_hash),
+    'formula': ('formulas', ('worksheet', 'cell_reference', 'formula', 'purpose',
+                             'normalized_formula', 'cell_ranges', 'cell_count'),
+                _formula_values, _formula_key, _formula_hash)
+}
+
+class _CopySource:
+    """File-like object that feeds COPY from a row iterator without building the whole payload"""
+    
+    def __init__(self, rows):
+        self._rows = iter(rows)
+        self._buffer = ''
+    
+    def read(self, size=-1):
+        parts = [self._buffer]
+        length = len(self._buffer)
+        for row in self._rows:
+            line = '\t'.join(_copy_value(value) for value in row) + '\n'
+            parts.append(line)
+            length += len(line)
+            if 0 <= size <= length:
+                break
+        data = ''.join(parts)
+        if size < 0:
+            self._buffer = ''
+            return data
+        self._buffer = data[size:]
+        return data[:size]
+    
+    def readline(self, size=-1):
+        return self.read(size)
+
 class VectorStore:
-    def __init__(self):
-        """Initialize the vector store with database connection"""
-        self.db = Database()
-        self.conn = self.db.connect()
-        self.embedder = TitanEmbedder()
-    
-    def store_euda(self, euda_info, analysis=None):
-        """Store EUDA information and generate embeddings"""
+    # store_euda can update an EUDA in place with upsert=True
+    supports_upsert = True
+    
+    def __init__(self, bulk=True, pool=None, embedder=None, quantization=None, rerank_factor=None):
+        """Initialize the vector store with pooled database connections"""
+        # Stores in the same process share one connection pool and one Bedrock client
+        self.pool = pool or DatabasePool.shared()
+        self.embedder = embedder or TitanEmbedder.shared()
+        # Bulk mode writes rows and embeddings with COPY instead of row by row
+        self.bulk = bulk
+        # Quantized searches use the compact index for candidates and re-rank them exactly
+        self.quantization = (quantization or VECTOR_QUANTIZATION).lower()
+        if self.quantization not in VECTOR_QUANTIZATIONS:
+            raise ValueError(f"Unsupported vector quantization for PostgreSQL: {self.quantization}")
+        self.rerank_factor = rerank_factor or VECTOR_RERANK_FACTOR
+    
+    @metrics.timed('vector_store_euda_seconds')
+    def store_euda(self, euda_info, analysis=None, upsert=False):
+        """Store EUDA information and generate embeddings in a single transaction
+        
+        With upsert the EUDA last stored for the same file_path is updated in
+        place: macros and formulas are diffed against the stored rows, only
+        changed rows are written and only changed content is re-embedded.
+        """
         try:
-            cursor = self.conn.cursor()
-            
-            # Insert EUDA information
-            cursor.execute("""
-                INSERT INTO eudas (
-                    filename, file_path, complexity_score, has_macros, 
-                    has_formulas, has_external_connections, data_sensitivity,
-                    description, purpose
-                ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s) RETURNING id
-            """, (
-                euda_info.get('filename'),
-                euda_info.get('file_path'),
-                euda_info.get('complexity_score'),
-                euda_info.get('has_macros'),
-                euda_info.get('has_formulas'),
-                euda_info.get('has_external_connections'),
-                analysis.get('data_sensitivity') if analysis else 'Unknown',
-                analysis.get('description') if analysis else None,
-                analysis.get('purpose') if analysis else None
-            ))
-            
-            # Get the EUDA ID
-            euda_id = cursor.fetchone()[0]
-            
-            # Generate and store embedding for the EUDA
-            embedding = self.embedder.generate_euda_embedding(euda_info)
-            if embedding:
-                cursor.execute("""
-                    INSERT INTO embeddings (
-                        euda_id, content_type, content_id, embedding
-                    ) VALUES (%s, %s, %s, %s)
-                """, (
-                    euda_id,
-                    'euda',
-                    euda_id,
-                    embedding
-                ))
-            
-            # Store macros if available
-            if 'macros' in euda_info and euda_info['macros']:
-                self._store_macros(cursor, euda_id, euda_info['macros'])
-            
-            # Store formulas if available
-            if 'formulas' in euda_info and euda_info['formulas']:
-                self._store_formulas(cursor, euda_id, euda_info['formulas'])
-            
-            self.conn.commit()
-            cursor.close()
+            with self.pool.cursor() as cursor:
+                euda_id = self._upsert_euda(cursor, euda_info, analysis) if upsert else None
+                macros = euda_info.get('macros') or []
+                formulas = _formula_records(euda_info)
+                if macros:
+                    self._store_macro_code(cursor, macros)
+                if euda_id is None:
+                    euda_id = self._insert_euda(cursor, euda_info, analysis)
+                else:
+                    # Only rows without a stored counterpart are left to insert
+                    macros = self._sync_rows(cursor, euda_id, 'macro', macros)
+                    formulas = self._sync_rows(cursor, euda_id, 'formula', formulas)
+                
+                # Store macros if available
+                if macros:
+                    store_macros = self._bulk_store_macros if self.bulk else self._store_macros
+                    store_macros(cursor, euda_id, macros)
+                
+                # Store formula groups, or individual formulas, if available
+                if formulas:
+                    store_formulas = self._bulk_store_formulas if self.bulk else self._store_formulas
+                    store_formulas(cursor, euda_id, formulas)
             
             return euda_id
         except Exception as e:
             print(f"Error storing EUDA: {str(e)}")
-            if self.conn:
-                self.conn.rollback()
+            metrics.increment('vector_store_failures_total', operation='store_euda')
+            return None
+    
+    def _insert_euda(self, cursor, euda_info, analysis=None):
+        """Insert the EUDA row and its embedding, returning the EUDA ID"""
+        # Insert EUDA information
+        cursor.execute("""
+            INSERT INTO eudas (
+                filename, file_path, complexity_score, has_macros, 
+                has_formulas, has_external_connections, data_sensitivity,
+                description, purpose, dependency_metrics, content_hash
+            ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s) RETURNING id
+        """, self._euda_values(euda_info, analysis))
+        
+        # Get the EUDA ID
+        euda_id = cursor.fetchone()[0]
+        
+        # Generate and store embedding for the EUDA
+        self._store_euda_embedding(cursor, euda_id, euda_info)
+        return euda_id
+    
+    def _euda_values(self, euda_info, analysis=None):
+        """Column values of the EUDA row, in the order of the eudas columns"""
+        return (
+            euda_info.get('filename'),
+            euda_info.get('file_path'),
+            euda_info.get('complexity_score'),
+            euda_info.get('has_macros'),
+            euda_info.get('has_formulas'),
+            euda_info.get('has_external_connections'),
+            analysis.get('data_sensitivity') if analysis else 'Unknown',
+            analysis.get('description') if analysis else None,
+            analysis.get('purpose') if analysis else None,
+            json.dumps(euda_info['dependency_metrics']) if euda_info.get('dependency_metrics') else None,
+            _euda_hash(euda_info)
+        )
+    
+    def _store_euda_embedding(self, cursor, euda_id, euda_info):
+        """Generate and store the embedding of the EUDA summary"""
+        embedding = self.embedder.generate_euda_embedding(euda_info)
+        if embedding:
+            cursor.execute("""
+                INSERT INTO embeddings (
+                    euda_id, content_type, content_id, embedding
+                ) VALUES (%s, %s, %s, %s)
+            """, (
+                euda_id,
+                'euda',
+                euda_id,
+                embedding
+            ))
+    
+    def _upsert_euda(self, cursor, euda_info, analysis=None):
+        """Update the EUDA last stored for the same file, returning its ID or None if there is none"""
+        file_path = euda_info.get('file_path')
+        # Concurrent stores of one file wait for each other instead of both inserting
+        cursor.execute("SELECT pg_advisory_xact_lock(hashtext(%s))", (file_path,))
+        cursor.execute("SELECT id, content_hash FROM eudas WHERE file_path = %s ORDER BY id DESC LIMIT 1",
+                       (file_path,))
+        row = cursor.fetchone()
+        if row is None:
             return None
+        
+        euda_id, stored_hash = row
+        values = self._euda_values(euda_info, analysis)
+        cursor.execute("""
+            UPDATE eudas SET
+                filename = %s, file_path = %s, complexity_score = %s, has_macros = %s,
+                has_formulas = %s, has_external_connections = %s, data_sensitivity = %s,
+                description = %s, purpose = %s, dependency_metrics = %s, content_hash = %s
+            WHERE id = %s
+        """, values + (euda_id,))
+        
+        # The summary embedding only changes with the summary
+        if stored_hash != values[-1]:
+            cursor.execute("DELETE FROM embeddings WHERE content_type = 'euda' AND content_id = %s", (euda_id,))
+            self._store_euda_embedding(cursor, euda_id, euda_info)
+        return euda_id
+    
+    def _sync_rows(self, cursor, euda_id, content_type, items):
+        """Diff macros or formulas against the stored rows of an EUDA and apply the changes
+        
+        Rows are matched by identity (macro name, formula cell or formula
+        group). Matched rows are updated when a column changed and get the
+        embedding of their new content hash when it changed; stored rows with
+        no match are deleted. Shared embeddings are left to prune_content.
+        Returns the items that have no stored row, in their original order,
+        for the caller to insert.
+        """
+        table, columns, row_values, row_key, content_hash = UPSERT_CONTENT[content_type]
+        cursor.execute(f"SELECT id, content_hash, {', '.join(columns)} FROM {table} WHERE euda_id = %s ORDER BY id",
+                       (euda_id,))
+        stored = {}
+        deleted = []
+        for row in cursor.fetchall():
+            key = row_key(row[2:])
+            if key in stored:
+                deleted.append(row[0])
+            else:
+                stored[key] = row
+        
+        inserted = []
+        updated = []
+        changed = []
+        for item in items:
+            values = row_values(item)
+            row = stored.pop(row_key(values), None)
+            if row is None:
+                inserted.append(item)
+                continue
+            item_hash = content_hash(item)
+            if row[1] != item_hash:
+                changed.append(item)
+            if row[1] != item_hash or tuple(row[2:]) != values:
+                updated.append(values + (item_hash, row[0]))
+        deleted.extend(row[0] for row in stored.values())
+        
+        if deleted:
+            cursor.execute(f"DELETE FROM {table} WHERE id = ANY(%s)", (deleted,))
+        if updated:
+            assignments = ', '.join(f"{column} = %s" for column in columns + ('content_hash',))
+            execute_batch(cursor, f"UPDATE {table} SET {assignments} WHERE id = %s", updated,
+                          page_size=STORE_BATCH_SIZE)
+        if changed:
+            self._store_content_embeddings(cursor, content_type, changed)
+        
+        if metrics.registry.enabled:
+            unchanged = len(items) - len(inserted) - len(updated)
+            for action, count in (('insert', len(inserted)), ('update', len(updated)),
+                                  ('delete', len(deleted)), ('unchanged', unchanged),
+                                  ('reembed', len(changed))):
+                metrics.increment('vector_store_upsert_rows_total', count, content_type=content_type, action=action)
+        return inserted
     
     def _store_macros(self, cursor, euda_id, macros):
         """Store macro information and generate embeddings"""
+        stored = []
         for macro in macros:
             try:
+                # A savepoint lets the other macros go through if one row fails
+                cursor.execute("SAVEPOINT store_row")
+                
                 # Insert macro information
                 cursor.execute("""
                     INSERT INTO macros (
-                        euda_id, macro_name, macro_code, purpose, complexity_score
-                    ) VALUES (%s, %s, %s, %s, %s) RETURNING id
+                        euda_id, macro_name, code_hash, purpose, complexity_score, content_hash
+                    ) VALUES (%s, %s, %s, %s, %s, %s)
                 """, (
                     euda_id,
                     macro.get('name'),
-                    macro.get('code'),
+                    _code_hash(macro.get('code')),
                     macro.get('purpose'),
-                    macro.get('complexity', 0)
+                    macro.get('complexity', 0),
+                    _macro_hash(macro)
                 ))
-                
-                # Get the macro ID
-                macro_id = cursor.fetchone()[0]
-                
-                # Generate and store embedding for the macro
-                embedding = self.embedder.generate_macro_embedding(macro)
-                if embedding:
-                    cursor.execute("""
-                        INSERT INTO embeddings (
-                            euda_id, content_type, content_id, embedding
-                        ) VALUES (%s, %s, %s, %s)
-                    """, (
-                        euda_id,
-                        'macro',
-                        macro_id,
-                        embedding
-                    ))
+                stored.append(macro)
+                cursor.execute("RELEASE SAVEPOINT store_row")
             except Exception as e:
                 print(f"Error storing macro: {str(e)}")
+                metrics.increment('vector_store_failures_total', operation='store_macro')
+                cursor.execute("ROLLBACK TO SAVEPOINT store_row")
                 # Continue with other macros even if one fails
+        
+        # Generate embeddings for content not stored yet, in concurrent batches
+        self._store_content_embeddings(cursor, 'macro', stored)
     
     def _store_formulas(self, cursor, euda_id, formulas):
         """Store formula information and generate embeddings"""
+        stored = []
         for formula in formulas:
             try:
+                # A savepoint lets the other formulas go through if one row fails
+                cursor.execute("SAVEPOINT store_row")
+                
                 # Insert formula information
                 cursor.execute("""
                     INSERT INTO formulas (
-                        euda_id, worksheet, cell_reference, formula, purpose
-                    ) VALUES (%s, %s, %s, %s, %s) RETURNING id
-                """, (
-                    euda_id,
-                    formula.get('sheet'),
-                    formula.get('cell'),
-                    formula.get('formula'),
-                    formula.get('purpose', 'Unknown')
-                ))
-                
-                # Get the formula ID
-                formula_id = cursor.fetchone()[0]
-                
-                # Generate and store embedding for the formula
-                embedding = self.embedder.generate_formula_embedding(formula)
-                if embedding:
-                    cursor.execute("""
-                        INSERT INTO embeddings (
-                            euda_id, content_type, content_id, embedding
-                        ) VALUES (%s, %s, %s, %s)
-                    """, (
-                        euda_id,
-                        'formula',
-                        formula_id,
-                        embedding
-                    ))
+                        euda_id, worksheet, cell_reference, formula, purpose,
+                        normalized_formula, cell_ranges, cell_count, content_hash
+                    ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)
+                """, (euda_id,) + _formula_values(formula) + (_formula_hash(formula),))
+                stored.append(formula)
+                cursor.execute("RELEASE SAVEPOINT store_row")
             except Exception as e:
                 print(f"Error storing formula: {str(e)}")
+                metrics.increment('vector_store_failures_total', operation='store_formula')
+                cursor.execute("ROLLBACK TO SAVEPOINT store_row")
                 # Continue with other formulas even if one fails
+        
+        # Generate embeddings for content not stored yet, in concurrent batches
+        self._store_content_embeddings(cursor, 'formula', stored)
+    
+    def _missing_hashes(self, cursor, query, hashes, *params):
+        """The hashes, in order, that the query (selecting stored hashes among %s) does not return"""
+        cursor.execute(query, params + (list(hashes),))
+        stored = {row[0] for row in cursor.fetchall()}
+        return [content_hash for content_hash in hashes if content_hash not in stored]
     
-    def search_similar_eudas(self, query, limit=5):
+    def _missing_embeddings(self, cursor, content_type, hashes):
+        """The content hashes, in order, that have no stored embedding of the content type"""
+        return self._missing_hashes(cursor, """
+            SELECT content_hash FROM embeddings WHERE content_type = %s AND content_hash = ANY(%s)
+        """, hashes, content_type)
+    
+    def missing_content(self, content_type, items):
+        """The macros or formula records whose content has no stored embedding yet
+        
+        Callers that embed ahead of store_euda, like the ingestion pipeline,
+        use it to skip content already stored for another EUDA. If the
+        lookup fails every item is returned, so nothing is left unembedded.
+        """
+        content_hash = UPSERT_CONTENT[content_type][4]
+        items = list(items)
+        if not items:
+            return []
+        hashes = [content_hash(item) for item in items]
+        try:
+            with self.pool.cursor() as cursor:
+                missing = set(self._missing_embeddings(cursor, content_type, list(dict.fromkeys(hashes))))
+        except Exception as e:
+            print(f"Error looking up stored {content_type} content: {str(e)}")
+            metrics.increment('vector_store_failures_total', operation='missing_content')
+            return items
+        return [item for item, item_hash in zip(items, hashes) if item_hash in missing]
+    
+    def _store_macro_code(self, cursor, macros):
+        """Store the code of modules not in macro_code yet, once per distinct code"""
+        code = {}
+        for macro in macros:
+            if macro.get('code') is not None:
+                code.setdefault(_code_hash(macro['code']), macro['code'])
+        if not code:
+            return
+        missing = self._missing_hashes(cursor, "SELECT code_hash FROM macro_code WHERE code_hash = ANY(%s)", code)
+        if missing:
+            # Another store may add the same module concurrently
+            execute_values(cursor, """
+                INSERT INTO macro_code (code_hash, macro_code) VALUES %s
+                ON CONFLICT (code_hash) DO NOTHING
+            """, [(code_hash, code[code_hash]) for code_hash in missing], page_size=STORE_BATCH_SIZE)
+        metrics.increment('vector_store_content_total', len(missing), content_type='macro_code', action='stored')
+        metrics.increment('vector_store_content_total', len(code) - len(missing), content_type='macro_code',
+                          action='reused')
+    
+    def _store_content_embeddings(self, cursor, content_type, items):
+        """Embed and store macro or formula content whose hash has no embedding yet
+        
+        Embeddings are keyed by content hash, so content already stored for
+        any EUDA is neither embedded nor stored again.
+        """
+        content_hash = UPSERT_CONTENT[content_type][4]
+        unique = {}
+        for item in items:
+            unique.setdefault(content_hash(item), item)
+        if not unique:
+            return
+        missing = self._missing_embeddings(cursor, content_type, unique)
+        metrics.increment('vector_store_content_total', len(unique) - len(missing), content_type=content_type,
+                          action='reused')
+        if not missing:
+            return
+        
+        embeddings = self._content_embeddings(content_type, [unique[key] for key in missing])
+        rows = ((content_type, key, _vector_literal(embedding))
+                for key, embedding in zip(missing, embeddings) if embedding)
+        # Embeddings are pulled and written a batch at a time, so memory stays bounded
+        stored = 0
+        while batch := list(islice(rows, STORE_BATCH_SIZE)):
+            execute_values(cursor, """
+                INSERT INTO embeddings (content_type, content_hash, embedding) VALUES %s
+                ON CONFLICT (content_type, content_hash) WHERE content_hash IS NOT NULL DO NOTHING
+            """, batch, page_size=STORE_BATCH_SIZE)
+            stored += len(batch)
+        metrics.increment('vector_store_content_total', stored, content_type=content_type, action='stored')
+    
+    def _iter_embeddings(self, generate, items):
+        """Yield embeddings for items, generating them one batch at a time"""
+        for start in range(0, len(items), STORE_BATCH_SIZE):
+            yield from generate(items[start:start + STORE_BATCH_SIZE])
+    
+    def _content_embeddings(self, content_type, items):
+        """Yield macro or formula embeddings; formula groups share one embedding per logical formula"""
+        if content_type == 'macro':
+            return self._iter_embeddings(self.embedder.generate_macro_embeddings, items)
+        if 'ranges' in items[0]:
+            return self.embedder.iter_formula_group_embeddings(items)
+        return self._iter_embeddings(self.embedder.generate_formula_embeddings, items)
+    
+    def _copy_rows(self, cursor, table, columns, rows):
+        """Stream rows into a table with a single COPY statement"""
+        cursor.copy_expert(
+            f"COPY {table} ({', '.join(columns)}) FROM STDIN",
+            _CopySource(rows),
+            size=65536
+        )
+    
+    def _bulk_store_macros(self, cursor, euda_id, macros):
+        """Store macros and their embeddings with set-based writes"""
+        self._copy_rows(cursor, 'macros', (
+            'euda_id', 'macro_name', 'code_hash', 'purpose', 'complexity_score', 'content_hash'
+        ), (
+            (euda_id,) + _macro_values(macro) + (_macro_hash(macro),)
+            for macro in macros
+        ))
+        
+        self._store_content_embeddings(cursor, 'macro', macros)
+    
+    def _bulk_store_formulas(self, cursor, euda_id, formulas):
+        """Store formulas and their embeddings with set-based writes"""
+        self._copy_rows(cursor, 'formulas', (
+            'euda_id', 'worksheet', 'cell_reference', 'formula', 'purpose',
+            'normalized_formula', 'cell_ranges', 'cell_count', 'content_hash'
+        ), (
+            (euda_id,) + _formula_values(formula) + (_formula_hash(formula),)
+            for formula in formulas
+        ))
+        
+        self._store_content_embeddings(cursor, 'formula', formulas)
+    
+    def _apply_search_params(self, cursor, ef_search=None, probes=None, iterative_scan=None):
+        """Tune the ANN index scan for the current transaction only"""
+        if iterative_scan:
+            cursor.execute("SELECT set_config('hnsw.iterative_scan', %s, true)", (iterative_scan,))
+        if ef_search:
+            cursor.execute("SELECT set_config('hnsw.ef_search', %s, true)", (str(int(ef_search)),))
+        if probes:
+            cursor.execute("SELECT set_config('ivfflat.probes', %s, true)", (str(int(probes)),))
+    
+    def _candidate_count(self, limit):
+        """Number of index candidates fetched for re-ranking"""
+        if self.quantization == 'none':
+            return limit
+        return limit * self.rerank_factor
+    
+    def _nearest_sql(self, content_type_sql='%(content_type)s', query_sql='%(query)s::vector', filter_sql='',
+                     link_table=None):
+        """Nearest-neighbour subquery returning (euda_id, content_id, content_hash, distance)
+        
+        The inner query orders by the same expression as the partial ANN index
+        for the configured quantization, so the index serves the candidates.
+        The outer query re-ranks them by the full-precision cosine distance.
+        Filters on the EUDA are applied inside the index scan through a join
+        on eudas aliased as fe; for content-addressed embeddings some EUDA
+        linking to the content through link_table has to match them.
+        """
+        expression, _, operator = VECTOR_QUANTIZATIONS[self.quantization]
+        join_sql = "JOIN eudas fe ON fe.id = emb.euda_id" if filter_sql and not link_table else ""
+        if filter_sql and link_table:
+            filter_sql = f"""
+                  AND EXISTS (
+                      SELECT 1 FROM {link_table} l JOIN eudas fe ON fe.id = l.euda_id
+                      WHERE l.content_hash = emb.content_hash{filter_sql}
+                  )"""
+        return f"""
+            SELECT c.euda_id, c.content_id, c.content_hash, c.embedding <=> {query_sql} AS distance
+            FROM (
+                SELECT emb.euda_id, emb.content_id, emb.content_hash, emb.embedding
+                FROM embeddings emb
+                {join_sql}
+                WHERE emb.content_type = {content_type_sql}{filter_sql}
+                ORDER BY {expression.format('emb.embedding')} {operator} {expression.format(query_sql)}
+                LIMIT %(candidates)s
+            ) c
+            ORDER BY distance
+            LIMIT %(limit)s
+        """
+    
+    def _filter_sql(self, filters):
+        """Build the SQL predicate and parameters for EUDA filters
+        
+        Supported filters: has_macros, has_formulas, has_external_connections
+        (booleans), min_complexity and max_complexity (complexity score range)
+        and data_sensitivity (one value or a list of values).
+        """
+        clauses = []
+        params = {}
+        for name, value in (filters or {}).items():
+            if value is None:
+                continue
+            if name in ('has_macros', 'has_formulas', 'has_external_connections'):
+                clauses.append(f"fe.{name} = %(filter_{name})s")
+                value = bool(value)
+            elif name == 'min_complexity':
+                clauses.append("fe.complexity_score >= %(filter_min_complexity)s")
+            elif name == 'max_complexity':
+                clauses.append("fe.complexity_score <= %(filter_max_complexity)s")
+            elif name == 'data_sensitivity':
+                if isinstance(value, str):
+                    value = [value]
+                clauses.append("fe.data_sensitivity = ANY(%(filter_data_sensitivity)s)")
+                value = list(value)
+            else:
+                raise ValueError(f"Unknown search filter: {name}")
+            params[f"filter_{name}"] = value
+        
+        return ''.join(f"\n                  AND {clause}" for clause in clauses), params
+    
+    @metrics.timed('vector_search_seconds', operation='search_similar_eudas')
+    def search_similar_eudas(self, query, limit=5, ef_search=None, probes=None):
         """Search for similar EUDAs using vector similarity"""
         try:
             # Generate embedding for the query
@@ -153,21 +597,24 @@ class VectorStore:
             if not query_embedding:
                 return []
             
-            cursor = self.conn.cursor()
-            
-            # Search for similar EUDAs using vector similarity
-            cursor.execute("""
-                SELECT e.id, e.filename, e.complexity_score, e.description, e.purpose,
-                       1 - (emb.embedding <=> %s) as similarity
-                FROM eudas e
-                JOIN embeddings emb ON e.id = emb.euda_id
-                WHERE emb.content_type = 'euda'
-                ORDER BY similarity DESC
-                LIMIT %s
-            """, (query_embedding, limit))
-            
-            results = cursor.fetchall()
-            cursor.close()
+            candidates = self._candidate_count(limit)
+            with self.pool.cursor() as cursor:
+                # HNSW returns at most ef_search rows, so never ask for fewer than the candidates
+                if ef_search is None and candidates > 40:
+                    ef_search = candidates
+                self._apply_search_params(cursor, ef_search, probes)
+                
+                # Order by the raw distance operator so the partial ANN index
+                # on content_type = 'euda' can serve the nearest neighbours
+                cursor.execute(f"""
+                    SELECT e.id, e.filename, e.complexity_score, e.description, e.purpose,
+                           1 - nn.distance AS similarity
+                    FROM ({self._nearest_sql("'euda'")}) nn
+                    JOIN eudas e ON e.id = nn.euda_id
+                    ORDER BY nn.distance
+                """, {'query': _vector_literal(query_embedding), 'limit': limit, 'candidates': candidates})
+                
+                results = cursor.fetchall()
             
             # Format the results
             return [{
@@ -180,8 +627,209 @@ class VectorStore:
             } for row in results]
         except Exception as e:
             print(f"Error searching similar EUDAs: {str(e)}")
+            metrics.increment('vector_store_failures_total', operation='search_similar_eudas')
             return []
     
+    @metrics.timed('vector_search_seconds', operation='search_many')
+    def search_many(self, queries, content_type='euda', limit=5, filters=None,
+                    ef_search=None, probes=None, iterative_scan=None):
+        """Run many similarity searches in one batch of embeddings and one SQL round trip
+        
+        Returns one list of results per query, in query order. content_type
+        selects EUDAs, macros or formulas; filters restrict the owning EUDA
+        (see _filter_sql) and are evaluated by PostgreSQL during the scan.
+        iterative_scan ('strict_order' or 'relaxed_order', pgvector 0.8+)
+        lets HNSW keep scanning when filters discard candidates.
+        """
+        if content_type not in VECTOR_CONTENT_TYPES:
+            raise ValueError(f"Unknown content type: {content_type}")
+        queries = list(queries)
+        if not queries:
+            return []
+        
+        try:
+            filter_sql, params = self._filter_sql(filters)
+            
+            # Embed all queries in one concurrent batch; failed embeddings get no results
+            embeddings = self.embedder.embed_texts(queries)
+            vectors = [_vector_literal(embedding) for embedding in embeddings if embedding]
+            positions = [i for i, embedding in enumerate(embeddings) if embedding]
+            results = [[] for _ in queries]
+            if not vectors:
+                return results
+            
+            candidates = self._candidate_count(limit)
+            if ef_search is None and candidates > 40:
+                ef_search = candidates
+            params.update({
+                'queries': vectors,
+                'content_type': content_type,
+                'limit': limit,
+                'candidates': candidates
+            })
+            
+            content_columns, link_table = SEARCH_CONTENT_COLUMNS[content_type]
+            nearest_sql = self._nearest_sql(query_sql='q.query', filter_sql=filter_sql, link_table=link_table)
+            if link_table:
+                # The first row linking to each match, from an EUDA passing the filters
+                ids_sql = 'c.euda_id, c.id'
+                content_join = f"""CROSS JOIN LATERAL (
+                        SELECT c.* FROM {link_table} c JOIN eudas fe ON fe.id = c.euda_id
+                        WHERE c.content_hash = nn.content_hash{filter_sql}
+                        ORDER BY c.id LIMIT 1
+                    ) c
+                    JOIN eudas e ON e.id = c.euda_id"""
+            else:
+                ids_sql = 'nn.euda_id, nn.content_id'
+                content_join = 'JOIN eudas e ON e.id = nn.euda_id'
+
+            with self.pool.cursor() as cursor:
+                self._apply_search_params(cursor, ef_search, probes, iterative_scan)
+                
+                # One lateral nearest-neighbour scan per query vector
+                cursor.execute(f"""
+                    SELECT q.position - 1, {ids_sql}, 1 - nn.distance AS similarity,
+                           e.filename, e.complexity_score, e.description, e.purpose{content_columns}
+                    FROM unnest(%(queries)s::vector[]) WITH ORDINALITY AS q(query, position)
+                    CROSS JOIN LATERAL ({nearest_sql}) nn
+                    {content_join}
+                    ORDER BY q.position, nn.distance
+                """, params)
+                rows = cursor.fetchall()
+            
+            # Format the results
+            names = SEARCH_RESULT_FIELDS[content_type]
+            for row in rows:
+                result = {
+                    'id': row[1] if content_type == 'euda' else row[2],
+                    'euda_id': row[1],
+                    'content_type': content_type,
+                    'filename': row[4],
+                    'complexity_score': row[5],
+                    'description': row[6],
+                    'purpose': row[7],
+                    'similarity': row[3]
+                }
+                result.update(zip(names, row[8:]))
+                results[positions[row[0]]].append(result)
+            return results
+        except ValueError:
+            raise
+        except Exception as e:
+            print(f"Error running batched similarity search: {str(e)}")
+            metrics.increment('vector_store_failures_total', operation='search_many')
+            return [[] for _ in queries]
+    
+    @metrics.timed('vector_search_seconds', operation='find_macro_clones')
+    def find_macro_clones(self, code=None, code_hash=None, macro_id=None):
+        """List every EUDA containing a module, given its code, its code hash or one of its macros rows
+        
+        Returns one entry per copy of the module, ordered by EUDA.
+        """
+        if code is not None:
+            code_hash = _code_hash(code)
+        if code_hash is not None:
+            match_sql, param = "m.code_hash = %s", code_hash
+        elif macro_id is not None:
+            match_sql, param = "m.code_hash = (SELECT code_hash FROM macros WHERE id = %s)", macro_id
+        else:
+            raise ValueError("find_macro_clones needs code, code_hash or macro_id")
+        
+        try:
+            with self.pool.cursor() as cursor:
+                cursor.execute(f"""
+                    SELECT m.euda_id, e.filename, e.file_path, m.id, m.macro_name, m.code_hash
+                    FROM macros m
+                    JOIN eudas e ON e.id = m.euda_id
+                    WHERE {match_sql}
+                    ORDER BY m.euda_id, m.id
+                """, (param,))
+                rows = cursor.fetchall()
+            
+            return [{
+                'euda_id': row[0],
+                'filename': row[1],
+                'file_path': row[2],
+                'macro_id': row[3],
+                'macro_name': row[4],
+                'code_hash': row[5]
+            } for row in rows]
+        except Exception as e:
+            print(f"Error finding macro clones: {str(e)}")
+            metrics.increment('vector_store_failures_total', operation='find_macro_clones')
+            return []
+    
+    @metrics.timed('vector_search_seconds', operation='shared_macros')
+    def shared_macros(self, min_eudas=2, limit=20):
+        """List the modules found in at least min_eudas EUDAs, most widely shared first"""
+        try:
+            with self.pool.cursor() as cursor:
+                cursor.execute("""
+                    SELECT c.code_hash, array_agg(DISTINCT m.macro_name), COUNT(DISTINCT m.euda_id), COUNT(*),
+                           length(c.macro_code)
+                    FROM macros m
+                    JOIN macro_code c ON c.code_hash = m.code_hash
+                    GROUP BY c.code_hash
+                    HAVING COUNT(DISTINCT m.euda_id) >= %s
+                    ORDER BY COUNT(DISTINCT m.euda_id) DESC, COUNT(*) DESC
+                    LIMIT %s
+                """, (min_eudas, limit))
+                rows = cursor.fetchall()
+            
+            return [{
+                'code_hash': row[0],
+                'macro_names': row[1],
+                'eudas': row[2],
+                'copies': row[3],
+                'code_length': row[4]
+            } for row in rows]
+        except Exception as e:
+            print(f"Error listing shared macros: {str(e)}")
+            metrics.increment('vector_store_failures_total', operation='shared_macros')
+            return []
+    
+    def prune_content(self):
+        """Delete macro code and content embeddings no longer linked from any EUDA
+        
+        Run it while no EUDAs are being stored: a concurrent store may be
+        about to link to content it found already stored.
+        """
+        try:
+            with self.pool.cursor() as cursor:
+                cursor.execute("""
+                    DELETE FROM macro_code c
+                    WHERE NOT EXISTS (SELECT 1 FROM macros m WHERE m.code_hash = c.code_hash)
+                """)
+                pruned = {'macro_code': cursor.rowcount}
+                for content_type, (table, *_) in UPSERT_CONTENT.items():
+                    cursor.execute(f"""
+                        DELETE FROM embeddings emb
+                        WHERE emb.content_type = %s AND emb.content_hash IS NOT NULL
+                          AND NOT EXISTS (SELECT 1 FROM {table} t WHERE t.content_hash = emb.content_hash)
+                    """, (content_type,))
+                    pruned[content_type] = cursor.rowcount
+            return pruned
+        except Exception as e:
+            print(f"Error pruning stored content: {str(e)}")
+            metrics.increment('vector_store_failures_total', operation='prune_content')
+            return None
+    
     def close(self):
-        """Close the database connection"""
-        self.db.close()
\ No newline at end of file
+        """Close the database connections unless the pool is shared with other stores"""
+        if self.pool is not DatabasePool._shared:
+            self.pool.close()
+
+def vector_store_class(backend=None):
+    """The class of the configured vector store backend (postgres or local)"""
+    backend = (backend or VECTOR_STORE_BACKEND).lower()
+    if backend == 'local':
+        from embedding.local_vector_index import LocalVectorStore
+        return LocalVectorStore
+    if backend == 'postgres':
+        return VectorStore
+    raise ValueError(f"Unknown vector store backend: {backend}")
+
+
+def create_vector_store(backend=None, **kwargs):
+    """Create the configured vector store backend (postgres or local)"""
+    return vector_store_class(backend)(**kwargs)
\ No newline at end of file
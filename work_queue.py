@@ -0,0 +1,359 @@
+# core/work_queue.py
+import os
+import sys
+import json
+import time
+import signal
+import socket
+import argparse
+import threading
+import multiprocessing
+from itertools import islice
+import psycopg2
+from psycopg2.extras import execute_values
+from core.database import DatabasePool
+from core.excel_analyzer import ExcelAnalyzer
+from core.macro_extractor import MacroExtractor
+from core.workbook_reader import WorkbookReader
+from core import metrics
+from config.settings import SCAN_LEASE_SECONDS, SCAN_MAX_ATTEMPTS, SCAN_POLL_INTERVAL, SCAN_MAX_WORKERS
+
+JOB_STATUSES = ('pending', 'running', 'done', 'failed')
+
+# A failed job is retried after this many seconds, doubled with every attempt
+RETRY_BACKOFF_SECONDS = 30
+
+# Paths inserted per statement when enqueueing
+ENQUEUE_BATCH_SIZE = 1000
+
+
+def enqueue(paths, pool=None, max_attempts=None):
+    """Queue workbooks for scanning, skipping those already pending or running
+
+    Returns the number of jobs added.
+    """
+    pool = pool or DatabasePool.shared()
+    max_attempts = max_attempts or SCAN_MAX_ATTEMPTS
+    paths = iter(paths)
+    added = 0
+    while True:
+        batch = list(islice(paths, ENQUEUE_BATCH_SIZE))
+        if not batch:
+            return added
+        with pool.cursor() as cursor:
+            rows = execute_values(cursor, """
+                INSERT INTO scan_jobs (file_path, max_attempts) VALUES %s
+                ON CONFLICT (file_path) WHERE status IN ('pending', 'running') DO NOTHING
+                RETURNING id
+            """, [(path, max_attempts) for path in batch], fetch=True)
+        added += len(rows)
+
+
+def requeue_failed(pool=None):
+    """Give failed jobs a fresh set of attempts, returning how many were requeued"""
+    pool = pool or DatabasePool.shared()
+    with pool.cursor() as cursor:
+        cursor.execute("""
+            UPDATE scan_jobs SET status = 'pending', attempts = 0, available_at = now(),
+                worker_id = NULL, finished_at = NULL
+            WHERE status = 'failed'
+              AND NOT EXISTS (
+                  SELECT 1 FROM scan_jobs active
+                  WHERE active.file_path = scan_jobs.file_path AND active.status IN ('pending', 'running')
+              )
+        """)
+        return cursor.rowcount
+
+
+def queue_stats(pool=None, lease_seconds=None):
+    """Job counts by status and the throughput of every worker"""
+    pool = pool or DatabasePool.shared()
+    lease_seconds = lease_seconds or SCAN_LEASE_SECONDS
+    with pool.cursor() as cursor:
+        cursor.execute("SELECT status, COUNT(*) FROM scan_jobs GROUP BY status")
+        jobs = dict.fromkeys(JOB_STATUSES, 0)
+        jobs.update(cursor.fetchall())
+
+        cursor.execute("""
+            SELECT worker_id, hostname, pid, jobs_done, jobs_failed, busy_seconds, bytes_processed,
+                   EXTRACT(EPOCH FROM heartbeat_at - started_at),
+                   heartbeat_at > now() - %s * interval '1 second'
+            FROM scan_workers ORDER BY worker_id
+        """, (lease_seconds,))
+        workers = []
+        for (worker_id, hostname, pid, done, failed, busy, processed, uptime, alive) in cursor.fetchall():
+            uptime = float(uptime or 0)
+            workers.append({
+                'worker_id': worker_id,
+                'hostname': hostname,
+                'pid': pid,
+                'alive': alive,
+                'jobs_done': done,
+                'jobs_failed': failed,
+                'jobs_per_minute': 60 * (done + failed) / uptime if uptime else 0.0,
+                'mb_per_second': processed / 1024 / 1024 / busy if busy else 0.0,
+                'utilization': min(1.0, busy / uptime) if uptime else 0.0
+            })
+    return {'jobs': jobs, 'workers': workers}
+
+
+class QueueWorker:
+    """Claims scan jobs from the shared queue and runs the scan-and-store pipeline on each
+
+    Any number of workers on any number of hosts can share one queue. A
+    claimed job is leased to its worker, and a heartbeat thread renews the
+    lease while the job runs. A job whose worker crashed is claimed again
+    once its lease expires. Failed jobs are retried with backoff until
+    max_attempts. EUDAs are stored with upsert, so running a job twice
+    after a lost lease does not duplicate it.
+    """
+
+    def __init__(self, pool=None, store=None, worker_id=None, lease_seconds=None, poll_interval=None,
+                 max_formulas=None):
+        self.pool = pool or DatabasePool.shared()
+        self._store = store
+        self.worker_id = worker_id or f"{socket.gethostname()}:{os.getpid()}"
+        self.lease_seconds = lease_seconds or SCAN_LEASE_SECONDS
+        self.poll_interval = poll_interval if poll_interval is not None else SCAN_POLL_INTERVAL
+        self.max_formulas = max_formulas
+        self._current = None
+        self._stop = threading.Event()
+
+    @property
+    def store(self):
+        """The vector store, created on first use so workers only connect when they have work"""
+        if self._store is None:
+            from embedding.vector_store import create_vector_store
+            self._store = create_vector_store('postgres', pool=self.pool)
+        return self._store
+
+    def stop(self):
+        """Finish the current job and stop claiming new ones"""
+        self._stop.set()
+
+    def _register(self):
+        with self.pool.cursor() as cursor:
+            cursor.execute("""
+                INSERT INTO scan_workers (worker_id, hostname, pid) VALUES (%s, %s, %s)
+                ON CONFLICT (worker_id) DO UPDATE SET
+                    hostname = EXCLUDED.hostname, pid = EXCLUDED.pid, started_at = now(), heartbeat_at = now(),
+                    jobs_done = 0, jobs_failed = 0, busy_seconds = 0, bytes_processed = 0
+            """, (self.worker_id, socket.gethostname(), os.getpid()))
+
+    def claim(self):
+        """Lease the next available job, returning (id, file_path) or None when the queue is empty"""
+        with self.pool.cursor() as cursor:
+            # Jobs whose lease ran out on their last attempt are given up
+            cursor.execute("""
+                UPDATE scan_jobs SET status = 'failed', finished_at = now(),
+                    error = COALESCE(error || '; ', '') || 'lease expired after ' || attempts || ' attempts'
+                WHERE id IN (
+                    SELECT id FROM scan_jobs
+                    WHERE status = 'running' AND lease_expires_at < now() AND attempts >= max_attempts
+                    FOR UPDATE SKIP LOCKED
+                )
+            """)
+            # Pending jobs first, then jobs whose worker stopped renewing the lease
+            cursor.execute("""
+                UPDATE scan_jobs SET status = 'running', worker_id = %(worker)s, attempts = attempts + 1,
+                    started_at = now(), heartbeat_at = now(),
+                    lease_expires_at = now() + %(lease)s * interval '1 second'
+                WHERE id = (
+                    SELECT id FROM scan_jobs
+                    WHERE (status = 'pending' AND available_at <= now())
+                       OR (status = 'running' AND lease_expires_at < now())
+                    ORDER BY status, available_at, id
+                    LIMIT 1
+                    FOR UPDATE SKIP LOCKED
+                )
+                RETURNING id, file_path
+            """, {'worker': self.worker_id, 'lease': self.lease_seconds})
+            return cursor.fetchone()
+
+    def _heartbeat(self):
+        """Renew the lease of the current job and the worker's liveness until stopped"""
+        interval = max(1.0, self.lease_seconds / 3)
+        while not self._stop.wait(interval):
+            job_id = self._current
+            try:
+                with self.pool.cursor() as cursor:
+                    cursor.execute("UPDATE scan_workers SET heartbeat_at = now() WHERE worker_id = %s",
+                                   (self.worker_id,))
+                    if job_id is not None:
+                        cursor.execute("""
+                            UPDATE scan_jobs SET heartbeat_at = now(),
+                                lease_expires_at = now() + %s * interval '1 second'
+                            WHERE id = %s AND worker_id = %s AND status = 'running'
+                        """, (self.lease_seconds, job_id, self.worker_id))
+            except psycopg2.Error as e:
+                print(f"Error renewing lease: {str(e)}")
+
+    def _scan_and_store(self, file_path):
+        """Analyze a workbook and its macros through one reader and upsert it into the vector store"""
+        with WorkbookReader(file_path) as reader:
+            analyzer = ExcelAnalyzer(file_path, max_formulas=self.max_formulas, reader=reader)
+            if not analyzer.analyze():
+                raise RuntimeError(analyzer.error)
+            euda_info = analyzer.get_summary()
+            euda_info['formula_groups'] = analyzer.formula_groups
+            # Formulas are stored and embedded as groups when there are any
+            if not analyzer.formula_groups:
+                euda_info['formulas'] = analyzer.formulas
+            euda_info['macros'] = []
+
+            if analyzer.has_macros:
+                extractor = MacroExtractor(file_path, reader=reader)
+                if extractor.extract_macros():
+                    euda_info['macros'] = extractor.analyze_macros()
+
+        euda_id = self.store.store_euda(euda_info, upsert=True)
+        if euda_id is None:
+            raise RuntimeError("Failed to store EUDA")
+        return euda_id
+
+    def process(self, job_id, file_path):
+        """Run one claimed job and record its outcome; returns True if it succeeded"""
+        self._current = job_id
+        started = time.perf_counter()
+        euda_id = None
+        error = None
+        try:
+            euda_id = self._scan_and_store(file_path)
+        except Exception as e:
+            error = f"Error scanning file: {str(e)}"
+        finally:
+            self._current = None
+        elapsed = time.perf_counter() - started
+        try:
+            size = os.path.getsize(file_path)
+        except OSError:
+            size = 0
+
+        with self.pool.cursor() as cursor:
+            if error is None:
+                cursor.execute("""
+                    UPDATE scan_jobs SET status = 'done', finished_at = now(), lease_expires_at = NULL,
+                        euda_id = %s, error = NULL, elapsed = %s
+                    WHERE id = %s AND worker_id = %s AND status = 'running'
+                """, (euda_id, elapsed, job_id, self.worker_id))
+            else:
+                cursor.execute("""
+                    UPDATE scan_jobs SET
+                        status = CASE WHEN attempts < max_attempts THEN 'pending' ELSE 'failed' END,
+                        finished_at = CASE WHEN attempts < max_attempts THEN NULL ELSE now() END,
+                        available_at = now() + %s * power(2, attempts - 1) * interval '1 second',
+                        lease_expires_at = NULL, error = %s, elapsed = %s
+                    WHERE id = %s AND worker_id = %s AND status = 'running'
+                """, (RETRY_BACKOFF_SECONDS, error, elapsed, job_id, self.worker_id))
+            if cursor.rowcount == 0:
+                # The lease expired and another worker took the job over
+                print(f"Lease on scan job {job_id} was lost; leaving its outcome to the new owner")
+            cursor.execute("""
+                UPDATE scan_workers SET jobs_done = jobs_done + %s, jobs_failed = jobs_failed + %s,
+                    busy_seconds = busy_seconds + %s, bytes_processed = bytes_processed + %s,
+                    heartbeat_at = now()
+                WHERE worker_id = %s
+            """, (int(error is None), int(error is not None), elapsed, size, self.worker_id))
+
+        if error:
+            print(f"{file_path}: {error}")
+        metrics.increment('work_queue_jobs_total', status='done' if error is None else 'failed')
+        return error is None
+
+    def run(self, max_jobs=None, exit_when_idle=False):
+        """Claim and process jobs until stopped, returning the number of jobs processed"""
+        self._stop.clear()
+        self._register()
+        heartbeat = threading.Thread(target=self._heartbeat, name='scan-lease-heartbeat', daemon=True)
+        heartbeat.start()
+
+        processed = 0
+        try:
+            while not self._stop.is_set() and (max_jobs is None or processed < max_jobs):
+                try:
+                    job = self.claim()
+                except psycopg2.Error as e:
+                    print(f"Error claiming scan job: {str(e)}")
+                    self._stop.wait(self.poll_interval)
+                    continue
+
+                if job is None:
+                    if exit_when_idle:
+                        break
+                    self._stop.wait(self.poll_interval)
+                    continue
+
+                self.process(*job)
+                processed += 1
+        finally:
+            self._stop.set()
+            heartbeat.join()
+        return processed
+
+
+def _run_worker(options):
+    """Entry point of one worker process"""
+    worker = QueueWorker(lease_seconds=options['lease_seconds'], max_formulas=options['max_formulas'])
+    # Finish the job in hand on SIGTERM; the lease covers a hard kill
+    signal.signal(signal.SIGTERM, lambda signum, frame: worker.stop())
+    try:
+        worker.run(max_jobs=options['max_jobs'], exit_when_idle=options['exit_when_idle'])
+    except KeyboardInterrupt:
+        pass
+
+
+def main(argv=None):
+    """Command line entry point for the distributed scan queue"""
+    parser = argparse.ArgumentParser(description="Distributed EUDA scanning through a PostgreSQL work queue")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    enqueue_parser = commands.add_parser('enqueue', help="Queue the workbooks of a directory tree or manifest")
+    enqueue_parser.add_argument('source', help="Directory tree to walk or manifest file with one path per line")
+    enqueue_parser.add_argument('--max-attempts', type=int, default=None, help="Attempts per job before it fails")
+
+    work_parser = commands.add_parser('work', help="Claim and scan queued workbooks")
+    work_parser.add_argument('--processes', type=int, default=None, help="Worker processes on this host")
+    work_parser.add_argument('--max-jobs', type=int, default=None, help="Stop each worker after this many jobs")
+    work_parser.add_argument('--exit-when-idle', action='store_true', help="Stop when no job is available")
+    work_parser.add_argument('--lease', type=int, default=None, help="Job lease in seconds")
+    work_parser.add_argument('--max-formulas', type=int, default=None,
+                             help="Keep at most this many formula records per workbook (a uniform sample)")
+
+    commands.add_parser('stats', help="Print job counts and worker throughput as JSON")
+    commands.add_parser('requeue-failed', help="Retry jobs that ran out of attempts")
+    args = parser.parse_args(argv)
+
+    if args.command == 'enqueue':
+        from core.batch_scanner import PortfolioScanner
+        added = enqueue(PortfolioScanner(max_workers=1).discover(args.source), max_attempts=args.max_attempts)
+        print(f"Queued {added} workbooks", file=sys.stderr)
+    elif args.command == 'stats':
+        print(json.dumps(queue_stats(), indent=2, default=str))
+    elif args.command == 'requeue-failed':
+        print(f"Requeued {requeue_failed()} failed jobs", file=sys.stderr)
+    else:
+        options = {
+            'lease_seconds': args.lease,
+            'max_formulas': args.max_formulas,
+            'max_jobs': args.max_jobs,
+            'exit_when_idle': args.exit_when_idle
+        }
+        processes = args.processes or SCAN_MAX_WORKERS
+        # Spawned workers open their own database connections
+        context = multiprocessing.get_context('spawn')
+        workers = [context.Process(target=_run_worker, args=(options,)) for _ in range(processes)]
+        for worker in workers:
+            worker.start()
+        try:
+            for worker in workers:
+                worker.join()
+        except KeyboardInterrupt:
+            for worker in workers:
+                worker.terminate()
+            for worker in workers:
+                worker.join()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
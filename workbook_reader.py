@@ -0,0 +1,152 @@
+# core/workbook_reader.py
+import io
+import os
+import mmap
+import zipfile
+import xml.etree.ElementTree as ET
+from collections import OrderedDict
+
+# Parsed XML parts kept per reader; workbook.xml and the .rels parts are
+# small and read by several scanners, worksheets are streamed instead
+PART_CACHE_SIZE = 64
+
+
+class _MappedFile(io.RawIOBase):
+    """Seekable read-only file object over a memory map"""
+
+    def __init__(self, buffer):
+        self._buffer = buffer
+        self._position = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self._position
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self._position
+        elif whence == io.SEEK_END:
+            offset += len(self._buffer)
+        self._position = max(0, offset)
+        return self._position
+
+    def read(self, size=-1):
+        end = len(self._buffer) if size is None or size < 0 else self._position + size
+        data = self._buffer[self._position:end]
+        self._position += len(data)
+        return data
+
+    def readinto(self, b):
+        data = self.read(len(b))
+        b[:len(data)] = data
+        return len(data)
+
+
+class WorkbookReader:
+    """A workbook package opened once and shared by every scanner
+
+    The file is memory-mapped and the zip central directory is indexed
+    when the reader is first used; ExcelAnalyzer and MacroExtractor read
+    their parts through the same reader, so a scan reads each workbook
+    from disk once. The reader can be passed wherever a ZipFile is
+    expected (namelist, open, read) and also caches parsed XML parts.
+    """
+
+    def __init__(self, file_path, cache_size=PART_CACHE_SIZE):
+        self.file_path = file_path
+        self.cache_size = cache_size
+        self._file = None
+        self._buffer = None
+        self._zip = None
+        self._names = None
+        self._name_set = None
+        self._parts = OrderedDict()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    @property
+    def zip_file(self):
+        """The ZipFile over the mapped file, opened on first use"""
+        self._ensure_open()
+        return self._zip
+
+    def _ensure_open(self):
+        if self._zip is not None:
+            return
+        self._file = open(self.file_path, 'rb')
+        try:
+            if os.fstat(self._file.fileno()).st_size == 0:
+                raise zipfile.BadZipFile("File is empty")
+            self._buffer = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+            self._zip = zipfile.ZipFile(_MappedFile(self._buffer), 'r')
+        except Exception:
+            self.close()
+            raise
+        # Index the central directory once instead of on every lookup
+        self._names = self._zip.namelist()
+        self._name_set = frozenset(self._names)
+
+    def namelist(self):
+        """Part names in package order; the list is shared, do not modify it"""
+        self._ensure_open()
+        return self._names
+
+    def has_part(self, name):
+        self._ensure_open()
+        return name in self._name_set
+
+    def open(self, name):
+        return self.zip_file.open(name)
+
+    def read(self, name):
+        return self.zip_file.read(name)
+
+    def read_xml(self, name):
+        """Parse an XML part, served from the cache when it was parsed before"""
+        root = self._parts.get(name)
+        if root is not None:
+            self._parts.move_to_end(name)
+            return root
+        with self.open(name) as f:
+            root = ET.parse(f).getroot()
+        self._parts[name] = root
+        if len(self._parts) > self.cache_size:
+            self._parts.popitem(last=False)
+        return root
+
+    def stream(self):
+        """A separate file object over the mapped workbook, e.g. for openpyxl
+
+        It is only valid while the reader is open.
+        """
+        self._ensure_open()
+        return _MappedFile(self._buffer)
+
+    def close(self):
+        self._parts.clear()
+        if self._zip is not None:
+            self._zip.close()
+            self._zip = None
+        if self._buffer is not None:
+            self._buffer.close()
+            self._buffer = None
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+def read_part_xml(package, name):
+    """Parse an XML part of an open WorkbookReader or ZipFile"""
+    if isinstance(package, WorkbookReader):
+        return package.read_xml(name)
+    with package.open(name) as f:
+        return ET.parse(f).getroot()